@@ -0,0 +1,188 @@
+"""
+Benchmarks of the resolution engine, written against `KBMan`.
+
+    python -m benchmarks.bench [--quick] [--repeat N] [--only NAME] [-o FILE]
+
+Each benchmark is run for a few problem sizes. For each, the best time
+of `repeat` runs is reported along with the number of inferences
+(predicate calls, counted in a separate profiled run), the inferences
+per second (LIPS) and the peak memory allocated by a traced run. The
+results are printed as JSON, to be compared between releases.
+"""
+
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from pryo import KBMan, TermCnpd, scm
+from pryo.pryo import query_goal
+
+
+Cons = lambda car, cdr: TermCnpd('Cons', car, cdr)
+NIL = None
+
+x, y, z, w = scm('xyzw')
+xs, ys, zs, t = scm('xs ys zs t'.split())
+
+
+def cons_list(items):
+    l = NIL
+    for i in reversed(items):
+        l = Cons(i, l)
+    return l
+
+
+def with_lists(k):
+    k.append[NIL, ys, ys]
+    k.append[Cons(x, xs), ys, Cons(x, zs)] = k.append(xs, ys, zs)
+
+
+# Each benchmark takes a size and gives a KBMan and its queries as
+# (verb, args) pairs, '$name' strings standing for Var's.
+
+def nrev(n):
+    "Naive reverse of a list of `n`, the classic LIPS measure."
+    k = KBMan()
+    with_lists(k)
+    k.nrev[NIL, NIL]
+    k.nrev[Cons(x, xs), ys] = [k.nrev(xs, zs),
+                               k.append(zs, Cons(x, NIL), ys)]
+    return k, [('nrev', (cons_list(list(range(n))), '$r'))] * 10
+
+
+def queens(n):
+    "All placements of `n` queens, by selecting safe columns row by row."
+    k = KBMan()
+    q, q1, d, qs, r, safe = scm('q q1 d qs r safe'.split())
+    k.select[x, Cons(x, t), t]
+    k.select[x, Cons(y, t), Cons(y, r)] = k.select(x, t, r)
+    k.noattack[q, NIL, d]
+    k.noattack[q, Cons(q1, qs), d] = [
+        q1 - q != d,
+        q - q1 != d,
+        k.noattack(q, qs, d + 1)]
+    k.place[NIL, safe, safe]
+    k.place[xs, safe, qs] = [
+        k.select(q, xs, r),
+        k.noattack(q, safe, 1),
+        k.place(r, Cons(q, safe), qs)]
+    return k, [('place', (cons_list(list(range(1, n + 1))), NIL, '$qs'))]
+
+
+def closure(n):
+    "All ancestors in a random forest of `n` people."
+    k = KBMan()
+    rnd = random.Random(n)
+    k.father.load([(rnd.randrange(i), i) for i in range(1, n)])
+    k.ancester[x, y] = k.father(x, y)
+    k.ancester[x, y] = [k.father(x, z), k.ancester(z, y)]
+    return k, [('ancester', ('$x', '$y'))]
+
+
+def depth(n):
+    "Deterministic recursion `n` calls deep."
+    k = KBMan()
+    with_lists(k)
+    k.factorial[0, 1]
+    k.factorial[x, y] = [x > 0, k.factorial(x - 1, z), y == x * z]
+    l = cons_list(list(range(n)))
+    return k, [('factorial', (n, '$f')), ('append', (l, l, '$l'))]
+
+
+def lookup(n):
+    "Lookups of single facts among `n` loaded ones, by either column."
+    k = KBMan()
+    rnd = random.Random(n)
+    k.owns.load([('p{}'.format(i), 'item{}'.format(i * 7 % n))
+                 for i in range(n)])
+    keys = [rnd.randrange(n) for _ in range(1000)]
+    return k, ([('owns', ('p{}'.format(i), '$o')) for i in keys] +
+               [('owns', ('$p', 'item{}'.format(i))) for i in keys])
+
+
+BENCHMARKS = [
+    (nrev, [30, 60]),
+    (queens, [5, 6]),
+    (closure, [1000, 4000]),
+    (depth, [50, 100]),
+    (lookup, [10000, 100000]),
+]
+
+
+def run(k, queries):
+    n = 0
+    for verb, args in queries:
+        for _ in k.kb.ask(query_goal(verb, args)):
+            n += 1
+    return n
+
+
+def measure(bench, size, repeat):
+    k, queries = bench(size)
+    answers = run(k, queries)   # warms up indexes
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        run(k, queries)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    with k.kb.profile() as prof:
+        run(k, queries)
+    inferences = sum(st['call'] for st in prof.preds.values())
+    gc.collect()
+    tracemalloc.start()
+    run(k, queries)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'benchmark': bench.__name__,
+        'size': size,
+        'answers': answers,
+        'seconds': best,
+        'inferences': inferences,
+        'lips': inferences / best if best else None,
+        'peak_bytes': peak,
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--quick', action='store_true',
+                    help='run the smallest size of each benchmark once')
+    ap.add_argument('--only', action='append',
+                    help='run the benchmark of this name (repeatable)')
+    ap.add_argument('-o', '--output', help='write the JSON here')
+    args = ap.parse_args(argv)
+    results = []
+    for bench, sizes in BENCHMARKS:
+        if args.only and bench.__name__ not in args.only:
+            continue
+        for size in sizes[:1] if args.quick else sizes:
+            r = measure(bench, size, 1 if args.quick else args.repeat)
+            print('{benchmark:>10} {size:>7} {seconds:9.4f}s '
+                  '{lips:12.0f} LIPS {peak_bytes:>11} B'.format(**r),
+                  file=sys.stderr)
+            results.append(r)
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out + '\n')
+    else:
+        print(out)
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,3 @@
 from .pryo import *
+from .datalog import Datalog
+from .solver import Solver, aask
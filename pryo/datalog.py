@@ -0,0 +1,456 @@
+# Bottom-up evaluation for Datalog-shaped knowledge bases.
+#
+# A Datalog program here is a `KB` whose facts are ground constants
+# and whose rules are function-free definite clauses:
+#
+# Rule     : Pred <= Body
+# Body     : Atom & Body | Atom
+# Atom     : Pred Arg* | Arg != Arg | Assert Func
+# Arg      : ScmVar | Const
+#
+# All relations get materialized by semi-naive fix point iteration and
+# every rule body is executed set-at-a-time as a series of hash joins.
+
+from collections import Counter
+
+from .pryo import (Sen, Rule, Pred, And, Eq, NotEq, Term, Func, Var,
+                   ScmVar, conjuncts)
+
+
+SEED = '-SEED-'
+
+
+def is_const(t):
+    "Test whether `t` is a constant usable as a hash key."
+    if isinstance(t, (Term, Sen, list, tuple)):
+        return False
+    try:
+        hash(t)
+    except TypeError:
+        return False
+    return True
+
+
+def index_rows(rows, positions):
+    "Hash `rows` by their values at `positions`."
+    idx = {}
+    for row in rows:
+        idx.setdefault(tuple(row[p] for p in positions), []).append(row)
+    return idx
+
+
+class Plan(object):
+
+    """Compiled rule as a sequence of join steps.
+
+    Each body predicate becomes a step probing its relation by the
+    constants and already bound variables among its arguments. The
+    `NotEq` and `Assert` filters run as soon as their variables are
+    bound, but never before the predicates preceding them. Raises
+    `ValueError` on a rule it cannot handle.
+
+    """
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.head = rule.lhs.verb
+        self._seeded = None
+        self._deltas = {}
+        self.steps = []
+        slots = {}
+        filters = []
+        for sen in conjuncts(rule.rhs):
+            if isinstance(sen, Pred):
+                self.steps.append(self.step(sen, slots))
+            elif isinstance(sen, NotEq):
+                filters.append((sen, len(self.steps)))
+            elif (isinstance(sen, Eq) and sen.subs[0] is True and
+                  isinstance(sen.subs[1], Func)):
+                filters.append((sen, len(self.steps)))
+            else:
+                raise ValueError('unsupported sentence {}'.format(sen))
+        if not self.steps:
+            raise ValueError('no body predicate')
+        # Attach each filter to the step binding its variables.
+        for sen, after in filters:
+            marks = set(self.marks(sen))
+            if not marks <= set(slots):
+                raise ValueError('unsafe variables in {}'.format(sen))
+            last = max(slots[m] for m in marks) if marks else -1
+            for i, step in enumerate(self.steps):
+                if i + 1 >= after and step[-1] > last:
+                    break
+            step[-2].append(self.compile(sen, slots))
+        self.out = []
+        for t in rule.lhs.terms:
+            if isinstance(t, ScmVar):
+                if t._mark not in slots:
+                    raise ValueError('unsafe head variable {}'.format(t))
+                self.out.append((True, slots[t._mark]))
+            elif is_const(t):
+                self.out.append((False, t))
+            else:
+                raise ValueError('unsupported head argument {}'.format(t))
+
+    def __repr__(self):
+        return 'Plan({})'.format(self.rule)
+
+    @property
+    def seeded(self):
+        """The plan preceded by a step reading candidate head rows, used
+        for checking which of them are still derivable.
+
+        """
+        if self._seeded is None:
+            head = self.rule.lhs
+            self._seeded = Plan(Rule(head, And(Pred(SEED, *head.terms),
+                                               self.rule.rhs)))
+        return self._seeded
+
+    def delta(self, i):
+        """The plan starting with its `i`-th body predicate, used for
+        joining a few delta rows against full relations.
+
+        """
+        if i not in self._deltas:
+            body = conjuncts(self.rule.rhs)
+            atoms = [j for j, sen in enumerate(body) if isinstance(sen, Pred)]
+            first = body.pop(atoms[i])
+            rhs = first
+            for sen in body:
+                rhs = And(rhs, sen)
+            self._deltas[i] = Plan(Rule(self.rule.lhs, rhs))
+        return self._deltas[i]
+
+    @property
+    def verbs(self):
+        return [step[0] for step in self.steps]
+
+    @staticmethod
+    def step(sen, slots):
+        """Compile a body predicate into `(verb, keys, news, eqs,
+        filters, width)`, where `keys` tells how to get the probing key,
+        `news` are positions binding fresh variables and `eqs` are pairs
+        of positions sharing a fresh variable.
+
+        """
+        keys = []
+        news = []
+        eqs = []
+        fresh = {}
+        for pos, t in enumerate(sen.terms):
+            if isinstance(t, ScmVar):
+                m = t._mark
+                if m in fresh:
+                    eqs.append((fresh[m], pos))
+                elif m in slots:
+                    keys.append((pos, True, slots[m]))
+                else:
+                    slots[m] = len(slots)
+                    fresh[m] = pos
+                    news.append(pos)
+            elif is_const(t):
+                keys.append((pos, False, t))
+            else:
+                raise ValueError('unsupported argument {}'.format(t))
+        return (sen.verb, keys, news, eqs, [], len(slots))
+
+    @classmethod
+    def marks(cls, x):
+        if isinstance(x, ScmVar):
+            yield x._mark
+        elif isinstance(x, Func):
+            for a in x.args:
+                yield from cls.marks(a)
+        elif isinstance(x, Sen):
+            for a in x.subs:
+                yield from cls.marks(a)
+
+    @classmethod
+    def value(cls, t, slots):
+        "Compile term `t` into a getter upon a row."
+        if isinstance(t, ScmVar):
+            i = slots[t._mark]
+            return lambda row: row[i]
+        elif isinstance(t, Func):
+            f = t.op
+            args = [cls.value(a, slots) for a in t.args]
+            return lambda row: f(*(a(row) for a in args))
+        elif isinstance(t, (Term, Sen)):
+            raise ValueError('unsupported term {}'.format(t))
+        else:
+            return lambda row: t
+
+    @classmethod
+    def compile(cls, sen, slots):
+        "Compile a filter sentence into a predicate upon a row."
+        if isinstance(sen, NotEq):
+            a, b = (cls.value(t, slots) for t in sen.subs)
+            return lambda row: a(row) != b(row)
+        else:
+            f = cls.value(sen.subs[1], slots)
+            return lambda row: f(row) is True
+
+    def run(self, dl, delta_at=None, delta=()):
+        """Evaluate the rule body with full relations from `dl`, except
+        that the step at `delta_at` reads rows from `delta` only.
+
+        """
+        if delta_at:
+            return self.delta(delta_at).run(dl, 0, delta)
+        rows = [()]
+        for i, (verb, keys, news, eqs, filters, _) in enumerate(self.steps):
+            positions = tuple(k[0] for k in keys)
+            if i == delta_at:
+                idx = index_rows(delta, positions)
+            else:
+                idx = dl.index(verb, positions)
+            out = []
+            for row in rows:
+                key = tuple(row[v] if bound else v for _, bound, v in keys)
+                for fact in idx.get(key, ()):
+                    if all(fact[a] == fact[b] for a, b in eqs):
+                        out.append(row + tuple(fact[p] for p in news))
+            rows = [r for r in out if all(f(r) for f in filters)]
+            if not rows:
+                break
+        return [tuple(row[v] if var else v for var, v in self.out)
+                for row in rows]
+
+
+class Datalog(object):
+
+    """Bottom-up engine materializing all relations of a `KB`.
+
+    Facts and rules are read from `kb.base`. Rules which cannot be
+    handled are reported in `unsupported` as `(rule, reason)` pairs;
+    their predicates and all predicates depending on them are kept in
+    `excluded` and still queried top-down by `kb.ask`.
+
+    The engine watches `kb` and maintains the relations incrementally:
+    told sentences only propagate their new rows, while retracted ones
+    are handled by delete-and-rederive (DRed).
+
+    .. code-block:: python
+
+        dl = Datalog(k.kb)
+        dl.ask(Pred('ancester', Var('x'), 'Lucy'))
+
+    """
+
+    def __init__(self, kb):
+        self.kb = kb
+        self.materialize()
+        kb.watchers.append(self)
+
+    def detach(self):
+        "Stop maintaining the relations upon changes of the KB."
+        self.kb.watchers.remove(self)
+
+    def __repr__(self):
+        return 'Datalog({})'.format(
+            {verb: len(rows) for verb, rows in self.rels.items()})
+
+    def materialize(self):
+        "(Re)compute all relations from scratch."
+        self.rels = {}          # verb -> {row}
+        self.indexes = {}       # verb -> {positions -> {key -> [row]}}
+        self.plans = []
+        self.unsupported = []
+        self.facts = {}         # verb -> Counter of told rows
+        bad = set()
+        facts = self.facts
+        for verb, proc in self.kb.base.items():
+            rows = facts.setdefault(verb, Counter())
+            if proc.facts is not None:
+                rows.update(proc.facts.rows())
+            for sen in proc.clauses.values():
+                if isinstance(sen, Rule):
+                    try:
+                        self.plans.append(Plan(sen))
+                    except ValueError as e:
+                        self.unsupported.append((sen, str(e)))
+                        bad.add(verb)
+                elif all(is_const(t) for t in sen.terms):
+                    rows[tuple(sen.terms)] += 1
+                else:
+                    self.unsupported.append((sen, 'non-ground fact'))
+                    bad.add(verb)
+        # Predicates depending on unsupported ones are excluded too.
+        self.excluded = set(bad)
+        while True:
+            more = {p.head for p in self.plans
+                    if p.head not in self.excluded and
+                    self.excluded.intersection(p.verbs)}
+            if not more:
+                break
+            self.excluded |= more
+        self.plans = [p for p in self.plans if p.head not in self.excluded]
+        for verb, rows in facts.items():
+            if verb not in self.excluded:
+                self.rels[verb] = set(rows)
+        self.propagate({verb: rows for verb, rows in self.rels.items()
+                        if rows})
+
+    def index(self, verb, positions):
+        "Hash index of relation `verb` upon `positions`, kept up to date."
+        idxs = self.indexes.setdefault(verb, {})
+        if positions not in idxs:
+            idxs[positions] = index_rows(self.rels.get(verb, ()), positions)
+        return idxs[positions]
+
+    def add_rows(self, verb, rows):
+        self.rels.setdefault(verb, set()).update(rows)
+        for positions, idx in self.indexes.get(verb, {}).items():
+            for row in rows:
+                idx.setdefault(tuple(row[p] for p in positions),
+                               []).append(row)
+
+    def remove_rows(self, verb, rows):
+        self.rels[verb].difference_update(rows)
+        for positions, idx in self.indexes.get(verb, {}).items():
+            for row in rows:
+                key = tuple(row[p] for p in positions)
+                idx[key].remove(row)
+                if not idx[key]:
+                    del idx[key]
+
+    def propagate(self, delta):
+        """Semi-naive iteration: derive from the rows in `delta`, which
+        are already in the relations, until no new rows arise.
+
+        """
+        while delta:
+            new = {}
+            for plan in self.plans:
+                have = self.rels.get(plan.head, ())
+                for i, verb in enumerate(plan.verbs):
+                    if delta.get(verb):
+                        for row in plan.run(self, i, delta[verb]):
+                            if row not in have:
+                                new.setdefault(plan.head, set()).add(row)
+            for verb, rows in new.items():
+                self.add_rows(verb, rows)
+            delta = new
+
+    # Maintenance
+
+    def told(self, sen):
+        "Propagate the rows newly derivable from `sen`."
+        verb = sen.key
+        if verb in self.excluded:
+            return
+        if isinstance(sen, Rule):
+            try:
+                plan = Plan(sen)
+            except ValueError:
+                return self.materialize()
+            if self.excluded.intersection(plan.verbs):
+                return self.materialize()
+            self.plans.append(plan)
+            rows = set(plan.run(self))
+        elif all(is_const(t) for t in sen.terms):
+            row = tuple(sen.terms)
+            self.facts.setdefault(verb, Counter())[row] += 1
+            rows = {row}
+        else:
+            return self.materialize()
+        rows.difference_update(self.rels.get(verb, ()))
+        if rows:
+            self.add_rows(verb, rows)
+            self.propagate({verb: rows})
+
+    def loaded(self, verb, rows):
+        "Propagate the rows newly loaded as facts of `verb`."
+        if verb in self.excluded:
+            return
+        facts = self.facts.setdefault(verb, Counter())
+        facts.update(rows)
+        rows = set(rows).difference(self.rels.get(verb, ()))
+        if rows:
+            self.add_rows(verb, rows)
+            self.propagate({verb: rows})
+
+    def retracted(self, sen):
+        """Delete the rows no more derivable without `sen` by DRed:
+        first delete every row derived from what `sen` supported, then
+        rederive those rows having an alternative derivation.
+
+        """
+        verb = sen.key
+        if any(s is sen for s, _ in self.unsupported):
+            return self.materialize()
+        if verb in self.excluded:
+            return
+        if isinstance(sen, Rule):
+            plan = next(p for p in self.plans if p.rule is sen)
+            self.plans.remove(plan)
+            rows = set(plan.run(self))
+        else:
+            row = tuple(sen.terms)
+            facts = self.facts[verb]
+            facts[row] -= 1
+            if facts[row] > 0:
+                return
+            del facts[row]
+            rows = {row}
+        rows.intersection_update(self.rels.get(verb, ()))
+        # Over-delete upon the relations before deletion.
+        gone = {verb: rows}
+        delta = gone
+        while delta:
+            new = {}
+            for plan in self.plans:
+                have = self.rels.get(plan.head, ())
+                lost = gone.get(plan.head, ())
+                for i, v in enumerate(plan.verbs):
+                    if delta.get(v):
+                        for row in plan.run(self, i, delta[v]):
+                            if row in have and row not in lost:
+                                new.setdefault(plan.head, set()).add(row)
+            for v, rows in new.items():
+                gone.setdefault(v, set()).update(rows)
+            delta = new
+        for v, rows in gone.items():
+            self.remove_rows(v, rows)
+        # Rederive rows still told as facts or derivable in one step.
+        back = {}
+        for v, rows in gone.items():
+            facts = self.facts.get(v, {})
+            back[v] = {row for row in rows if row in facts}
+        for plan in self.plans:
+            if gone.get(plan.head):
+                back[plan.head].update(
+                    plan.seeded.run(self, 0, gone[plan.head]))
+        back = {v: rows for v, rows in back.items() if rows}
+        for v, rows in back.items():
+            self.add_rows(v, rows)
+        self.propagate(back)
+
+    def ask(self, goal):
+        """Query materialized relations in the form of :KB.ask:. Goals
+        upon excluded predicates are delegated to :KB.ask:.
+
+        """
+        terms = goal.terms
+        if goal.key in self.excluded or not all(
+                isinstance(t, Var) or is_const(t) for t in terms):
+            yield from self.kb.ask(goal)
+            return
+        if goal.key not in self.kb.base:
+            raise KeyError(goal.key)
+        positions = tuple(i for i, t in enumerate(terms)
+                          if not isinstance(t, Var))
+        if positions:
+            key = tuple(terms[i] for i in positions)
+            rows = self.index(goal.key, positions).get(key, ())
+        else:
+            rows = self.rels.get(goal.key, ())
+        for row in rows:
+            u = {}
+            for t, v in zip(terms, row):
+                if isinstance(t, Var):
+                    if u.setdefault(t, v) != v:
+                        break
+            else:
+                yield u
@@ -16,15 +16,26 @@
 # Term     : TermFunc | TermCnpd | Const | Var | ScmVar
 # TermFunc : FUNC FUNCOP Term*
 # TermCnpd : DATA CONSTR Term* | List
-# List     : NIL | CONS Term List
+# List     : NIL | CONS Term List | TermList
+# TermList : [Term+ | List]
 # Const    : NUMBER | STRING | BOOLEAN
 # Var      : VARSYMBOL
 # ScmVar   : SCMSYMBOL
 
+import csv
+import multiprocessing as mp
 import operator as op
+import pickle
+import sys
+import threading
+import time
+from array import array
+from mmap import mmap as mapfile, ACCESS_READ
+from heapq import merge
 from pprint import pformat
-from itertools import count
+from itertools import count, islice
 from collections import OrderedDict as odict
+from functools import wraps
 
 
 # === FOL-Structures ===
@@ -33,6 +44,9 @@ class Sen(object):
 
     def __init__(self, *subs):
         self.subs = subs
+        # Whether no Var, ScmVar or Func occurs within. Sentences are
+        # not changed once built, but for a `Pred` called again.
+        self.ground = all(map(is_ground, subs))
 
     def __and__(self, other):
         return And(self, other)
@@ -69,6 +83,15 @@ class Rule(Sen):
     def __repr__(self):
         return '({} :- {}.)'.format(self.lhs, self.rhs)
 
+    @property
+    def cuts(self):
+        "Whether the body holds a cut committing calls to this rule."
+        try:
+            return self._cuts
+        except AttributeError:
+            self._cuts = next(body_cuts(self.rhs), None) is not None
+            return self._cuts
+
     @property
     def lhs(self): return self.subs[0]
 
@@ -84,6 +107,68 @@ class SenAtom(Sen):
     pass
 
 
+class Cut(SenAtom):
+
+    """The cut `!` succeeds once, committing the rule call it is in to
+    the current clause and to the answers of the conjuncts before it.
+
+    Each call to the rule renames its body, giving its cuts the
+    `barrier` of that call.
+
+    """
+
+    barrier = None
+
+    def __init__(self):
+        self.subs = ()
+        # Never shared between calls.
+        self.ground = False
+
+    def __repr__(self):
+        return '!'
+
+
+cut = Cut()
+
+
+def body_cuts(sen):
+    "Cuts of rule body `sen`, but those local to a `Not`."
+    if type(sen) is Cut:
+        yield sen
+    elif isinstance(sen, (And, Or)):
+        for sub in sen.subs:
+            yield from body_cuts(sub)
+
+
+def fresh_cuts(sen):
+    "Copy of `sen` with cuts of its own, sharing anything else."
+    if type(sen) is Cut:
+        return Cut()
+    elif isinstance(sen, (And, Or)):
+        return type(sen)(*(fresh_cuts(sub) for sub in sen.subs))
+    return sen
+
+
+def conjuncts(sen):
+    "Flatten nested `And` sentences into the list of their conjuncts."
+    if type(sen) is And:
+        return [c for sub in sen.subs for c in conjuncts(sub)]
+    else:
+        return [sen]
+
+
+def callees(sen):
+    "Yield verbs of all predicates called within sentence `sen`."
+    if isinstance(sen, Pred):
+        yield sen.verb
+        subs = sen.terms
+    else:
+        subs = sen.subs
+    for sub in subs:
+        if isinstance(sub, Sen):
+            yield from callees(sub)
+
+
 class Pred(SenAtom):
 
     """A predicate is upon 0 or more terms.
@@ -93,6 +178,8 @@ class Pred(SenAtom):
 
     """
 
+    _ground = None
+
     def __init__(self, verb, *terms):
         assert type(verb) is str
         self.verb = verb
@@ -103,8 +190,16 @@ class Pred(SenAtom):
 
     def __call__(self, *terms):
         self.terms = terms
+        self._ground = None
         return self
 
+    @property
+    def ground(self):
+        "Whether no Var, ScmVar or Func occurs within, cached."
+        if self._ground is None:
+            self._ground = all(map(is_ground, self.terms))
+        return self._ground
+
     @property
     def arity(self):
         return len(self.terms)
@@ -224,7 +319,14 @@ class Term(Operable):
 
 class TermCnpd(Term):
 
-    'Compound Term.'
+    """Compound Term.
+
+    Whether it is ground is found once and cached, so that ground terms
+    are shared rather than rebuilt by `subst` and `univ_inst`.
+
+    """
+
+    _ground = None
 
     def __init__(self, con, *terms):
         self.con = con
@@ -235,11 +337,116 @@ class TermCnpd(Term):
 
     def __call__(self, *terms):
         self.terms = terms
+        self._ground = None
+
+    @property
+    def ground(self):
+        "Whether no Var, ScmVar or Func occurs within, cached."
+        if self._ground is None:
+            self._ground = all(map(is_ground, self.terms))
+        return self._ground
 
     def __hash__(self):
         return hash(self.con)
 
 
+class TermList(TermCnpd):
+
+    """List term backed by a Python tuple: the elements `items[start:]`
+    followed by `tail`, which is NIL (None) for a proper list, a Var
+    for a partial list like `[H|T]`, or another list.
+
+    It stands for the chain of cells `TermCnpd('.', head, rest)`, where
+    `rest` is a view sharing the same tuple. The engine handles the
+    elements in loops rather than cell by cell. Make lists by `lst`.
+
+    """
+
+    con = '.'
+
+    def __init__(self, items, tail=None, start=0):
+        self.items = items if type(items) is tuple else tuple(items)
+        assert start < len(self.items), 'Empty TermList, use NIL.'
+        self.tail = tail
+        self.start = start
+        self._ground = None
+
+    @property
+    def terms(self):
+        return (self.items[self.start], self.rest)
+
+    @property
+    def rest(self):
+        return self.view(self.start + 1)
+
+    def view(self, start):
+        "The list from `items[start]` on, sharing the storage."
+        if start == len(self.items):
+            return self.tail
+        v = TermList(self.items, self.tail, start)
+        if self._ground:
+            v._ground = True
+        return v
+
+    @property
+    def ground(self):
+        "Whether no Var, ScmVar or Func occurs in the list."
+        if self._ground is None:
+            es, t = self.parts()
+            self._ground = is_ground(t) and all(map(is_ground, es))
+        return self._ground
+
+    def parts(self, u=None):
+        """Elements up to the first tail which is no list, and that tail,
+        following Var's bound in `u` if given.
+
+        """
+        es = []
+        x = self
+        while True:
+            if isinstance(x, TermList):
+                es.extend(x.items[x.start:])
+                x = x.tail
+            elif u is not None and isinstance(x, Var) and x in u:
+                x = u[x]
+            else:
+                return es, x
+
+    def tolist(self):
+        "Elements of a proper list as a Python list."
+        es, t = self.parts()
+        if t is not None:
+            raise ValueError('Partial list: {}'.format(self))
+        return es
+
+    def __repr__(self):
+        es, t = self.parts()
+        s = ', '.join(map(repr, es))
+        return '[{}]'.format(s) if t is None else '[{} | {}]'.format(s, t)
+
+
+def lst(items=(), tail=None):
+    """List term of the elements `items` followed by `tail`, which is
+    NIL (None) for a proper list and a Var or ScmVar for a partial one.
+
+    """
+    return TermList(items, tail) if len(items) else tail
+
+
+def is_ground(x):
+    "Test whether no Var, ScmVar or Func occurs in term `x`."
+    if isinstance(x, (TermCnpd, Sen)):
+        return x.ground
+    elif isinstance(x, (list, tuple)):
+        return all(map(is_ground, x))
+    return not isinstance(x, Term)
+
+
+def same(xs, ys):
+    "Whether sequences `xs` and `ys` hold the very same objects."
+    return all(map(op.is_, xs, ys))
+
+
 class Var(Term):
 
     "Variable Term."
@@ -349,14 +556,167 @@ pred = easy(Pred)
 FAIL = '-FAIL-'
 
 
+class Env(dict):
+
+    """Unifier which gets bound in place and records every binding on
+    an undo trail.
+
+    Instead of copying the unifier for each new binding, backtracking
+    rolls the unifier back to a mark taken before trying an
+    alternative.
+
+    """
+
+    limits = None               # Limits of the query if any
+
+    def __init__(self, *a, **kw):
+        super(Env, self).__init__(*a, **kw)
+        self.trail = []
+        # Numbers the Var's made by renaming clauses for this query.
+        self.fresh = count()
+        # Delayed goals, domains and constraints of unbound Var's.
+        self.attrs = {}
+
+    def bind(self, v, z):
+        self[v] = z
+        self.trail.append(v)
+
+    def put(self, v, attrs):
+        "Set the attributes of unbound `v`, removing them if None."
+        self.trail.append((v, self.attrs.get(v)))
+        if attrs is None:
+            del self.attrs[v]
+        else:
+            self.attrs[v] = attrs
+
+    def mark(self):
+        return len(self.trail)
+
+    def undo(self, mark):
+        trail = self.trail
+        while len(trail) > mark:
+            x = trail.pop()
+            if type(x) is tuple:
+                v, attrs = x
+                if attrs is None:
+                    del self.attrs[v]
+                else:
+                    self.attrs[v] = attrs
+            else:
+                del self[x]
+
+
+class ResourceError(Exception):
+
+    """Raised by a query exceeding one of its `Limits`, naming the
+    `limit` exceeded and giving the `stats` of the query so far.
+
+    """
+
+    def __init__(self, limit, stats):
+        super(ResourceError, self).__init__(
+            'Query exceeded its {} limit: {}'.format(limit, stats))
+        self.limit = limit
+        self.stats = stats
+
+
+class Limits(object):
+
+    """Bounds on the number of `inferences` (predicate calls), the
+    `depth` of nested rule calls, the `timeout` in seconds and the
+    number of `answers` of a query. Unset bounds are not checked.
+
+    A query counts on its own copy made by `started`. Long scans of
+    candidate clauses or rows check the timeout every `SCAN` of them.
+
+    """
+
+    SCAN = 1024
+
+    def __init__(self, inferences=None, depth=None, timeout=None,
+                 answers=None):
+        self.inferences = inferences
+        self.depth = depth
+        self.timeout = timeout
+        self.answers = answers
+        self.counts = {'inferences': 0, 'depth': 0, 'max_depth': 0,
+                       'answers': 0}
+        self.start = None
+
+    def started(self):
+        lim = Limits(self.inferences, self.depth, self.timeout, self.answers)
+        lim.start = time.monotonic()
+        return lim
+
+    def stats(self):
+        st = dict(self.counts)
+        st['seconds'] = time.monotonic() - self.start
+        return st
+
+    def exceeded(self, limit):
+        raise ResourceError(limit, self.stats())
+
+    def call(self):
+        "Count an inference."
+        n = self.counts['inferences'] = self.counts['inferences'] + 1
+        if self.inferences is not None and n > self.inferences:
+            self.exceeded('inferences')
+        self.tick()
+
+    def scan(self, items):
+        "Generate `items`, checking the timeout every so often."
+        if self.timeout is None:
+            yield from items
+            return
+        for i, x in enumerate(items):
+            if not i % self.SCAN:
+                self.tick()
+            yield x
+
+    def tick(self):
+        "Check the timeout."
+        if self.timeout is not None and \
+                time.monotonic() - self.start > self.timeout:
+            self.exceeded('timeout')
+
+    def answer(self):
+        "Count an answer."
+        n = self.counts['answers'] = self.counts['answers'] + 1
+        if self.answers is not None and n > self.answers:
+            self.exceeded('answers')
+
+    def enter(self, sols):
+        "Count rule calls nested while solving a body by `sols`."
+        counts = self.counts
+        d = counts['depth'] = counts['depth'] + 1
+        if d > counts['max_depth']:
+            counts['max_depth'] = d
+            if self.depth is not None and d > self.depth:
+                self.exceeded('depth')
+        for _ in sols:
+            counts['depth'] -= 1
+            yield _
+            counts['depth'] += 1
+        counts['depth'] -= 1
+
+
 def unify(x, y, u={}):
 
-    "Unification can apply to `Term` as well as `Pred`."
+    """Unification can apply to `Term` as well as `Pred`.
+
+    Bindings are added into `u` in place when it is an `Env`, any other
+    mapping is copied into a new `Env` first. On FAIL, `u` may keep
+    partial bindings to be undone by the caller.
+
+    """
 
     # Transitive FAIL
     if u is FAIL:
         return FAIL
 
+    elif type(u) is not Env:
+        return unify(x, y, Env(u))
+
     # unify iterable
     elif type(x) == type(y) and isinstance(x, (list, tuple)):
         for a, b in zip(x, y):
@@ -390,6 +750,10 @@ def unify(x, y, u={}):
             'Unsupported unification for unevaluated Func object. '
             '(cf. equivalence of functions - undecidability).')
 
+    # - List Term, element by element
+    elif isinstance(x, TermList) and isinstance(y, TermList):
+        return unify_lists(x, y, u)
+
     # - Compound Term
     # FIXME: Support Compound Term in the future maybe.
     # - Can Func be treated as specialized Compound Term?
@@ -432,18 +796,54 @@ def unify(x, y, u={}):
         return FAIL
 
 
+def unify_lists(x, y, u):
+    "Unify lists `x` and `y` in a loop over their elements."
+    xs, i, ys, j = x.items, x.start, y.items, y.start
+    while True:
+        if i == len(xs) or j == len(ys):
+            if i == len(xs):
+                x = x.tail
+                y = y.view(j)
+            else:
+                y = y.tail
+                x = x.view(i)
+            # Go on with the tail when it is bound to a list.
+            while isinstance(x, Var) and x in u:
+                x = u[x]
+            while isinstance(y, Var) and y in u:
+                y = u[y]
+            if not (isinstance(x, TermList) and isinstance(y, TermList)):
+                return unify(x, y, u)
+            xs, i, ys, j = x.items, x.start, y.items, y.start
+            continue
+        a, b = xs[i], ys[j]
+        if a is not b:
+            u = unify(a, b, u)
+            if u is FAIL:
+                return FAIL
+        i += 1
+        j += 1
+
+
 def occurs_in(v, x):
     "Occurence check."
     assert isinstance(v, Var)
-    if isinstance(x, Var):
-        # Unifiable whether they are equal Var.
-        return False
-    elif isinstance(x, TermCnpd):
-        return any(occurs_in(v, y) for y in x.terms)
-    elif isinstance(x, Pred):
-        return any(occurs_in(v, y) for y in x.terms)
-    else:
-        return False
+    # Walked with an explicit stack for arbitrarily deep terms.
+    todo = [x]
+    while todo:
+        x = todo.pop()
+        if isinstance(x, Var):
+            # Unifiable whether they are equal Var.
+            continue
+        elif isinstance(x, TermList):
+            if not x.ground:
+                es, t = x.parts()
+                todo.extend(es)
+                todo.append(t)
+        elif isinstance(x, (TermCnpd, Pred)):
+            if not x.ground:
+                todo.extend(x.terms)
+    return False
 
 
 def unify_var(v, z, u):
@@ -461,23 +861,87 @@ def unify_var(v, z, u):
     elif z in u:
         return unify(v, u[z], u)
     else:
-        u1 = dict(u)
-        u1[v] = z
-        return u1
+        u.bind(v, z)
+        return u
+
+
+def matches(x, y):
+    "Test whether `x` and `y` unify, without keeping any binding."
+    try:
+        return unify(x, y, Env()) is not FAIL
+    except ValueError:
+        return False
 
 
 def updated_subst(u):
     "Substitute all Var's in `u` w.R.t. itself until fix point."
+    # Roots are shared among the Var's and built with an explicit
+    # stack, so long chains of bindings cost neither time nor depth.
+    roots = {}
     def root(x):
-        if x in u:
-            return root(u[x])
-        elif isinstance(x, TermCnpd):
-            return TermCnpd(x.con, *map(root, x.terms))
-        else:
-            return x
+        todo = [(0, x)]
+        out = []
+        while todo:
+            step, x = todo.pop()
+            if step == 0:
+                if isinstance(x, Var) and x in u:
+                    if x in roots:
+                        out.append(roots[x])
+                    else:
+                        todo.append((1, x))
+                        todo.append((0, u[x]))
+                elif isinstance(x, TermList):
+                    if x.ground:
+                        out.append(x)
+                    else:
+                        es, t = x.parts()
+                        todo.append((3, len(es) + 1))
+                        todo.append((0, t))
+                        todo.extend((0, y) for y in reversed(es))
+                elif isinstance(x, TermCnpd):
+                    if x.ground:
+                        out.append(x)
+                    else:
+                        todo.append((2, x))
+                        todo.extend((0, y) for y in reversed(x.terms))
+                else:
+                    out.append(x)
+            elif step == 1:
+                roots[x] = out[-1]
+            elif step == 2:
+                i = len(out) - len(x.terms)
+                args = out[i:]
+                del out[i:]
+                out.append(x if same(args, x.terms) else
+                           TermCnpd(x.con, *args))
+            else:
+                i = len(out) - x
+                es, t = out[i:-1], out[-1]
+                del out[i:]
+                out.append(lst(es, t))
+        return out[0]
     return {k: root(k) for k in u}
 
 
+def answer(u):
+    """Answer of a query bound by `u`, hiding the renamed Var's. Goals
+    still delayed on unbound Var's cannot be told to hold, so raise.
+
+    """
+    for v, (goals, _, _) in residue(u).items():
+        if goals:
+            raise ValueError(
+                'Unsupported unification for unevaluated Func object: '
+                '{} delayed on unbound {}.'.format(goals[0], v))
+    # Update all RHS in `u` recursively thus each rooted Var gets
+    # substituted by its root.
+    u1 = updated_subst(u)
+    for k in set(u):
+        if '#' in k.symbol:
+            u1.pop(k)
+    return u1
+
+
 def subst(u, x):
     """Substitute `u[x]` for `x` recursively.
 
@@ -487,24 +951,42 @@ def subst(u, x):
     """
     # Term
     if isinstance(x, Var):
-        if x in u:
-            return u[x]
-        else:
-            return x
+        while isinstance(x, Var) and x in u:
+            x = u[x]
+        return x
+    elif isinstance(x, TermList):
+        # Ground lists are shared, others rebuilt up to a ground tail.
+        es = []
+        while isinstance(x, TermList) and not x.ground:
+            es.extend(subst(u, y) for y in x.items[x.start:])
+            x = subst(u, x.tail) if isinstance(x.tail, Var) else x.tail
+        return lst(es, x if isinstance(x, TermList) or x is None
+                   else subst(u, x))
+    # Terms left unchanged are shared, not rebuilt.
     elif isinstance(x, TermCnpd):
-        return TermCnpd(x.con, *(subst(u, y) for y in x.terms))
+        if x.ground:
+            return x
+        ts = [subst(u, y) for y in x.terms]
+        return x if same(ts, x.terms) else TermCnpd(x.con, *ts)
     elif isinstance(x, Func):
         # Eval func here after post-order construction.
-        f = Func(x.op, *(subst(u, a) for a in x.args))
+        args = [subst(u, a) for a in x.args]
+        f = x if same(args, x.args) else Func(x.op, *args)
         if f.can_eval():
             return f.eval()
         else:
             return f
     # Sentence
     elif isinstance(x, Pred):
-        return Pred(x.verb, *(subst(u, y) for y in x.terms))
+        if x.ground:
+            return x
+        ts = [subst(u, y) for y in x.terms]
+        return x if same(ts, x.terms) else Pred(x.verb, *ts)
     elif isinstance(x, Sen):
-        return type(x)(*(subst(u, y) for y in x.subs))
+        if x.ground or not x.subs:
+            return x
+        subs = [subst(u, y) for y in x.subs]
+        return x if same(subs, x.subs) else type(x)(*subs)
     # Constant term
     else:
         # Constant
@@ -514,27 +996,44 @@ def subst(u, x):
 stand_count = count()
 
 
-def univ_inst(x, env=None):
+def univ_inst(x, env=None, fresh=None):
     """Instantiate ScmVar to Var. This is like beta-reduction in the
     context of lambda calculus.
 
+    New Var's are numbered by `fresh`, the counter of a query's `Env`,
+    or else by the module-wide `stand_count`.
+
     """
     if env is None:
         env = {}
     if isinstance(x, ScmVar):
         if x._mark not in env:
-            env[x._mark] = Var('{}_#{}'.format(x._mark, next(stand_count)))
+            n = next(stand_count if fresh is None else fresh)
+            env[x._mark] = Var('{}_#{}'.format(x._mark, n))
         return env[x._mark]
     elif isinstance(x, Var):
         raise
+    elif isinstance(x, TermList):
+        if x.ground:
+            return x
+        es, t = x.parts()
+        return lst([univ_inst(y, env, fresh) for y in es],
+                   univ_inst(t, env, fresh))
+    # Ground terms and sentences are shared, not copied.
     elif isinstance(x, TermCnpd):
-        return TermCnpd(x.con, *(univ_inst(y, env) for y in x.terms))
+        if x.ground:
+            return x
+        return TermCnpd(x.con, *(univ_inst(y, env, fresh) for y in x.terms))
     elif isinstance(x, Func):
-        return Func(x.op, *(univ_inst(a, env) for a in x.args))
+        return Func(x.op, *(univ_inst(a, env, fresh) for a in x.args))
     elif isinstance(x, Pred):
-        return Pred(x.verb, *(univ_inst(y, env) for y in x.terms))
+        if x.ground:
+            return x
+        return Pred(x.verb, *(univ_inst(y, env, fresh) for y in x.terms))
     elif isinstance(x, Sen):
-        return type(x)(*(univ_inst(y, env) for y in x.subs))
+        if x.ground:
+            return x
+        return type(x)(*(univ_inst(y, env, fresh) for y in x.subs))
     else:
         # Constant
         return x
@@ -545,6 +1044,105 @@ def stand_reset():
     stand_count = count()
 
 
+# === Variants ===
+#
+# Two terms are *variants* of each other if they are equal up to
+# renaming of their Var's. Tabling identifies subgoals and answers by
+# their variant keys.
+
+def walk(u, x):
+    "Substitute `u` into `x` thoroughly without evaluating `Func`."
+    if isinstance(x, Var):
+        while isinstance(x, Var) and x in u:
+            x = u[x]
+        return x if isinstance(x, Var) else walk(u, x)
+    elif isinstance(x, TermList):
+        if x.ground:
+            return x
+        es, t = x.parts(u)
+        return lst([walk(u, y) for y in es], walk(u, t))
+    elif isinstance(x, TermCnpd):
+        if x.ground:
+            return x
+        ts = [walk(u, y) for y in x.terms]
+        return x if same(ts, x.terms) else TermCnpd(x.con, *ts)
+    elif isinstance(x, Pred):
+        if x.ground:
+            return x
+        ts = [walk(u, y) for y in x.terms]
+        return x if same(ts, x.terms) else Pred(x.verb, *ts)
+    elif isinstance(x, (list, tuple)):
+        return type(x)(walk(u, y) for y in x)
+    else:
+        return x
+
+
+def symbol_key(v):
+    "Key of constant `v`, telling apart `1`, `1.0` and `True`."
+    t = type(v)
+    return v if t is str or t is int else (t, v)
+
+
+def variant(x, vs=None):
+    """Hashable key of `x` which is shared by all its variants. Var's
+    are numbered by first occurence, collected in `vs` if given.
+
+    """
+    if vs is None:
+        vs = {}
+    if isinstance(x, Var):
+        if x not in vs:
+            vs[x] = len(vs)
+        return (Var, vs[x])
+    elif isinstance(x, TermList):
+        es, t = x.parts()
+        return (TermList, tuple(variant(y, vs) for y in es), variant(t, vs))
+    elif isinstance(x, TermCnpd):
+        return (TermCnpd, x.con) + tuple(variant(y, vs) for y in x.terms)
+    elif isinstance(x, Pred):
+        return (Pred, x.verb) + tuple(variant(y, vs) for y in x.terms)
+    elif isinstance(x, Func):
+        return (Func, x.op) + tuple(variant(y, vs) for y in x.args)
+    elif isinstance(x, Sen):
+        return (type(x),) + tuple(variant(y, vs) for y in x.subs)
+    elif isinstance(x, (list, tuple)):
+        return (type(x),) + tuple(variant(y, vs) for y in x)
+    else:
+        return symbol_key(x)
+
+
+def generalize(x, vs=None):
+    """Replace Var's in `x` by ScmVar's, so that `univ_inst` makes a
+    fresh variant of `x`.
+
+    """
+    if vs is None:
+        vs = {}
+    if isinstance(x, Var):
+        if x not in vs:
+            vs[x] = ScmVar('_{}'.format(len(vs)))
+        return vs[x]
+    elif isinstance(x, TermList):
+        if x.ground:
+            return x
+        es, t = x.parts()
+        return lst([generalize(y, vs) for y in es], generalize(t, vs))
+    elif isinstance(x, (TermCnpd, Pred)) and x.ground:
+        return x
+    elif isinstance(x, TermCnpd):
+        return TermCnpd(x.con, *(generalize(y, vs) for y in x.terms))
+    elif isinstance(x, Pred):
+        return Pred(x.verb, *(generalize(y, vs) for y in x.terms))
+    elif isinstance(x, Func):
+        return Func(x.op, *(generalize(y, vs) for y in x.args))
+    elif isinstance(x, Sen):
+        return type(x)(*(generalize(y, vs) for y in x.subs))
+    elif isinstance(x, (list, tuple)):
+        return type(x)(generalize(y, vs) for y in x)
+    else:
+        return x
+
+
 # === Knowledge Base ===
 #
 # Properties of a KB
@@ -554,10 +1152,1594 @@ def stand_reset():
 #   - verifying a new tell
 #   - a real-time query
 
+_OPEN = object()
+
+
+def index_key(t):
+    """Key of an argument term for clause indexing.
+
+    Constants are keyed by themselves and compound terms by their
+    constructor and arity. Terms which may match anything (Var, ScmVar,
+    Func, ...) are keyed as `_OPEN`.
+
+    """
+    if isinstance(t, TermList):
+        return (TermCnpd, '.', 2)
+    elif isinstance(t, TermCnpd):
+        return (TermCnpd, t.con, len(t.terms))
+    elif isinstance(t, (Term, Sen, list, tuple)):
+        return _OPEN
+    try:
+        hash(t)
+    except TypeError:
+        return _OPEN
+    return t
+
+
+class Symbols(object):
+
+    """Interned constants. Each distinct constant gets a small integer
+    id, so that fact tables can store ids instead of objects.
+
+    Constants equal but of different types, like `1`, `1.0` and `True`,
+    get ids of their own, yet still match each other: `find_all` gives
+    the ids of all constants equal to one, and once any such constants
+    are interned, `mixed` tells that equal ids no longer stand for
+    equal constants.
+
+    """
+
+    def __init__(self, load=None):
+        # Symbols of a snapshot are read on demand by `load`.
+        self._load = load
+        self._values = None if load else []
+        self._ids = None if load else {}
+        self._types = set()     # types of constants keyed with their type
+        self._mixed = False
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def values(self):
+        if self._values is None:
+            self._values = self._load()
+        return self._values
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            self._ids = {}
+            for i, v in enumerate(self.values):
+                self.enter(v, i)
+        return self._ids
+
+    @property
+    def mixed(self):
+        "Whether some interned constants are equal but of other types."
+        self.ids                # noted while keying
+        return self._mixed
+
+    def enter(self, v, i):
+        "Key constant `v` by id `i`."
+        k = symbol_key(v)
+        if k is not v:
+            self._types.add(type(v))
+        if not self._mixed and self.find_all(v):
+            self._mixed = True
+        self._ids[k] = i
+
+    def find(self, v):
+        "Id of constant `v`, or None if it was never interned."
+        return self.ids.get(symbol_key(v))
+
+    def find_all(self, v):
+        "Ids of the constants equal to `v`, in interning order."
+        ids = self.ids
+        # Constants keyed by themselves are found by any equal one.
+        i = ids.get(v)
+        found = [] if i is None else [i]
+        for t in self._types:
+            i = ids.get((t, v))
+            if i is not None:
+                found.append(i)
+        return sorted(found) if len(found) > 1 else found
+
+    def intern(self, v):
+        k = symbol_key(v)
+        i = self.ids.get(k)
+        if i is None:
+            if isinstance(v, (Term, Sen, list, tuple)):
+                raise ValueError('Not a constant: {}'.format(repr(v)))
+            i = len(self.values)
+            self.enter(v, i)
+            self.values.append(v)
+        return i
+
+    def intern_all(self, vs):
+        "Intern each of `vs` into an array of ids."
+        ids = self.ids
+        ks = list(map(symbol_key, vs))
+        new = {k: v for k, v in zip(ks, vs) if k not in ids}
+        for v in new.values():
+            if isinstance(v, (Term, Sen, list, tuple)):
+                raise ValueError('Not a constant: {}'.format(repr(v)))
+        n = len(self.values)
+        if self._types or any(k is not v for k, v in new.items()):
+            for i, v in enumerate(new.values(), n):
+                self.enter(v, i)
+        else:
+            # Only constants keyed by themselves, which never clash.
+            ids.update(zip(new, range(n, n + len(new))))
+        self.values.extend(new.values())
+        return array('q', map(ids.__getitem__, ks))
+
+
+def ids_array(buf):
+    "Copy a buffer of ids into an array."
+    a = array('q')
+    a.frombytes(memoryview(buf).cast('B'))
+    return a
+
+
+class FactTable(object):
+
+    """Column store of ground facts of one predicate.
+
+    Row `r` holds the constant of id `cols[j][r]` at argument position
+    `j`, and has the ordinal `ords[r]` among the clauses of its
+    Proc. Columns are hash-indexed on demand. Retracted rows remain as
+    tombstones in `dead`, so that rows keep their numbers in lookups
+    done earlier; saving the KB leaves them out.
+
+    """
+
+    def __init__(self, symbols, arity):
+        self.symbols = symbols
+        self.arity = arity
+        self.cols = [array('q') for _ in range(arity)]
+        self.ords = array('q')
+        self.indexes = {}       # position -> {id -> row | array of rows}
+        self.dead = set()
+
+    def __len__(self):
+        return len(self.ords) - len(self.dead)
+
+    def __repr__(self):
+        return 'FactTable({} rows, arity {})'.format(len(self), self.arity)
+
+    def row(self, r):
+        vs = self.symbols.values
+        return tuple(vs[c[r]] for c in self.cols)
+
+    def pred(self, verb, r):
+        return Pred(verb, *self.row(r))
+
+    def rows(self):
+        "Yield all live rows as tuples of constants."
+        dead = self.dead
+        for r in range(len(self.ords)):
+            if r not in dead:
+                yield self.row(r)
+
+    @staticmethod
+    def enter(idx, ids, start):
+        # Single rows are kept unboxed, as most keys are rather unique.
+        get = idx.get
+        for r, i in enumerate(ids, start):
+            b = get(i)
+            if b is None:
+                idx[i] = r
+            elif type(b) is int:
+                idx[i] = array('q', (b, r))
+            else:
+                b.append(r)
+
+    def build(self, pos):
+        self.indexes[pos] = {}
+        self.enter(self.indexes[pos], self.cols[pos], 0)
+
+    def own(self):
+        "Copy columns mapped from a snapshot into arrays of our own."
+        if type(self.ords) is not array:
+            self.ords = ids_array(self.ords)
+            self.cols = [ids_array(c) for c in self.cols]
+
+    def append(self, ords, cols):
+        "Append rows given by their ordinals and columns of ids."
+        self.own()
+        n = len(self.ords)
+        if len(cols) != self.arity or any(len(c) != len(ords) for c in cols):
+            raise ValueError('Rows of arity {} expected.'.format(self.arity))
+        self.ords.extend(ords)
+        for col, new in zip(self.cols, cols):
+            col.extend(new)
+        for pos, idx in self.indexes.items():
+            self.enter(idx, cols[pos], n)
+
+    def append_row(self, ordinal, ids):
+        self.own()
+        r = len(self.ords)
+        self.ords.append(ordinal)
+        for col, i in zip(self.cols, ids):
+            col.append(i)
+        for pos, idx in self.indexes.items():
+            self.enter(idx, (ids[pos],), r)
+
+    def remove(self, r):
+        self.dead.add(r)
+
+    @staticmethod
+    def hits(idx, i):
+        "Rows of id `i` in index `idx`."
+        hit = idx.get(i, ())
+        return (hit,) if type(hit) is int else hit
+
+    def select(self, goal):
+        """Rows possibly matching `goal` as of now, using the most
+        selective index among the bound argument positions.
+
+        """
+        if len(goal.terms) != self.arity:
+            return ()
+        best = None
+        for pos, t in enumerate(goal.terms):
+            k = index_key(t)
+            if k is _OPEN:
+                continue
+            ids = () if isinstance(t, TermCnpd) else self.symbols.find_all(t)
+            if not ids:
+                return ()
+            if pos not in self.indexes:
+                self.build(pos)
+            idx = self.indexes[pos]
+            if len(ids) == 1:
+                hit = self.hits(idx, ids[0])
+            else:
+                hit = sorted(r for i in ids for r in self.hits(idx, i))
+            if best is None or len(hit) < len(best):
+                best = hit
+        n = len(self.ords)
+        rows = range(n) if best is None else best
+        if not self.dead:
+            return rows if best is None else rows[:]
+        dead = self.dead
+        return [r for r in rows if r not in dead]
+
+    def probe(self, positions, keys):
+        """Rows whose ids at `positions` make up one of `keys`, as a dict
+        from each key found to its rows in order. Few keys are probed
+        through the index of the first position, many are joined with
+        one scan of the table.
+
+        """
+        found = {}
+        n = len(self.ords)
+        dead = self.dead
+        if positions and len(keys) * 8 < n:
+            pos = positions[0]
+            if pos not in self.indexes:
+                self.build(pos)
+            idx = self.indexes[pos]
+            cols = [self.cols[p] for p in positions]
+            for ks in keys:
+                hit = idx.get(ks[0], ())
+                if type(hit) is int:
+                    hit = (hit,)
+                rows = [r for r in hit if r not in dead and
+                        all(c[r] == i for c, i in zip(cols, ks))]
+                if rows:
+                    found[ks] = rows
+        else:
+            cols = [self.cols[p] for p in positions]
+            for r, ks in enumerate(zip(*cols) if cols else [()] * n):
+                if ks in keys and r not in dead:
+                    found.setdefault(ks, []).append(r)
+        return found
+
+    def matcher(self, goal):
+        """Compile `goal` into a test `match(r, u)`, which binds `u` in
+        place if row `r` matches.
+
+        """
+        consts = []
+        alts = []               # (column, ids of equal constants)
+        binds = []
+        for pos, t in enumerate(goal.terms):
+            if index_key(t) is _OPEN:
+                binds.append((self.cols[pos], t, type(t) is Var))
+                continue
+            ids = self.symbols.find_all(t)
+            if len(ids) > 1:
+                alts.append((self.cols[pos], frozenset(ids)))
+            else:
+                consts.append((self.cols[pos], ids[0] if ids else None))
+        vs = self.symbols.values
+
+        def match(r, u):
+            for col, i in consts:
+                if col[r] != i:
+                    return False
+            for col, ids in alts:
+                if col[r] not in ids:
+                    return False
+            for col, t, free in binds:
+                if free and t not in u:
+                    u.bind(t, vs[col[r]])
+                elif unify(t, vs[col[r]], u) is FAIL:
+                    return False
+            return True
+
+        def may(r):
+            "Whether row `r` has the constants of `goal`, binding nothing."
+            for col, i in consts:
+                if col[r] != i:
+                    return False
+            for col, ids in alts:
+                if col[r] not in ids:
+                    return False
+            return True
+        match.may = may
+        return match
+
+
+class Proc(object):
+
+    """Procedure: all clauses (facts and rules) telled for one
+    predicate, kept in telling order.
+
+    Clauses are hash-indexed on argument positions of their heads. The
+    first argument is indexed eagerly as in the WAM, any other position
+    gets its index the first time a goal binds it. An index maps each
+    key to the ordinals of matching clauses, while clauses being open
+    at that position are kept aside, so that a lookup yields exactly
+    the clauses which can unify with the goal at that position.
+
+    Bulk loaded facts are kept apart in a columnar `FactTable`, sharing
+    the ordinals with the clauses.
+
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.clauses = {}       # ordinal -> clause
+        self.indexes = {}       # position -> {key -> {ordinal: None}}
+        self.opens = {}         # position -> {ordinal: None}
+        self.ordinal = 0
+        self.facts = None       # FactTable
+        self.build(0)
+
+    def __iter__(self):
+        if self.facts is None:
+            return iter(self.clauses.values())
+        return (self.facts.pred(self.key, r) if sen is None else sen
+                for _, sen, r in self.entries())
+
+    def __len__(self):
+        n = len(self.clauses)
+        return n if self.facts is None else n + len(self.facts)
+
+    def __repr__(self):
+        return 'Proc({}, {} clauses)'.format(self.key, len(self))
+
+    @staticmethod
+    def head(sen):
+        return sen.lhs if isinstance(sen, Rule) else sen
+
+    def enter(self, pos, i, sen):
+        terms = self.head(sen).terms
+        k = index_key(terms[pos]) if pos < len(terms) else _OPEN
+        if k is _OPEN:
+            self.opens[pos][i] = None
+        else:
+            self.indexes[pos].setdefault(k, {})[i] = None
+
+    def leave(self, pos, i, sen):
+        terms = self.head(sen).terms
+        k = index_key(terms[pos]) if pos < len(terms) else _OPEN
+        if k is _OPEN:
+            del self.opens[pos][i]
+        else:
+            bucket = self.indexes[pos][k]
+            del bucket[i]
+            if not bucket:
+                del self.indexes[pos][k]
+
+    def build(self, pos):
+        self.indexes[pos] = {}
+        self.opens[pos] = {}
+        for i, sen in self.clauses.items():
+            self.enter(pos, i, sen)
+
+    def add(self, sen):
+        i = self.ordinal
+        self.ordinal += 1
+        self.clauses[i] = sen
+        for pos in self.indexes:
+            self.enter(pos, i, sen)
+
+    def add_fact(self, symbols, fact):
+        """Add a ground fact as a row of the fact table if possible, and
+        tell whether it is done so.
+
+        """
+        terms = fact.terms
+        if self.facts is not None and self.facts.arity != len(terms):
+            return False
+        for t in terms:
+            if index_key(t) is _OPEN or isinstance(t, TermCnpd):
+                return False
+        if self.facts is None:
+            self.facts = FactTable(symbols, len(terms))
+        self.facts.append_row(self.ordinal, [symbols.intern(t) for t in terms])
+        self.ordinal += 1
+        return True
+
+    def load(self, symbols, cols):
+        "Append rows given by columns of interned ids to the fact table."
+        if self.facts is None:
+            self.facts = FactTable(symbols, len(cols))
+        n = len(cols[0]) if cols else 0
+        self.facts.append(range(self.ordinal, self.ordinal + n), cols)
+        self.ordinal += n
+
+    def remove(self, i):
+        "Remove the clause of ordinal `i` and return it."
+        sen = self.clauses.pop(i)
+        for pos in self.indexes:
+            self.leave(pos, i, sen)
+        return sen
+
+    def remove_row(self, r):
+        "Remove row `r` of the fact table and return it as a fact."
+        self.facts.remove(r)
+        return self.facts.pred(self.key, r)
+
+    def lookup(self, goal):
+        """List clauses possibly matching `goal` in telling order, where
+        rows of the fact table are given by their numbers. The list is
+        a snapshot, unaffected by later telling or retracting (the
+        *logical update view*).
+
+        """
+        cs = self.clauses
+        sel = self.select(goal)
+        if self.facts is None or not self.facts.ords:
+            if sel is cs:
+                return list(cs.values())
+            return [cs[i] for i in sel]
+        elif not cs:
+            return self.facts.select(goal)
+        else:
+            return [r if sen is None else sen
+                    for _, sen, r in self.entries(goal)]
+
+    def entries(self, goal=None):
+        """List `(ordinal, clause, None)` for clauses and `(ordinal, None,
+        row)` for fact table rows possibly matching `goal`, in telling
+        order.
+
+        """
+        cs = self.clauses
+        sel = cs if goal is None else self.select(goal)
+        es = [(i, cs[i], None) for i in sel]
+        if self.facts is not None:
+            ords = self.facts.ords
+            rows = (range(len(ords)) if goal is None else
+                    self.facts.select(goal))
+            dead = self.facts.dead
+            es = list(merge(es, ((ords[r], None, r) for r in rows
+                                 if goal is not None or r not in dead)))
+        return es
+
+    def select(self, goal):
+        """Ordinals of clauses possibly matching `goal`, using the most
+        selective index among the bound argument positions.
+
+        """
+        best = None
+        for pos, t in enumerate(goal.terms):
+            k = index_key(t)
+            if k is _OPEN:
+                continue
+            if pos not in self.indexes:
+                self.build(pos)
+            hit = self.indexes[pos].get(k, {})
+            opn = self.opens[pos]
+            n = len(hit) + len(opn)
+            if best is None or n < best[0]:
+                best = (n, hit, opn)
+        if best is None:
+            return self.clauses
+        _, hit, opn = best
+        if not opn:
+            return hit
+        elif not hit:
+            return opn
+        else:
+            return merge(hit, opn)
+
+
+class Table(object):
+
+    """Answer table of one tabled subgoal variant.
+
+    Answers are kept as generalized goal instances, in the order found
+    and free of variants.
+
+    """
+
+    def __init__(self, goal):
+        self.goal = goal
+        self.answers = []
+        self.keys = set()
+        self.complete = False
+        self.leader = None      # Lowest stack position depended on
+        self.scc = []           # Incomplete tables led by this one
+        self.passes = 0         # Evaluations of the clauses so far
+        self.stamp = None       # (leader, its passes) when last evaluated
+
+    def evaluated(self, stack):
+        "Whether evaluated in the current pass of its leader on `stack`."
+        if self.stamp is None:
+            return False
+        leader, passes = self.stamp
+        return leader.passes == passes and leader in stack
+
+    def __repr__(self):
+        return 'Table({}, {} answers{})'.format(
+            self.goal, len(self.answers),
+            '' if self.complete else ', incomplete')
+
+    def add(self, ans):
+        k = variant(ans)
+        if k in self.keys:
+            return False
+        self.keys.add(k)
+        self.answers.append(generalize(ans))
+        return True
+
+
+# === Planning ===
+#
+# Conjunctions run left to right as told. A planner may reorder the
+# conjuncts of rule bodies and queries instead, picking greedily the
+# one expected to give the fewest answers with the arguments bound so
+# far. Conjuncts which are not pure, i.e. `NotEq`, `Not`, disjunctions
+# and anything evaluating a `Func`, are only run once the variables
+# bound before them as told are bound, and before any conjunct binding
+# their other variables.
+
+def sen_vars(x, vs=None):
+    "Collect the Var's occurring in `x` into dict `vs` in order."
+    if vs is None:
+        vs = {}
+    if isinstance(x, Var):
+        vs[x] = None
+    elif isinstance(x, TermList):
+        if not x.ground:
+            es, t = x.parts()
+            for y in es:
+                sen_vars(y, vs)
+            sen_vars(t, vs)
+    elif isinstance(x, (TermCnpd, Pred)):
+        if not x.ground:
+            for y in x.terms:
+                sen_vars(y, vs)
+    elif isinstance(x, Func):
+        for y in x.args:
+            sen_vars(y, vs)
+    elif isinstance(x, Sen):
+        for y in x.subs:
+            sen_vars(y, vs)
+    elif isinstance(x, (list, tuple)):
+        for y in x:
+            sen_vars(y, vs)
+    return vs
+
+
+def has_func(x):
+    "Test whether `x` contains a `Func` to be evaluated."
+    if isinstance(x, Func):
+        return True
+    elif isinstance(x, TermList):
+        if x.ground:
+            return False
+        es, t = x.parts()
+        return has_func(t) or any(has_func(y) for y in es)
+    elif isinstance(x, (TermCnpd, Pred)):
+        return not x.ground and any(has_func(y) for y in x.terms)
+    elif isinstance(x, Sen):
+        return not x.ground and any(has_func(y) for y in x.subs)
+    elif isinstance(x, (list, tuple)):
+        return any(has_func(y) for y in x)
+    return False
+
+
+def may_match(sen, goal):
+    """Cheap test whether clause `sen`, or a fact row if it is a number,
+    may match `goal` with Var's substituted: only constants given at
+    the same argument position by both are compared.
+
+    """
+    if type(sen) is int:
+        return True
+    head = sen.lhs if isinstance(sen, Rule) else sen
+    for x, y in zip(head.terms, goal.terms):
+        if not isinstance(x, (Term, list, tuple)) and \
+                not isinstance(y, (Term, Sen, list, tuple)) and x != y:
+            return False
+    return True
+
+
+class Planner(object):
+
+    """Cost-based ordering of conjunctions for a KB.
+
+    The number of answers of a predicate called is estimated by the
+    size of its procedure, rules counting for `RULE_FANOUT` answers
+    each, divided by the number of distinct keys indexed at each bound
+    argument position. Plans of rule bodies are cached by the rule and
+    the bound variables upon calling, until the KB changes.
+
+    """
+
+    RULE_FANOUT = 10
+
+    def __init__(self, kb):
+        self.kb = kb
+        self.plans = {}         # (id of rule, bound flags) -> (rule, order)
+        self.stats = {}         # verb -> (size, {position: distinct keys})
+
+    def reset(self):
+        self.plans.clear()
+        self.stats.clear()
+
+    def body(self, sen, body, u):
+        """Reorder conjunction `body` for `u`, being the instantiated
+        body of rule `sen` or a query if `sen` is None.
+
+        """
+        if type(body) is not And:
+            return body
+        goals = conjuncts(body)
+        vs = sen_vars(goals)
+        flags = tuple(not isinstance(subst(u, v), Var) for v in vs)
+        key = (id(sen), flags)
+        plan = self.plans.get(key) if sen is not None else None
+        if plan is None or plan[0] is not sen:
+            bound = {v for v, b in zip(vs, flags) if b}
+            plan = (sen, self.order(goals, bound))
+            if sen is not None:
+                self.plans[key] = plan
+        order = plan[1]
+        if order == sorted(order):
+            return body
+        sen = goals[order[0]]
+        for i in order[1:]:
+            sen = And(sen, goals[i])
+        return sen
+
+    def order(self, goals, bound=()):
+        """Order of conjuncts `goals` given Var's in `bound` being bound,
+        as a list of their indices.
+
+        """
+        n = len(goals)
+        vs = [sen_vars(g) for g in goals]
+        pinned = [not isinstance(g, (Pred, Eq)) or has_func(g) or
+                  self.builtin(g) for g in goals]
+        # A pinned conjunct waits for the Var's bound before it as told,
+        # and precedes the conjuncts sharing the others with it.
+        needs = [()] * n
+        before = [set() for _ in goals]
+        seen = set(bound)
+        for i in range(n):
+            # Nothing moves across a cut.
+            if type(goals[i]) is Cut:
+                before[i].update(range(i))
+                for j in range(i + 1, n):
+                    before[j].add(i)
+            if pinned[i]:
+                needs[i] = seen.intersection(vs[i])
+                free = vs[i].keys() - seen
+                for j in range(i + 1, n):
+                    if not free.isdisjoint(vs[j]):
+                        before[j].add(i)
+            seen.update(vs[i])
+        bound = set(bound)
+        done = set()
+        order = []
+        while len(order) < n:
+            best = None
+            for i in range(n):
+                if i in done or not before[i] <= done or \
+                   not bound.issuperset(needs[i]):
+                    continue
+                if pinned[i]:
+                    best = i
+                    break
+                c = self.cost(goals[i], bound)
+                if best is None or c < cost:
+                    best, cost = i, c
+            order.append(best)
+            done.add(best)
+            bound.update(vs[best])
+        return order
+
+    def builtin(self, goal):
+        "Whether `goal` calls a built-in predicate."
+        return isinstance(goal, Pred) and goal.key in BUILTINS and \
+            goal.key not in self.kb.base
+
+    def cost(self, goal, bound):
+        "Estimated number of answers to `goal` with `bound` Var's bound."
+        if isinstance(goal, Eq):
+            return 1
+        proc = self.kb.base.get(goal.key)
+        if proc is None:
+            return 0
+        st = self.stats.get(goal.key)
+        if st is None:
+            rules = sum(isinstance(c, Rule) for c in proc.clauses.values())
+            size = len(proc) + rules * (self.RULE_FANOUT - 1)
+            st = self.stats[goal.key] = (size, {})
+        size, distinct = st
+        c = size
+        for pos, t in enumerate(goal.terms):
+            if isinstance(t, Var) and t not in bound:
+                continue
+            if pos not in distinct:
+                with self.kb.lock:
+                    distinct[pos] = max(1, self.distinct(proc, pos))
+            c /= distinct[pos]
+        return c
+
+    @staticmethod
+    def distinct(proc, pos):
+        "Number of distinct keys at argument position `pos` of `proc`."
+        if pos not in proc.indexes:
+            proc.build(pos)
+        n = len(proc.indexes[pos])
+        facts = proc.facts
+        if facts is not None and pos < facts.arity:
+            if pos not in facts.indexes:
+                facts.build(pos)
+            n += len(facts.indexes[pos])
+        return n
+
+
+class AnswerCache(object):
+
+    """LRU cache of the answers to queries asked of a KB.
+
+    Queries are keyed by variant, so renaming their Var's hits the same
+    entry. Answers get stored once all of them are found, and entries
+    are dropped as soon as any predicate they depend on is told or
+    retracted. At most `maxsize` entries holding `maxanswers` answers
+    in total are kept, the least recently used ones going first.
+
+    """
+
+    def __init__(self, kb, maxsize=1024, maxanswers=1 << 16):
+        self.kb = kb
+        self.maxsize = maxsize
+        self.maxanswers = maxanswers
+        self.entries = odict()  # variant key -> (verbs, rows, ground)
+        self.by_verb = {}       # verb -> {variant key: None}
+        self.size = 0           # Number of answers kept
+        self.epoch = 0          # Number of changes to the KB
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return 'AnswerCache({} entries, {} answers)'.format(
+            len(self.entries), self.size)
+
+    def ask(self, goal):
+        vs = {}
+        try:
+            key = variant(goal, vs)
+            entry = self.entries.get(key)
+        except TypeError:
+            # Unhashable constants
+            yield from self.kb.solve(goal)
+            return
+        qvs = list(vs)
+        if entry is not None:
+            self.hits += 1
+            with self.kb.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+            _, rows, ground = entry
+            env = None if ground else {
+                '_{}'.format(i): v for i, v in enumerate(qvs)}
+            for row in rows:
+                if env is not None:
+                    row = [univ_inst(t, dict(env)) for t in row]
+                yield {v: t for v, t in zip(qvs, row) if t is not _OPEN}
+            return
+        self.misses += 1
+        epoch = self.epoch
+        scms = {v: ScmVar('_{}'.format(i)) for i, v in enumerate(qvs)}
+        rows = []
+        ground = True
+        for ans in self.kb.solve(goal):
+            if rows is not None:
+                row = tuple(ans.get(v, _OPEN) for v in qvs)
+                if sen_vars(row):
+                    ground = False
+                    row = generalize(row, scms)
+                rows.append(row)
+                if len(rows) > self.maxanswers:
+                    rows = None
+            yield ans
+        if rows is not None:
+            with self.kb.lock:
+                if epoch == self.epoch:
+                    self.store(key, set(callees(goal)), rows, ground)
+
+    def store(self, key, verbs, rows, ground):
+        if key in self.entries:
+            self.drop(key)
+        self.entries[key] = (verbs, rows, ground)
+        for verb in verbs:
+            self.by_verb.setdefault(verb, {})[key] = None
+        self.size += len(rows)
+        while self.entries and (len(self.entries) > self.maxsize or
+                                self.size > self.maxanswers):
+            self.drop(next(iter(self.entries)))
+
+    def drop(self, key):
+        verbs, rows, _ = self.entries.pop(key)
+        self.size -= len(rows)
+        for verb in verbs:
+            keys = self.by_verb[verb]
+            del keys[key]
+            if not keys:
+                del self.by_verb[verb]
+
+    def changed(self, verb):
+        "Drop the entries depending on the predicate named `verb`."
+        self.epoch += 1
+        if self.entries:
+            verbs = self.kb.dependents(verb)
+            verbs.add(verb)
+            for verb in verbs:
+                for key in list(self.by_verb.get(verb, ())):
+                    self.drop(key)
+
+    def clear(self):
+        with self.kb.lock:
+            self.entries.clear()
+            self.by_verb.clear()
+            self.size = 0
+            self.epoch += 1
+
+
+# Built-in predicates
+#
+# Predicates not told into a KB may be answered natively: a built-in
+# is a generator of `(kb, goal, u)` binding `u` in place, yielding it for
+# every answer and undoing its own bindings, like the `ask_*` methods.
+# The list built-ins walk list terms in loops and share the storage of
+# the lists they get, e.g. `append` splitting a list into views.
+BUILTINS = {}
+
+
+def builtin(verb):
+    "Register the decorated generator as built-in predicate `verb`."
+    def register(f):
+        BUILTINS[verb] = f
+        return f
+    return register
+
+
+def fresh_vars(u, n):
+    return [Var('_#{}'.format(next(u.fresh))) for _ in range(n)]
+
+
+def list_parts(u, x):
+    "Elements of list `x` bound in `u` and its tail which is no list."
+    while isinstance(x, Var) and x in u:
+        x = u[x]
+    if isinstance(x, TermList):
+        return x.parts(u)
+    return [], x
+
+
+@builtin('append')
+def ask_append(kb, goal, u):
+    "append(Xs, Ys, Zs): Zs is Xs followed by Ys."
+    x, y, z = goal.terms
+    m = u.mark()
+    xs, xt = list_parts(u, x)
+    if xt is None:
+        # Ys is shared as the tail, as are the elements of a flat Xs.
+        x = subst(u, x)
+        if isinstance(x, TermList) and x.tail is None:
+            xy = TermList(x.items, y, x.start)
+        else:
+            xy = lst(xs, y)
+        if unify(z, xy, u) is not FAIL:
+            yield u
+        u.undo(m)
+        return
+    if not isinstance(xt, Var):
+        return
+    zs, zt = list_parts(u, z)
+    if zt is None:
+        # Split Zs into a copied prefix and a view of the rest.
+        zs = lst(zs)
+        es = zs.items if zs is not None else ()
+        for k in range(len(es) + 1):
+            if unify(x, lst(es[:k]), u) is not FAIL and \
+                    unify(y, zs.view(k) if k else zs, u) is not FAIL:
+                yield u
+            u.undo(m)
+        return
+    if not isinstance(zt, Var):
+        # Zs ends in no list: Ys takes that end.
+        for k in range(len(zs) + 1):
+            if unify(x, lst(zs[:k]), u) is not FAIL and \
+                    unify(y, lst(zs[k:], zt), u) is not FAIL:
+                yield u
+            u.undo(m)
+        return
+    # Xs ever longer
+    for n in count():
+        es = fresh_vars(u, n)
+        if unify(xt, lst(es), u) is not FAIL and \
+                unify(z, lst(xs + es, y), u) is not FAIL:
+            yield u
+        u.undo(m)
+
+
+@builtin('length')
+def ask_length(kb, goal, u):
+    "length(Xs, N): list Xs has N elements."
+    x, n = goal.terms
+    m = u.mark()
+    xs, xt = list_parts(u, x)
+    if xt is None:
+        if unify(n, len(xs), u) is not FAIL:
+            yield u
+        u.undo(m)
+        return
+    if not isinstance(xt, Var):
+        return
+    n = subst(u, n)
+    if not isinstance(n, (int, Var)) or isinstance(n, bool):
+        return
+    if isinstance(n, int):
+        if n >= len(xs):
+            if unify(xt, lst(fresh_vars(u, n - len(xs))), u) is not FAIL:
+                yield u
+            u.undo(m)
+        return
+    for k in count(len(xs)):
+        if unify(xt, lst(fresh_vars(u, k - len(xs))), u) is not FAIL and \
+                unify(n, k, u) is not FAIL:
+            yield u
+        u.undo(m)
+
+
+@builtin('member')
+def ask_member(kb, goal, u):
+    "member(X, Xs): X is an element of list Xs."
+    x, l = goal.terms
+    m = u.mark()
+    xs, xt = list_parts(u, l)
+    for e in xs:
+        if unify(x, e, u) is not FAIL:
+            yield u
+        u.undo(m)
+    if not isinstance(xt, Var):
+        return
+    # X at ever later places of the open tail
+    for n in count():
+        es = fresh_vars(u, n + 1)
+        if unify(xt, lst(es[:-1] + [x], es[-1]), u) is not FAIL:
+            yield u
+        u.undo(m)
+
+
+@builtin('once')
+def ask_once(kb, goal, u):
+    "once(G): the first answer of goal G only."
+    m = u.mark()
+    sols = kb.ask_local(goal.terms[0], u)
+    for _ in sols:
+        yield u
+        break
+    sols.close()
+    u.undo(m)
+
+
+# Delayed goals and finite domains
+#
+# An Eq or NotEq goal holding a Func which cannot be evaluated yet,
+# like `y == x * z` or `x > 0` with `x` unbound, is delayed instead of
+# raising: it is attached to its first Var and asked again once that
+# one gets bound. Var's given a range of integers by `fd_domain` turn
+# linear (in)equations over them into constraints, which narrow the
+# bounds of the ranges whenever one of them changes and bind the Var's
+# left with a single value. `fd_labeling` then only tries the values
+# consistent with all constraints so far.
+#
+# The attributes of an unbound Var are kept in `Env.attrs` as a triple
+# (delayed goals, domain, constraints) and trailed like bindings. Every
+# atomic goal answered settles the attributed Var's it bound (`wake`).
+NO_ATTRS = ((), None, ())
+
+RELATIONS = {op.eq: '==', op.ne: '!=', op.ge: '>=', op.le: '<=',
+             op.gt: '>', op.lt: '<'}
+
+
+class Linear(object):
+
+    """Constraint `sum(coef * var for var, coef in coefs) + const rel 0`
+    over integer Var's, `rel` being one of '==', '!=' and '>='.
+
+    """
+
+    __slots__ = ('coefs', 'const', 'rel')
+
+    def __init__(self, coefs, const, rel):
+        self.coefs = coefs
+        self.const = const
+        self.rel = rel
+
+    def __repr__(self):
+        return '{} {} {} 0'.format(
+            ' + '.join('{}*{}'.format(a, v) for v, a in self.coefs.items()),
+            self.const, self.rel)
+
+
+def linear(x):
+    """Coefficients of the Var's and constant of the integer expression
+    `x` as `({var: coef}, const)`, or None if `x` is not linear.
+
+    """
+    if isinstance(x, Var):
+        return {x: 1}, 0
+    elif type(x) is int:
+        return {}, x
+    elif not isinstance(x, Func):
+        return None
+    fs = [linear(a) for a in x.args]
+    if any(f is None for f in fs):
+        return None
+    if x.op in (op.add, op.sub) and len(fs) == 2:
+        (c1, k1), (c2, k2) = fs
+        s = 1 if x.op is op.add else -1
+        cs = dict(c1)
+        for v, a in c2.items():
+            cs[v] = cs.get(v, 0) + s * a
+        return cs, k1 + s * k2
+    elif x.op in (op.neg, op.pos) and len(fs) == 1:
+        (c, k), = fs
+        s = -1 if x.op is op.neg else 1
+        return {v: s * a for v, a in c.items()}, s * k
+    elif x.op is op.mul and len(fs) == 2:
+        (c1, k1), (c2, k2) = fs
+        if c1 and c2:
+            return None
+        c, k = (c1, k2) if c1 else (c2, k1)
+        return {v: k * a for v, a in c.items()}, k1 * k2
+    return None
+
+
+def constraint(goal):
+    "The Linear constraint stated by Eq or NotEq `goal`, if any."
+    s1, s2 = goal.subs
+    rel = '==' if isinstance(goal, Eq) else '!='
+    if rel == '==' and s1 is True and isinstance(s2, Func) and \
+            s2.op in RELATIONS and len(s2.args) == 2:
+        rel = RELATIONS[s2.op]
+        s1, s2 = s2.args
+    l1, l2 = linear(s1), linear(s2)
+    if l1 is None or l2 is None:
+        return None
+    cs = dict(l1[0])
+    for v, a in l2[0].items():
+        cs[v] = cs.get(v, 0) - a
+    k = l1[1] - l2[1]
+    if rel in ('<', '<='):
+        cs = {v: -a for v, a in cs.items()}
+        k = -k
+    if rel in ('<', '>'):
+        k -= 1
+    return Linear({v: a for v, a in cs.items() if a}, k,
+                  rel if rel in ('==', '!=') else '>=')
+
+
+def fd_constraint(u, goal):
+    "The Linear constraint of `goal` if it is one over some Var of domain."
+    c = constraint(goal)
+    if c is not None and any(u.attrs.get(v, NO_ATTRS)[1] is not None
+                             for v in c.coefs):
+        return c
+    return None
+
+
+def residue(u):
+    "Attributes of the Var's left unbound in `u`."
+    return {v: a for v, a in u.attrs.items() if v not in u}
+
+
+def delay(u, v, goal):
+    "Ask `goal` again once unbound `v` gets bound."
+    goals, dom, cons = u.attrs.get(v, NO_ATTRS)
+    u.put(v, (goals + (goal,), dom, cons))
+
+
+def post(u, c):
+    """Attach constraint `c` to its Var's and propagate it. Return the
+    goals woken up, or None if `c` cannot hold.
+
+    """
+    for v in c.coefs:
+        goals, dom, cons = u.attrs.get(v, NO_ATTRS)
+        u.put(v, (goals, dom, cons + (c,)))
+    woken = []
+    return woken if propagate(u, woken, [c]) else None
+
+
+def wake(u):
+    """Settle the attributed Var's bound since last time: check their
+    domains and propagate their constraints. Return the delayed goals
+    woken up, or None if some constraint fails.
+
+    """
+    woken, queue = [], []
+    for v in [v for v in u.attrs if v in u]:
+        if v in u.attrs and not settle(u, v, woken, queue):
+            return None
+    return woken if propagate(u, woken, queue) else None
+
+
+def settle(u, v, woken, queue):
+    "Take over the attributes of `v` just bound."
+    goals, dom, cons = u.attrs[v]
+    u.put(v, None)
+    woken.extend(goals)
+    queue.extend(cons)
+    x = v
+    while isinstance(x, Var) and x in u:
+        x = u[x]
+    if isinstance(x, Var):
+        # Bound to another Var, which gets the constraints and domain.
+        goals1, dom1, cons1 = u.attrs.get(x, NO_ATTRS)
+        u.put(x, (goals1, dom1, cons1 + cons))
+        return dom is None or restrict(u, x, dom[0], dom[1], woken, queue)
+    return dom is None or type(x) is int and dom[0] <= x <= dom[1]
+
+
+def restrict(u, x, lo, hi, woken, queue):
+    """Narrow the domain of `x` to `lo..hi`, binding it if a single
+    value is left. Return whether any is.
+
+    """
+    while isinstance(x, Var) and x in u:
+        x = u[x]
+    if not isinstance(x, Var):
+        return type(x) is int and lo <= x <= hi
+    goals, dom, cons = u.attrs.get(x, NO_ATTRS)
+    if dom is not None:
+        lo, hi = max(lo, dom[0]), min(hi, dom[1])
+        if (lo, hi) == dom:
+            return True
+    if lo > hi:
+        return False
+    if lo == hi:
+        u.bind(x, lo)
+        return settle(u, x, woken, queue) if x in u.attrs else True
+    u.put(x, (goals, (lo, hi), cons))
+    queue.extend(c for c in cons if c not in queue)
+    return True
+
+
+def propagate(u, woken, queue):
+    "Narrow domains by the constraints in `queue` until none changes."
+    while queue:
+        if not narrow(u, queue.pop(), woken, queue):
+            return False
+    return True
+
+
+def narrow(u, c, woken, queue):
+    """Narrow the domains of the Var's of constraint `c` to the bounds
+    it allows. Return False if it cannot hold.
+
+    """
+    k = c.const
+    terms = []
+    for v, a in c.coefs.items():
+        x = v
+        while isinstance(x, Var) and x in u:
+            x = u[x]
+        if isinstance(x, Var):
+            dom = u.attrs.get(x, NO_ATTRS)[1]
+            if dom is None:
+                # Unbounded, checked once bound.
+                return True
+            terms.append((x, a, dom))
+        elif type(x) is int:
+            k += a * x
+        else:
+            return False
+    if c.rel == '!=':
+        if not terms:
+            return k != 0
+        if len(terms) == 1:
+            x, a, (lo, hi) = terms[0]
+            if k % a == 0:
+                if -k // a == lo:
+                    return restrict(u, x, lo + 1, hi, woken, queue)
+                elif -k // a == hi:
+                    return restrict(u, x, lo, hi - 1, woken, queue)
+        return True
+    # Each term `a * x` lies within `t0..t1`, their sum within `s0..s1`.
+    spans = [(a * lo, a * hi) if a > 0 else (a * hi, a * lo)
+             for x, a, (lo, hi) in terms]
+    s0 = sum(t0 for t0, t1 in spans) + k
+    s1 = sum(t1 for t0, t1 in spans) + k
+    eq = c.rel == '=='
+    if s1 < 0 or eq and s0 > 0:
+        return False
+    for (x, a, (lo, hi)), (t0, t1) in zip(terms, spans):
+        # a * x >= t1 - s1, and a * x <= t0 - s0 for an equation.
+        if a > 0:
+            lo = max(lo, -((s1 - t1) // a))
+            if eq:
+                hi = min(hi, (t0 - s0) // a)
+        else:
+            hi = min(hi, (t1 - s1) // a)
+            if eq:
+                lo = max(lo, -((s0 - t0) // a))
+        if not restrict(u, x, lo, hi, woken, queue):
+            return False
+    return True
+
+
+@builtin('fd_domain')
+def ask_fd_domain(kb, goal, u):
+    "fd_domain(Xs, Lo, Hi): the integers Xs (or X) lie within Lo..Hi."
+    x, lo, hi = (subst(u, t) for t in goal.terms)
+    if type(lo) is not int or type(hi) is not int:
+        raise ValueError('Integer bounds expected: {}'.format(goal))
+    xs = list_parts(u, x)[0] if isinstance(x, TermList) else [x]
+    m = u.mark()
+    woken, queue = [], []
+    if all(restrict(u, x, lo, hi, woken, queue) for x in xs) and \
+            propagate(u, woken, queue):
+        yield from kb.ask_woken(woken, u)
+    u.undo(m)
+
+
+@builtin('fd_labeling')
+def ask_fd_labeling(kb, goal, u):
+    "fd_labeling(Xs): bind the Var's Xs (or X) to the values of their domains."
+    x = subst(u, goal.terms[0])
+    xs = list_parts(u, x)[0] if isinstance(x, TermList) else [x]
+    return label(kb, xs, 0, u)
+
+
+def label(kb, xs, i, u):
+    while i < len(xs) and not isinstance(subst(u, xs[i]), Var):
+        i += 1
+    if i == len(xs):
+        yield u
+        return
+    x = subst(u, xs[i])
+    dom = u.attrs.get(x, NO_ATTRS)[1]
+    if dom is None:
+        raise ValueError('Cannot label {} without a domain.'.format(x))
+    m = u.mark()
+    for n in range(dom[0], dom[1] + 1):
+        u.bind(x, n)
+        for _ in kb.wake(u):
+            yield from label(kb, xs, i + 1, u)
+        u.undo(m)
+
+
+# Aggregates
+#
+# An aggregate built-in answers its goal inside the engine on the Env
+# of the caller and folds the instances of its template into a single
+# result, with no answer dict made per answer: e.g. `count(G, N)`,
+# `sum(X, G, S)` or `findall(X, G, Xs)`, the goal being any sentence
+# like `G1 & G2`. `group_by(Keys, A)` folds aggregate goal `A`
+# separately for each distinct instance of `Keys`, like GROUP BY.
+#
+# Each aggregate is registered as `(start, step, stop)`: folding
+# starts from `start()`, `step(acc, x)` takes each instance `x` and
+# `stop(acc)` gives the result, or FAIL if there is none.
+AGGREGATES = {}
+
+
+def aggregate(verb, start, stop=lambda acc: acc):
+    "Register the decorated step function as aggregate `verb`."
+    def register(step):
+        AGGREGATES[verb] = (start, step, stop)
+        BUILTINS[verb] = ask_aggregate
+        return step
+    return register
+
+
+def standard_order(x):
+    "Sort key putting numbers before strings before other terms."
+    if isinstance(x, (int, float)) and not isinstance(x, bool):
+        return (0, x, '')
+    elif isinstance(x, str):
+        return (1, 0, x)
+    return (2, 0, repr(x))
+
+
+def ask_aggregate(kb, goal, u):
+    "Fold the template instances of aggregate `goal` into its result."
+    start, step, stop = AGGREGATES[goal.verb]
+    tmpl, sub, res = aggregate_parts(goal)
+    acc = start()
+    for _ in kb.ask_local(sub, u):
+        acc = step(acc, None if tmpl is None else subst(u, tmpl))
+    r = stop(acc)
+    if r is not FAIL:
+        m = u.mark()
+        if unify(res, r, u) is not FAIL:
+            yield u
+        u.undo(m)
+
+
+@aggregate('count', lambda: 0)
+def count_step(acc, x):
+    return acc + 1
+
+
+@aggregate('sum', lambda: 0)
+def sum_step(acc, x):
+    return acc + x
+
+
+@aggregate('max', lambda: FAIL)
+def max_step(acc, x):
+    return x if acc is FAIL or x > acc else acc
+
+
+@aggregate('min', lambda: FAIL)
+def min_step(acc, x):
+    return x if acc is FAIL or x < acc else acc
+
+
+@aggregate('bagof', list, lambda acc: lst(acc) if acc else FAIL)
+@aggregate('findall', list, lst)
+def collect_step(acc, x):
+    acc.append(x)
+    return acc
+
+
+@aggregate('setof', dict, lambda acc: lst(sorted(
+    acc.values(), key=standard_order)) if acc else FAIL)
+def setof_step(acc, x):
+    acc.setdefault(variant(x), x)
+    return acc
+
+
+def aggregate_parts(goal):
+    "Template, goal and result of aggregate goal `goal`."
+    if goal.verb not in AGGREGATES:
+        raise ValueError('Aggregate goal expected: {}'.format(goal))
+    *tmpl, sub, res = goal.terms
+    if goal.verb == 'count':
+        if tmpl:
+            raise ValueError('count(Goal, N) takes no template: {}'.format(
+                goal))
+        return None, sub, res
+    if len(tmpl) != 1:
+        raise ValueError('{}(Template, Goal, Result) expected: {}'.format(
+            goal.verb, goal))
+    return tmpl[0], sub, res
+
+
+@builtin('group_by')
+def ask_group_by(kb, goal, u):
+    "group_by(Keys, A): aggregate goal A for each instance of Keys."
+    keys, agg = goal.terms
+    agg = subst(u, agg)
+    start, step, stop = AGGREGATES[agg.verb]
+    tmpl, sub, res = aggregate_parts(agg)
+    groups = odict()
+    for _ in kb.ask_local(sub, u):
+        k = subst(u, keys)
+        key = variant(k)
+        g = groups.get(key)
+        if g is None:
+            g = groups[key] = [k, start()]
+        g[1] = step(g[1], None if tmpl is None else subst(u, tmpl))
+    m = u.mark()
+    for k, acc in groups.values():
+        r = stop(acc)
+        if r is not FAIL and unify(keys, k, u) is not FAIL and \
+                unify(res, r, u) is not FAIL:
+            yield u
+        u.undo(m)
+
+
+# Profiling
+#
+# While a `Profile` is active on a KB, every predicate call is
+# wrapped to count its ports (call, exit, redo, fail) and the time
+# spent inside, and the engines count their calls of `unify` and
+# `univ_inst` on it. Nothing is checked but `kb.profiler` otherwise.
+PORTS = ('call', 'exit', 'redo', 'fail')
+
+
+class Profile(object):
+
+    """Counts of a KB engine's work, active within a `with` block:
+
+        with kb.profile() as prof:
+            list(kb.ask(goal))
+        print(prof.table())
+
+    `preds` maps the key of each called predicate to its port counts
+    and its `time`, not including the time of the predicates it calls
+    in turn. Predicates joined on their fact tables only count calls
+    and exits, their time going to the caller. `clauses` maps each
+    clause tried to the number of `try`s of its head and of `exit`s
+    through it, fact table rows counting as the clause `'<facts>'`.
+    `counts` has the calls of `unify` and `univ_inst` made by the KB
+    or a Solver upon it to resolve goals, built-ins aside.
+
+    """
+
+    def __init__(self, kb):
+        self.kb = kb
+        self.preds = {}
+        self.clauses = odict()  # (key, id) -> [key, clause, try, exit]
+        self.counts = {'unify': 0, 'univ_inst': 0}
+        self.stack = [None]     # predicates running, innermost last
+        self.times = {None: 0.0}
+        self.last = None
+        self.saved = None
+
+    def __enter__(self):
+        self.saved = self.kb.profiler
+        self.kb.profiler = self
+        self.last = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.switch()
+        self.kb.profiler = self.saved
+        return False
+
+    def tally(self, *names):
+        "Count a call of each of the engine functions `names`."
+        for name in names:
+            self.counts[name] += 1
+
+    def switch(self):
+        "Charge the time since the last switch to the running predicate."
+        now = time.perf_counter()
+        top = self.stack[-1]
+        self.times[top] = self.times.get(top, 0.0) + now - self.last
+        self.last = now
+
+    def stat(self, key):
+        st = self.preds.get(key)
+        if st is None:
+            st = self.preds[key] = dict.fromkeys(PORTS, 0)
+        return st
+
+    def ports(self, key, sols):
+        "Generate from `sols`, counting them as the ports of `key`."
+        st = self.stat(key)
+        st['call'] += 1
+        stack = self.stack
+        while True:
+            self.switch()
+            stack.append(key)
+            try:
+                next(sols)
+            except StopIteration:
+                st['fail'] += 1
+                return
+            finally:
+                self.switch()
+                stack.pop()
+            st['exit'] += 1
+            yield
+            st['redo'] += 1
+
+    def clause(self, key, sen):
+        "Count a try of `sen` and give its counts."
+        c = self.clauses.get((key, id(sen)))
+        if c is None:
+            c = self.clauses[key, id(sen)] = [key, sen, 0, 0]
+        c[2] += 1
+        return c
+
+    def stats(self):
+        "Give the counts of each predicate with its time as a dict."
+        res = {}
+        for key, st in self.preds.items():
+            st = dict(st)
+            st['time'] = self.times.get(key, 0.0)
+            res[key] = st
+        return res
+
+    def table(self, limit=None):
+        "Format the predicates by time spent as a table."
+        stats = self.stats()
+        keys = sorted(stats, key=lambda k: -stats[k]['time'])[:limit]
+        lines = ['{:<20} {:>9} {:>9} {:>9} {:>9} {:>10}'.format(
+            'predicate', *PORTS + ('time',))]
+        for key in keys:
+            st = stats[key]
+            lines.append('{:<20} {:>9} {:>9} {:>9} {:>9} {:>10.6f}'.format(
+                key, *(st[p] for p in PORTS + ('time',))))
+        lines.append('unify: {unify}, univ_inst: {univ_inst}'.format(
+            **self.counts))
+        return '\n'.join(lines)
+
+
+# Parallel queries fork worker processes, which find the KB, goal
+# asked and its alternatives among the module globals they inherit.
+_forked = {}                    # token -> (KB, goal, alternatives)
+_fork_count = count()
+
+
+def _ask_branches(task):
+    token, lo, hi = task
+    kb, goal, alts = _forked[token]
+    return list(kb.ask_branches(goal, alts[lo:hi]))
+
+
+def locked(method):
+    "Make `method` of a KB run holding the lock of the KB."
+    @wraps(method)
+    def run(kb, *args, **kw):
+        with kb.lock:
+            return method(kb, *args, **kw)
+    return run
+
+
 class KB(object):
 
-    def __init__(self):
+    """Knowledge base answering queries from many threads at once.
+
+    Telling, retracting, loading and the lookups of clauses by queries
+    are serialized by `lock`, and each query runs on the snapshots of
+    clause lists it looked up (the logical update view), renaming
+    clauses by the counter of its own `Env`. Tables are filled holding
+    the lock, so that other threads only ever see complete ones.
+
+    """
+
+    def __init__(self, plan=False, cache=None):
         self.base = odict()
+        self.tabled = set()
+        self.tables = {}        # variant key -> Table
+        self.table_stack = []   # Tables under evaluation
+        self.table_news = 0     # Number of answers ever tabled
+        self.table_hits = 0     # Number of calls to incomplete tables
+        self.table_passes = 0   # Number of evaluations of tabled clauses
+        self.table_watch = []   # [Table, answers read] by consuming calls
+        self.watchers = []      # Notified of each told/retracted sentence
+        self._callers = None    # verb -> verbs of rules calling it
+        self.symbols = Symbols()
+        self.lock = threading.RLock()
+        # Reorders conjunctions if planning.
+        self.planner = Planner(self) if plan else None
+        # Keeps answers of up to `cache` queries if given.
+        self.cache = AnswerCache(self, cache) if cache else None
+        # Counts the work of queries while profiling.
+        self.profiler = None
 
     def __repr__(self):
         return pformat(list(r for rs in self.base.values() for r in rs))
@@ -584,22 +2766,483 @@ class KB(object):
             raise NotImplementedError
 
     # ADD
+    @locked
     def add(self, sen):
         if sen.key not in self.base:
-            self.base[sen.key] = []
-        self.base[sen.key].append(sen)
+            self.base[sen.key] = Proc(sen.key)
+        proc = self.base[sen.key]
+        # Ground facts are stored as rows of interned constants.
+        if not (isinstance(sen, Pred) and proc.add_fact(self.symbols, sen)):
+            proc.add(sen)
+        self.changed(sen)
+        for w in self.watchers:
+            w.told(sen)
+
+    # RETRACT
+    @locked
+    def retract(self, sen):
+        """Retract the first fact unifying with `sen`, or the first rule
+        unifying with `sen` if it is a Rule. Both ScmVar's and Var's in
+        `sen` match anything.
+
+        Return the retracted clause or None.
+
+        """
+        rule = isinstance(sen, Rule)
+        head = sen.lhs if rule else sen
+        proc = self.base.get(head.key)
+        if proc is None:
+            return None
+        pat = univ_inst(generalize(sen))
+        for i, c, r in proc.entries(Proc.head(pat)):
+            if r is not None:
+                if not rule and matches(proc.facts.pred(proc.key, r), pat):
+                    c = proc.remove_row(r)
+                    self.removed(c)
+                    return c
+            elif isinstance(c, Rule) is rule and (
+                    c is sen or matches(univ_inst(c), pat)):
+                self.removed(proc.remove(i))
+                return c
+        return None
+
+    @locked
+    def retract_all(self, head):
+        """Retract all facts and rules whose head unifies with `head`.
+        Return the number of retracted clauses.
+
+        """
+        proc = self.base.get(head.key)
+        if proc is None:
+            return 0
+        pat = univ_inst(generalize(head))
+        n = 0
+        for i, c, r in proc.entries(pat):
+            if r is not None:
+                if matches(proc.facts.pred(proc.key, r), pat):
+                    self.removed(proc.remove_row(r))
+                    n += 1
+            elif matches(univ_inst(Proc.head(c)), pat):
+                self.removed(proc.remove(i))
+                n += 1
+        return n
+
+    def removed(self, sen):
+        self.changed(sen)
+        for w in self.watchers:
+            w.retracted(sen)
+
+    # LOAD
+    @locked
+    def load(self, verb, rows, types=None):
+        """Bulk-tell ground facts of predicate `verb` into its columnar
+        fact table, interning their constants.
+
+        `rows` is an iterable of tuples, or the path of a CSV file whose
+        fields are converted by the callables in `types` if given.
+
+        """
+        if isinstance(rows, (str, bytes)) or hasattr(rows, '__fspath__'):
+            with open(rows, newline='') as f:
+                return self.load(verb, csv.reader(f), types)
+        rows = iter(rows)
+        cols = None
+        # Transpose and intern chunk by chunk.
+        for chunk in iter(lambda: list(islice(rows, 1 << 16)), []):
+            if types is not None:
+                chunk = [[t(v) for t, v in zip(types, row)] for row in chunk]
+            if cols is None:
+                cols = [array('q') for _ in chunk[0]]
+            if set(map(len, chunk)) != {len(cols)}:
+                raise ValueError('Rows of arity {} expected.'.format(
+                    len(cols)))
+            for col, vs in zip(cols, zip(*chunk)):
+                col.extend(self.symbols.intern_all(vs))
+        if cols is None:
+            return 0
+        return self.load_ids(verb, cols)
+
+    @locked
+    def load_columns(self, verb, *columns):
+        """Bulk-tell ground facts of predicate `verb` given by equally
+        long `columns`, i.e. sequences like lists, `array.array` or NumPy
+        arrays of argument constants.
+
+        """
+        cols = []
+        for col in columns:
+            if hasattr(col, 'tolist'):
+                col = col.tolist()
+            cols.append(self.symbols.intern_all(col))
+        return self.load_ids(verb, cols)
+
+    def load_ids(self, verb, cols):
+        if verb not in self.base:
+            self.base[verb] = Proc(verb)
+        proc = self.base[verb]
+        n0 = len(proc.facts.ords) if proc.facts is not None else 0
+        proc.load(self.symbols, cols)
+        facts = proc.facts
+        n = len(facts.ords) - n0
+        self.changed(Pred(verb))
+        for w in self.watchers:
+            w.loaded(verb, [facts.row(r) for r in range(n0, n0 + n)])
+        return n
+
+    # SNAPSHOT
+    #
+    # A snapshot file starts with `SNAPSHOT` and the length of a pickled
+    # header, which holds the clauses of each procedure and the layout
+    # of its fact table. The ordinals and columns of ids of the fact
+    # tables follow as raw 8-byte integers aligned to 8, and the
+    # pickled symbols last.
+    SNAPSHOT = b'PRYOKB1\n'
+
+    @locked
+    def save(self, path):
+        """Save the KB to a snapshot file at `path`, cf. `KB.open`.
+
+        Clauses and constants are pickled, so rules with a Func upon a
+        lambda or any other function not importable by name cannot be
+        saved.
+
+        """
+        blocks = []
+        procs = []
+        offset = 0
+        for key, proc in self.base.items():
+            layout = None
+            facts = proc.facts
+            if facts is not None:
+                cols = [facts.ords] + facts.cols
+                if facts.dead:
+                    live = [r for r in range(len(facts.ords))
+                            if r not in facts.dead]
+                    cols = [array('q', (c[r] for r in live)) for c in cols]
+                n = len(cols[0])
+                layout = (facts.arity, n, offset)
+                blocks.extend(cols)
+                offset += 8 * n * len(cols)
+            procs.append((key, proc.ordinal, proc.clauses, layout))
+        symbols = pickle.dumps(self.symbols.values, pickle.HIGHEST_PROTOCOL)
+        header = pickle.dumps({
+            'byteorder': sys.byteorder,
+            'symbols': (offset, len(symbols)),
+            'tabled': sorted(self.tabled),
+            'procs': procs,
+        }, pickle.HIGHEST_PROTOCOL)
+        with open(path, 'wb') as f:
+            f.write(self.SNAPSHOT)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            f.write(bytes(-f.tell() % 8))
+            for col in blocks:
+                f.write(memoryview(col).cast('B'))
+            f.write(symbols)
+
+    @classmethod
+    def open(cls, path, mmap=True, **options):
+        """Make a KB from the snapshot file at `path`, cf. `KB.save`.
+
+        Given `mmap`, the fact tables are read straight from the file
+        mapped into memory, which processes opening the same file
+        share. Tables get copied only once facts are told into them.
+        Other `options` go to `KB`.
+
+        Clauses and constants are unpickled, which may run arbitrary
+        code: only open snapshots from trusted sources.
+
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(cls.SNAPSHOT)) != cls.SNAPSHOT:
+                raise ValueError('Not a KB snapshot: {}'.format(path))
+            size = int.from_bytes(f.read(8), 'little')
+            header = pickle.loads(f.read(size))
+            start = f.tell() + -f.tell() % 8
+            swap = header['byteorder'] != sys.byteorder
+            if mmap and not swap:
+                data = memoryview(mapfile(f.fileno(), 0, access=ACCESS_READ))
+            else:
+                f.seek(start)
+                data = memoryview(f.read())
+                start = 0
+        kb = cls(**options)
+        offset, size = header['symbols']
+        symbols = data[start + offset:start + offset + size]
+        kb.symbols = Symbols(lambda: pickle.loads(symbols))
+        kb.tabled.update(header['tabled'])
+        for key, ordinal, clauses, layout in header['procs']:
+            proc = kb.base[key] = Proc(key)
+            proc.clauses.update(clauses)
+            proc.ordinal = ordinal
+            proc.build(0)
+            if layout is not None:
+                arity, n, offset = layout
+                facts = proc.facts = FactTable(kb.symbols, arity)
+                cols = []
+                for j in range(arity + 1):
+                    lo = start + offset + 8 * n * j
+                    col = data[lo:lo + 8 * n].cast('q')
+                    if swap or not mmap:
+                        col = ids_array(col)
+                        if swap:
+                            col.byteswap()
+                    cols.append(col)
+                facts.ords = cols[0]
+                facts.cols = cols[1:]
+        return kb
+
+    # DEPENDENCY
+    def dependents(self, verb):
+        """Verbs of predicates whose rules call `verb`, directly or
+        indirectly.
+
+        """
+        if self._callers is None:
+            self._callers = {}
+            for proc in self.base.values():
+                for sen in proc.clauses.values():
+                    if isinstance(sen, Rule):
+                        for v in callees(sen.rhs):
+                            self._callers.setdefault(v, set()).add(sen.key)
+        found = set()
+        todo = [verb]
+        while todo:
+            for v in self._callers.get(todo.pop(), ()):
+                if v not in found:
+                    found.add(v)
+                    todo.append(v)
+        return found
+
+    def changed(self, sen):
+        "Drop whatever gets outdated by telling or retracting `sen`."
+        if isinstance(sen, Rule):
+            self._callers = None
+        if self.planner is not None:
+            self.planner.reset()
+        # Answers cached for affected queries.
+        if self.cache is not None:
+            self.cache.changed(sen.key)
+        # Answers tabled for affected predicates.
+        if self.tables and not self.table_stack:
+            verbs = self.dependents(sen.key)
+            verbs.add(sen.key)
+            for k in [k for k, t in self.tables.items()
+                      if t.goal.key in verbs]:
+                del self.tables[k]
+
+    # TABLE
+    @locked
+    def table(self, *verbs):
+        """Evaluate the predicates named `verbs` in table mode.
+
+        Answers of each called subgoal variant are memoized and reused,
+        which also makes left-recursive and cyclic definitions
+        terminate as long as the answers are finite.
+
+        """
+        self.tabled.update(verbs)
+        self.tables.clear()
 
     # ASK
-    def ask(kb, goal):
-        stand_reset()
-        for u in kb.ask_1(goal, {}):
-            # Update all RHS in `u` recursively thus each rooted Var
-            # gets substituted by its root.
-            u1 = updated_subst(u)
-            for k in set(u):
-                if '#' in k.symbol:
-                    u1.pop(k)
-            yield u1
+    def ask(kb, goal, workers=None, ordered=True, limits=None):
+        """Generate the answers of `goal` as dicts binding its Var's.
+
+        Given more than one of `workers`, the alternatives of the first
+        conjunct are explored in parallel by as many forked processes,
+        yielding the answers in sequential order unless not `ordered`.
+
+        Given `limits`, the query raises `ResourceError` as soon as it
+        exceeds any of them. Such queries are neither cached nor run
+        in parallel.
+
+        """
+        if limits is not None:
+            return kb.solve(goal, limits)
+        if workers is not None and workers > 1:
+            return kb.ask_parallel(goal, workers, ordered)
+        if kb.cache is not None:
+            return kb.cache.ask(goal)
+        return kb.solve(goal)
+
+    def profile(kb):
+        "Give a `Profile` counting the work of queries within `with`."
+        return Profile(kb)
+
+    def lookup(kb, proc, goal):
+        "Snapshot of the clauses of `proc` possibly matching `goal`."
+        with kb.lock:
+            return proc.lookup(goal)
+
+    def solve(kb, goal, limits=None):
+        "Answer `goal` by resolution, bypassing the cache."
+        u = Env()
+        if kb.planner is not None:
+            goal = kb.planner.body(None, goal, u)
+        if limits is None:
+            for _ in kb.ask_1(goal, u):
+                yield answer(u)
+        else:
+            lim = u.limits = limits.started()
+            for _ in kb.ask_1(goal, u):
+                lim.answer()
+                yield answer(u)
+
+    def ask_first(kb, goal, limits=None):
+        """First answer of `goal`, or None if it has none. The search
+        stops there, bypassing the cache.
+
+        """
+        sols = kb.solve(goal, limits)
+        try:
+            return next(sols, None)
+        finally:
+            sols.close()
+
+    # ASK in batch.
+    def ask_many(kb, goals):
+        """Answer each of `goals`, yielding pairs `(goal, answer)` in the
+        order of `goals`.
+
+        Goals upon predicates made of ground facts only, with constants
+        or distinct Var's as arguments, are grouped by predicate and
+        bound argument positions. Each group is answered set-at-a-time
+        by one join against the fact table.
+
+        """
+        goals = list(goals)
+        groups = odict()        # (verb, bound positions) -> [goal index]
+        batched = {}            # verb -> whether made of facts only
+        for i, goal in enumerate(goals):
+            key = kb.batch_key(goal, batched)
+            if key is not None:
+                groups.setdefault(key, []).append(i)
+        results = {}            # goal index -> answers
+        for (verb, positions), idxs in groups.items():
+            facts = kb.base[verb].facts
+            find = facts.symbols.find
+            vs = facts.symbols.values
+            keys = {}
+            for i in idxs:
+                results[i] = []
+                terms = goals[i].terms
+                ks = tuple(find(terms[p]) for p in positions)
+                if None not in ks:
+                    keys.setdefault(ks, []).append(i)
+            free = [p for p in range(facts.arity) if p not in positions]
+            cols = [facts.cols[p] for p in free]
+            with kb.lock:
+                found = facts.probe(positions, keys)
+            for ks, rows in found.items():
+                for i in keys[ks]:
+                    terms = goals[i].terms
+                    ts = [(col, terms[p]) for col, p in zip(cols, free)]
+                    results[i] = [{t: vs[col[r]] for col, t in ts}
+                                  for r in rows]
+        for i, goal in enumerate(goals):
+            answers = results[i] if i in results else kb.ask(goal)
+            for ans in answers:
+                yield goal, ans
+
+    def batch_key(kb, goal, batched=None):
+        """Group of `goal` for `ask_many` to join, or None. Predicates
+        found to be made of facts only may be memoized in `batched`.
+
+        """
+        if not isinstance(goal, Pred):
+            return None
+        ok = None if batched is None else batched.get(goal.key)
+        if ok is None:
+            proc = kb.base.get(goal.key)
+            ok = not (goal.key in kb.tabled or proc is None or
+                      proc.clauses or proc.facts is None or
+                      proc.facts.symbols.mixed)
+            if batched is not None:
+                batched[goal.key] = ok
+        if not ok or len(goal.terms) != kb.base[goal.key].facts.arity:
+            return None
+        seen = set()
+        positions = []
+        for pos, t in enumerate(goal.terms):
+            if isinstance(t, Var):
+                if t in seen:
+                    return None
+                seen.add(t)
+            elif index_key(t) is _OPEN or isinstance(t, TermCnpd):
+                return None
+            else:
+                positions.append(pos)
+        return goal.key, tuple(positions)
+
+    # ASK in parallel.
+    #
+    # The alternatives of the first conjunct, being candidate clauses
+    # of a predicate or disjuncts, are looked up once and split into
+    # ranges among the workers. Each of them follows its branches
+    # through the rest of the conjunction on its own forked copy of the
+    # KB, so the pool is forked anew for every query.
+    def branching(kb, goal):
+        "Split `goal` into its first conjunct and the rest or None."
+        goals = conjuncts(goal)
+        rest = None
+        for g in goals[1:]:
+            rest = g if rest is None else And(rest, g)
+        return goals[0], rest
+
+    def branches(kb, goal):
+        "Alternatives of the first conjunct or None."
+        first, _ = kb.branching(goal)
+        if isinstance(first, Or):
+            return first.subs
+        elif isinstance(first, Pred) and first.key in kb.base and \
+                first.key not in kb.tabled:
+            cands = kb.lookup(kb.base[first.key], first)
+            # A cut commits to its clause, pruning the workers of later ones.
+            if any(isinstance(sen, Rule) and sen.cuts for sen in cands):
+                return None
+            return cands
+        return None
+
+    def ask_branches(kb, goal, alts):
+        "Answers of `goal` through the alternatives `alts` of its first."
+        u = Env()
+        first, rest = kb.branching(goal)
+        if isinstance(first, Or):
+            sols = (u for sub in alts for _ in kb.ask_1(sub, u))
+        else:
+            sols = kb.ask_clauses(first, u, alts)
+        for _ in sols:
+            if rest is None:
+                yield answer(u)
+            else:
+                for _ in kb.ask_1(rest, u):
+                    yield answer(u)
+
+    def ask_parallel(kb, goal, workers, ordered=True):
+        if kb.planner is not None:
+            goal = kb.planner.body(None, goal, Env())
+        alts = kb.branches(goal)
+        n = 0 if alts is None else len(alts)
+        if n < 2 or 'fork' not in mp.get_all_start_methods():
+            yield from kb.solve(goal)
+            return
+        k = min(n, workers * 4)
+        token = next(_fork_count)
+        tasks = [(token, n * i // k, n * (i + 1) // k) for i in range(k)]
+        _forked[token] = (kb, goal, alts)
+        try:
+            # Fork no copy of the KB amid a change by another thread.
+            with kb.lock:
+                pool = mp.get_context('fork').Pool(min(workers, k))
+            with pool:
+                if ordered:
+                    results = pool.imap(_ask_branches, tasks)
+                else:
+                    results = pool.imap_unordered(_ask_branches, tasks)
+                for answers in results:
+                    yield from answers
+        finally:
+            del _forked[token]
 
     # Dispatch ASK of 1 query.
     def ask_1(kb, goal0, u):
@@ -623,55 +3266,430 @@ class KB(object):
     def ask_atom(kb, goal, u):
         'Dispatch Atomic Sentence asked.'
         if isinstance(goal, Eq):
-            yield from kb.ask_eq(goal, u)
+            sols = kb.ask_eq(goal, u)
         elif isinstance(goal, NotEq):
-            yield from kb.ask_not_eq(goal, u)
+            sols = kb.ask_not_eq(goal, u)
+        elif type(goal) is Cut:
+            sols = kb.ask_cut(goal, u)
         else:
-            yield from kb.ask_pred(goal, u)
+            sols = kb.ask_pred(goal, u)
+        for _ in sols:
+            if u.attrs:
+                yield from kb.wake(u)
+            else:
+                yield u
+
+    # Each ask_* generator binds `u` in place, yields it for every
+    # answer and undoes its own bindings before trying the next
+    # alternative. Whoever abandons a generator early must close it
+    # and roll `u` back to the mark taken before.
 
     def ask_eq(kb, goal, u):
         s1, s2 = goal.subs
-        u1 = unify(s1, s2, u)
-        if u1 is not FAIL:
-            yield u1
+        if has_func(goal):
+            yield from kb.ask_delayed(goal, u)
+            return
+        if kb.profiler is not None:
+            kb.profiler.tally('unify')
+        m = u.mark()
+        if unify(s1, s2, u) is not FAIL:
+            yield u
+        u.undo(m)
 
     def ask_not_eq(kb, goal, u):
         s1, s2 = goal.subs
+        # Over Var's with domains, a disequation is a constraint too.
+        if has_func(goal) or u.attrs and fd_constraint(u, goal):
+            yield from kb.ask_delayed(goal, u)
+            return
+        if kb.profiler is not None:
+            kb.profiler.tally('unify')
+        m = u.mark()
         u1 = unify(s1, s2, u)
+        u.undo(m)
         if u1 is FAIL:
             yield u
 
+    # ASK for delayed goals.
+    #
+    # A goal whose Func's still wait for values is posted as constraint
+    # if linear over Var's with domains, or else delayed on a Var.
+    def ask_delayed(kb, goal, u):
+        m = u.mark()
+        c = fd_constraint(u, goal)
+        if c is not None:
+            yield from kb.ask_woken(post(u, c), u)
+        else:
+            vs = sen_vars([s for s in goal.subs if has_func(s)])
+            if not vs:
+                raise ValueError('Cannot evaluate {}'.format(goal))
+            delay(u, next(iter(vs)), goal)
+            yield u
+        u.undo(m)
+
+    def wake(kb, u):
+        "Yield `u` once the goals woken up by its bindings hold."
+        yield from kb.ask_woken(wake(u), u)
+
+    def ask_woken(kb, goals, u):
+        if goals:
+            yield from kb.ask_conj(goals, 0, u)
+        elif goals is not None:
+            yield u
+
+    def ask_cut(kb, goal, u):
+        yield u
+        # Backtracking into the cut: no more alternatives.
+        if goal.barrier is not None:
+            goal.barrier[0] = True
+
     def ask_pred(kb, goal, u):
-        for sen in kb.base[goal.key]:
+        if u.limits is not None:
+            u.limits.call()
+        if goal.key in kb.tabled:
+            sols = kb.ask_tabled(goal, u)
+        elif goal.key not in kb.base and goal.key in BUILTINS:
+            sols = BUILTINS[goal.key](kb, goal, u)
+        else:
+            sols = kb.ask_clauses(goal, u)
+        if kb.profiler is not None:
+            return kb.profiler.ports(goal.key, sols)
+        return sols
+
+    def ask_clauses(kb, goal, u, cands=None):
+        m = u.mark()
+        proc = kb.base[goal.key]
+        match = None
+        if cands is None:
+            cands = kb.lookup(proc, goal)
+        if u.limits is not None:
+            cands = u.limits.scan(cands)
+        prof = kb.profiler
+        c = None
+        for sen in cands:
+            if not may_match(sen, goal):
+                continue
+            if prof is not None:
+                c = prof.clause(goal.key,
+                                '<facts>' if type(sen) is int else sen)
+            # Row of the fact table
+            if type(sen) is int:
+                if match is None:
+                    match = proc.facts.matcher(goal)
+                if match(sen, u):
+                    if c is not None:
+                        c[3] += 1
+                    yield u
             # Fact
-            if isinstance(sen, SenAtom):
-                fact = univ_inst(sen)
-                u1 = unify(fact, goal, u)
-                if u1 is not FAIL:
-                    yield u1
+            elif isinstance(sen, SenAtom):
+                if prof is not None:
+                    prof.tally('univ_inst', 'unify')
+                fact = univ_inst(sen, None, u.fresh)
+                if unify(fact, goal, u) is not FAIL:
+                    if c is not None:
+                        c[3] += 1
+                    yield u
             # Rule
             elif isinstance(sen, Rule):
-                rule = univ_inst(sen)
-                u1 = unify(rule.lhs, goal, u)
-                if u1 is not FAIL:
-                    yield from kb.ask_and(rule.rhs, u1)
+                if prof is not None:
+                    prof.tally('univ_inst', 'unify')
+                rule = univ_inst(sen, None, u.fresh)
+                if unify(rule.lhs, goal, u) is not FAIL:
+                    body = rule.rhs
+                    if kb.planner is not None:
+                        body = kb.planner.body(sen, body, u)
+                    fence = None
+                    if sen.cuts:
+                        fence = [False]
+                        for x in body_cuts(body):
+                            x.barrier = fence
+                    if u.attrs:
+                        sols = (v for _ in kb.wake(u)
+                                for v in kb.ask_and(body, u, fence))
+                    else:
+                        sols = kb.ask_and(body, u, fence)
+                    if u.limits is not None:
+                        sols = u.limits.enter(sols)
+                    for _ in sols:
+                        if c is not None:
+                            c[3] += 1
+                        yield u
+                    if fence is not None and fence[0]:
+                        u.undo(m)
+                        return
+            u.undo(m)
+
+    # ASK for tabled predicates.
+    #
+    # This is linear tabling: a subgoal variant called for the first
+    # time becomes a table under evaluation and gets its clauses
+    # re-evaluated until no more answers arise, while a recursive call
+    # on a variant under evaluation consumes its answers found so
+    # far. Tables depending on each other are completed together with
+    # the oldest one of them (the leader). Only the leader iterates:
+    # the others (followers) are evaluated once per pass of the leader,
+    # and consumed when called again within the same pass. Every call
+    # consuming an incomplete table is watched: when all calls of a pass
+    # read their tables up to the last answer, another pass would find
+    # nothing new.
+    def ask_tabled(kb, goal, u):
+        goal = walk(u, goal)
+        key = variant(goal)
+        watch = None
+        with kb.lock:
+            tab = kb.tables.get(key)
+            stack = kb.table_stack
+            if tab is None or not tab.complete and tab not in stack and \
+                    not tab.evaluated(stack):
+                tab = kb.fill_table(key, goal, u)
+            elif not tab.complete:
+                kb.table_hits += 1
+                top = stack[-1]
+                on = tab if tab in stack else tab.stamp[0]
+                top.leader = min(top.leader, stack.index(on))
+                watch = [tab, None]     # answers read, once all read
+                kb.table_watch.append(watch)
+        m = u.mark()
+        prof = kb.profiler
+        i = 0
+        while i < len(tab.answers):
+            if prof is not None:
+                prof.tally('univ_inst', 'unify')
+            ans = univ_inst(tab.answers[i], None, u.fresh)
+            if unify(ans, goal, u) is not FAIL:
+                yield u
+            u.undo(m)
+            i += 1
+        if watch is not None:
+            watch[1] = i
+
+    def fill_table(kb, key, goal, caller):
+        tab = kb.tables.get(key)
+        if tab is None:
+            tab = kb.tables[key] = Table(goal)
+        stack = kb.table_stack
+        pos = len(stack)
+        tab.leader = pos
+        stack.append(tab)
+        watches = kb.table_watch
+        first = len(watches)
+        try:
+            while True:
+                tab.passes += 1
+                kb.table_passes += 1
+                news = kb.table_news
+                start = len(watches)
+                u = Env()
+                u.fresh, u.limits = caller.fresh, caller.limits
+                for _ in kb.ask_clauses(goal, u):
+                    # Tables are shared among callers, each checking its
+                    # own attributes on consuming, but keep no answers
+                    # conditional on attributes of their own.
+                    if residue(u):
+                        raise ValueError('Tabled answer of {} under delayed '
+                                         'goals or constraints.'.format(goal))
+                    if tab.add(walk(u, goal)):
+                        kb.table_news += 1
+                # Fix point reached, no answer missed by the calls
+                # consuming incomplete tables, or iterating left to the
+                # leader.
+                if kb.table_news == news or tab.leader < pos or \
+                        all(n == len(t.answers) for t, n in watches[start:]):
+                    break
+        except BaseException:
+            del watches[first:]
+            del stack[pos:]
+            for k in [k for k, t in kb.tables.items() if not t.complete]:
+                del kb.tables[k]
+            raise
+        stack.pop()
+        if tab.leader == pos:
+            del watches[first:]
+            tab.complete = True
+            for t in tab.scc:
+                t.complete = True
+            tab.scc = []
+        else:
+            top = stack[-1]
+            top.leader = min(top.leader, tab.leader)
+            leader = stack[tab.leader]
+            for t in [tab] + tab.scc:
+                t.stamp = (leader, leader.passes)
+            top.scc.append(tab)
+            top.scc.extend(tab.scc)
+            tab.scc = []
+        return tab
 
     # ASK for Complex Sentence.
-    def ask_or(kb, goal, u):
+    #
+    # Within the body of a rule with cuts, `fence` is the barrier of the
+    # call: once a cut set it, the conjuncts before stop backtracking.
+    def ask_or(kb, goal, u, fence=None):
         for sub in goal.subs:
-            yield from kb.ask_1(sub, u)
-
-    def ask_and(kb, a, u):
-        if type(a) is And:
-            l, r = a.subs
-            for u1 in kb.ask_and(l, u):
-                for u2 in kb.ask_1(r, u1):
-                    yield u2
+            yield from kb.ask_and(sub, u, fence)
+            if fence is not None and fence[0]:
+                return
+
+    def ask_and(kb, a, u, fence=None):
+        if type(a) is And or fence is not None:
+            yield from kb.ask_conj(conjuncts(a), 0, u, fence)
         else:
             yield from kb.ask_1(a, u)
 
+    def ask_conj(kb, goals, i, u, fence=None):
+        "ASK for the conjunction of `goals[i:]`."
+        if i == len(goals):
+            yield u
+            return
+        n = kb.join_run(goals, i, u)
+        if n > 1:
+            sols = kb.ask_join(goals[i:i + n], u)
+            if u.attrs:
+                sols = (v for _ in sols for v in kb.wake(u))
+        elif fence is not None and type(goals[i]) is Or:
+            n, sols = 1, kb.ask_or(goals[i], u, fence)
+        else:
+            n, sols = 1, kb.ask_1(goals[i], u)
+        for _ in sols:
+            yield from kb.ask_conj(goals, i + n, u, fence)
+            if fence is not None and fence[0]:
+                sols.close()
+                return
+
+    # ASK by joins.
+    #
+    # Consecutive conjuncts upon predicates of fact rows only are
+    # joined on the interned ids in their fact tables: the rows of each
+    # are probed through the index of a position bound by a constant or
+    # by an earlier conjunct, and Var's get bound only once a row of
+    # the last conjunct completes the match. Answers come in the same
+    # order as by resolution.
+    def join_run(kb, goals, i, u):
+        "Number of conjuncts from `goals[i]` on that can be joined."
+        n = 0
+        for goal in goals[i:]:
+            if type(goal) is not Pred or goal.key in kb.tabled:
+                break
+            proc = kb.base.get(goal.key)
+            # Ids tell equal constants only while no types are mixed.
+            if proc is None or proc.clauses or proc.facts is None or \
+                    proc.facts.arity != len(goal.terms) or \
+                    proc.facts.symbols.mixed:
+                break
+            for t in goal.terms:
+                t = subst(u, t)
+                if not isinstance(t, Var) and (
+                        index_key(t) is _OPEN or isinstance(t, TermCnpd)):
+                    return n
+            n += 1
+        return n
+
+    def ask_join(kb, atoms, u):
+        slots = {}              # Var -> slot of its id in `vals`
+        steps = []
+        for atom in atoms:
+            facts = kb.base[atom.key].facts
+            keys = []           # (position, const id or None, slot)
+            checks = []         # (column, slot) bound within this atom
+            binds = []          # (column, slot)
+            start = len(slots)
+            for pos, t in enumerate(atom.terms):
+                t = subst(u, t)
+                col = facts.cols[pos]
+                if not isinstance(t, Var):
+                    i = facts.symbols.find(t)
+                    if i is None:
+                        return
+                    keys.append((pos, i, None))
+                elif t in slots and slots[t] < start:
+                    keys.append((pos, None, slots[t]))
+                elif t in slots:
+                    checks.append((col, slots[t]))
+                else:
+                    slots[t] = len(slots)
+                    binds.append((col, slots[t]))
+            with kb.lock:
+                for pos, _, _ in keys:
+                    if pos not in facts.indexes:
+                        facts.build(pos)
+            keys.sort(key=lambda k: -len(facts.indexes[k[0]]))
+            probe = keys[0] if keys else None
+            keys = [(facts.cols[pos], i, j) for pos, i, j in keys[1:]]
+            steps.append((facts, probe, keys, checks, binds))
+        vals = [None] * len(slots)
+        values = kb.symbols.values
+        m = u.mark()
+
+        def rows(facts, probe):
+            n = len(facts.ords)
+            dead = facts.dead
+            if probe is None:
+                hit = range(n)
+            else:
+                pos, i, j = probe
+                hit = facts.indexes[pos].get(vals[j] if i is None else i, ())
+                if type(hit) is int:
+                    hit = (hit,)
+            if dead:
+                return [r for r in hit if r < n and r not in dead]
+            return [r for r in hit if r < n]
+
+        lim = u.limits
+        prof = kb.profiler
+
+        def join(k):
+            if k == len(steps):
+                yield
+                return
+            if lim is not None:
+                lim.call()
+            st = None
+            if prof is not None:
+                st = prof.stat(atoms[k].key)
+                st['call'] += 1
+            facts, probe, keys, checks, binds = steps[k]
+            rs = rows(facts, probe)
+            if lim is not None:
+                rs = lim.scan(rs)
+            for r in rs:
+                if any(col[r] != (vals[j] if i is None else i)
+                       for col, i, j in keys):
+                    continue
+                for col, j in binds:
+                    vals[j] = col[r]
+                if any(col[r] != vals[j] for col, j in checks):
+                    continue
+                if st is not None:
+                    st['exit'] += 1
+                yield from join(k + 1)
+
+        for _ in join(0):
+            for v, j in slots.items():
+                u.bind(v, values[vals[j]])
+            yield u
+            u.undo(m)
+
+    def ask_local(kb, sub, u):
+        """Answers of `sub` asked on its own, as within a negation or as
+        a goal argument of a built-in: cuts within are local to it."""
+        sub = subst(u, sub)
+        # Renamed so as not to set the barrier of cuts shared with other
+        # goals.
+        fence = None
+        if next(body_cuts(sub), None) is not None:
+            sub = fresh_cuts(sub)
+            fence = [False]
+            for x in body_cuts(sub):
+                x.barrier = fence
+        return kb.ask_and(sub, u, fence)
+
     def ask_not(kb, goal, u):
-        if not any(kb.ask_1(goal, u)):
+        m = u.mark()
+        sols = kb.ask_local(goal.subs[0], u)
+        found = next(sols, None) is not None
+        sols.close()
+        u.undo(m)
+        if not found:
             yield u
 
 
@@ -704,6 +3722,24 @@ class PredM(Pred):
         p = Pred(self.verb, *trans_args(args))
         self.kb.tell(p)
 
+    def load(self, rows, types=None):
+        "Bulk-tell facts, cf. :KB.load:."
+        return self.kb.load(self.verb, rows, types)
+
+    def load_columns(self, *columns):
+        "Bulk-tell facts, cf. :KB.load_columns:."
+        return self.kb.load_columns(self.verb, *columns)
+
+    def __delitem__(self, args):
+        "Retract all facts and rules whose head matches :args:."
+        if type(args) is not tuple:
+            args = (args,)
+        self.kb.retract_all(Pred(self.verb, *trans_args(args)))
+
+    def retract(self, *args):
+        "Retract the first fact matching :args:."
+        return self.kb.retract(Pred(self.verb, *trans_args(args)))
+
     def __setitem__(self, args, rhs):
         if type(args) is not tuple:
             args = (args,)
@@ -717,7 +3753,7 @@ class PredM(Pred):
                 assert isinstance(sub1, Sen), \
                     'Each clause must be a Sentence object.'
                 if isinstance(sub1, Pred):
-                    assert sub1.key in self.kb.base
+                    assert sub1.key in self.kb.base or sub1.key in BUILTINS
                 sub = And(sub, sub1)
             self.kb.tell(Rule(lhs, sub))
         elif isinstance(rhs, Sen):
@@ -727,6 +3763,22 @@ class PredM(Pred):
                             'or a list of :Predicate:s.')
 
 
+def query_goal(verb, args):
+    "Make a query on predicate :verb:, taking '$name' strings for Var's."
+    return Pred(verb, *(query_arg(arg) for arg in args))
+
+
+def query_arg(arg):
+    "Translate '$name' strings to Var's, also within goals given as terms."
+    if isinstance(arg, str) and arg.startswith('$'):
+        return Var(arg[1:])
+    elif isinstance(arg, Pred):
+        return Pred(arg.verb, *(query_arg(t) for t in arg.terms))
+    elif isinstance(arg, Sen):
+        return type(arg)(*(query_arg(sub) for sub in arg.subs))
+    return arg
+
+
 class KBMan(object):
 
     """KB-Manager simplifies adding facts/rules.
@@ -778,26 +3830,67 @@ class KBMan(object):
             else:
                 kb = self.kb
                 # Check if predicate name exists.
-                if k in kb.base:
+                if k in kb.base or k in BUILTINS:
+                    def goal(args):
+                        return query_goal(k, args)
+
                     def q(*args):
                         "Delegate queried argument terms to :KB.ask: method."
-                        _args = []
-                        for arg in args:
-                            if isinstance(arg, str) and arg.startswith('$'):
-                                _args.append(Var(arg[1:]))
-                            else:
-                                _args.append(arg)
-                        yield from self.kb.ask(Pred(k, *_args))
+                        yield from self.kb.ask(goal(args))
+
+                    def many(argrows):
+                        """Delegate queries for each of :argrows: to
+                        :KB.ask_many:, tagging answers with their row."""
+                        rows = {}
+                        for args in argrows:
+                            if type(args) is not tuple:
+                                args = (args,)
+                            rows[goal(args)] = args
+                        for g, ans in self.kb.ask_many(rows):
+                            yield rows[g], ans
+
+                    def first(*args):
+                        "First answer, cf. :KB.ask_first:."
+                        return self.kb.ask_first(goal(args))
                     q.__doc__ = "Query proxy with keyword {}.".format(repr(k))
+                    q.many = many
+                    q.first = first
                     return q
                 else:
                     raise ValueError('Unrecognized predicate '
                                      'to be queried: "{}".'.format(k))
 
-    def __init__(self):
-        kb = KB()
+    class AsyncQueryProxy(object):
+
+        """Like :QueryProxy:, but making asynchronous generators, which
+        give way to the event loop every :steps: inferences."""
+
+        def __init__(self, kb, steps=1000):
+            self.kb = kb
+            self.steps = steps
+
+        def __getattr__(self, k):
+            if k not in self.kb.base and k not in BUILTINS:
+                raise ValueError('Unrecognized predicate '
+                                 'to be queried: "{}".'.format(k))
+
+            def q(*args, steps=None, timeout=None, limits=None):
+                "Delegate queried argument terms to :aask:."
+                from .solver import aask
+                return aask(self.kb, query_goal(k, args),
+                            steps or self.steps, timeout, limits)
+            q.__doc__ = "Async query proxy with keyword {}.".format(repr(k))
+            return q
+
+    def __init__(self, plan=False, cache=None):
+        kb = KB(plan, cache)
         self.kb = kb
         self.query = KBMan.QueryProxy(kb)
+        self.aquery = KBMan.AsyncQueryProxy(kb)
+
+    def table(self, *verbs):
+        "Delegate to :KB.table:."
+        self.kb.table(*verbs)
 
     def __getattr__(self, k):
         if k in self.__dict__:
@@ -0,0 +1,388 @@
+# Iterative resolution with an explicit goal stack.
+#
+# The generator engine of `KB` nests one Python frame per resolved
+# goal, so deep recursions run into the interpreter's recursion
+# limit. The machine here keeps its whole state in plain data:
+#
+# Goals    : (Sen, Goals) | None       -- the continuation
+# Choices  : [Choice]                  -- the alternatives left
+#
+# Calling a predicate replaces the goal by the body of a matching
+# clause on top of the continuation, and only leaves a choice point
+# when more candidate clauses remain. A deterministic call in last
+# position thus grows neither the continuation nor the choice stack.
+
+import asyncio
+
+from .pryo import (Env, FAIL, Sen, SenAtom, Rule, Pred, And, Or, Not, Eq,
+                   NotEq, Cut, BUILTINS, unify, subst, univ_inst, answer,
+                   has_func, may_match, body_cuts, Limits, ResourceError)
+
+
+PAUSE = '-PAUSE-'
+# Goal settling the attributed Var's bound by the goal before.
+WAKE = '-WAKE-'
+
+
+class Choice(object):
+
+    """Alternatives left for resuming a query on backtracking.
+
+    `resume` rolls forward into the next alternative, pushing itself
+    back first whenever further ones remain, and returns whether one
+    succeeded. The trail is rolled back to `mark` before.
+
+    """
+
+    def resume(self, q):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class Clauses(Choice):
+
+    """Candidate clauses for a called predicate.
+
+    Candidates are skipped ahead while their heads cannot match, so
+    that no choice point is left when none of the rest can. Cuts in the
+    body of a rule cut the choices back to `height`, where they stood
+    when the predicate was called.
+
+    """
+
+    def __init__(self, goal, proc, cands, rest, mark, height):
+        self.goal = goal
+        self.proc = proc
+        self.cands = cands
+        self.i = 0
+        self.rest = rest
+        self.mark = mark
+        self.height = height
+        self.match = None
+
+    def resume(self, q):
+        u = q.env
+        goal = self.goal
+        cands = self.cands
+        prof = q.kb.profiler
+        lim = u.limits
+        n = len(cands)
+        while self.i < n:
+            sen = cands[self.i]
+            self.i += 1
+            if lim is not None and not self.i % lim.SCAN:
+                lim.tick()
+            if not self.viable(sen):
+                continue
+            while self.i < n and not self.viable(cands[self.i]):
+                self.i += 1
+                if lim is not None and not self.i % lim.SCAN:
+                    lim.tick()
+            last = self.i == n
+            # Row of the fact table
+            if type(sen) is int:
+                if self.match is None:
+                    self.match = self.proc.facts.matcher(goal)
+                if self.match(sen, u):
+                    if not last:
+                        q.choices.append(self)
+                    q.goals = self.rest
+                    return True
+            # Fact
+            elif isinstance(sen, SenAtom):
+                if prof is not None:
+                    prof.tally('univ_inst', 'unify')
+                if unify(univ_inst(sen, None, u.fresh), goal, u) is not FAIL:
+                    if not last:
+                        q.choices.append(self)
+                    q.goals = self.rest
+                    return True
+            # Rule
+            else:
+                if prof is not None:
+                    prof.tally('univ_inst', 'unify')
+                rule = univ_inst(sen, None, u.fresh)
+                if unify(rule.lhs, goal, u) is not FAIL:
+                    if not last:
+                        q.choices.append(self)
+                    body = rule.rhs
+                    if q.kb.planner is not None:
+                        body = q.kb.planner.body(sen, body, u)
+                    if sen.cuts:
+                        for x in body_cuts(body):
+                            x.barrier = self.height
+                    q.goals = (body, self.rest)
+                    return True
+            u.undo(self.mark)
+        return False
+
+    def viable(self, sen):
+        "Cheap test whether candidate `sen` may match the goal."
+        if type(sen) is int:
+            if self.match is None:
+                self.match = self.proc.facts.matcher(self.goal)
+            return self.match.may(sen)
+        return may_match(sen, self.goal)
+
+
+class Branches(Choice):
+
+    "Remaining disjuncts of an `Or`."
+
+    def __init__(self, subs, rest, mark):
+        self.subs = subs
+        self.i = 0
+        self.rest = rest
+        self.mark = mark
+
+    def resume(self, q):
+        sub = self.subs[self.i]
+        self.i += 1
+        if self.i < len(self.subs):
+            q.choices.append(self)
+        q.goals = (sub, self.rest)
+        return True
+
+
+class Solutions(Choice):
+
+    """Answers of a goal left to a generator of the `KB` engine.
+
+    The generator undoes its own bindings between answers, so the
+    trail is only rolled back to where it stood after the last one.
+
+    """
+
+    def __init__(self, sols, rest, mark):
+        self.sols = sols
+        self.rest = rest
+        self.mark = mark
+
+    def resume(self, q):
+        if next(self.sols, None) is None:
+            return False
+        self.mark = q.env.mark()
+        q.choices.append(self)
+        q.goals = self.rest
+        return True
+
+    def close(self):
+        self.sols.close()
+
+
+class Query(object):
+
+    """State of one query under iterative resolution.
+
+    `next` runs the machine up to the next answer and returns it, or
+    returns None when there are no more. Given a `budget` it returns
+    `PAUSE` after resolving that many goals without an answer, and
+    can simply be called again to go on.
+
+    Given `limits`, `next` raises `ResourceError` as soon as the query
+    exceeds any of them but `depth`, as calls in last position do not
+    nest here.
+
+    """
+
+    def __init__(self, kb, goal, limits=None):
+        self.kb = kb
+        self.env = Env()
+        if limits is not None:
+            self.env.limits = limits.started()
+        if kb.planner is not None:
+            goal = kb.planner.body(None, goal, self.env)
+        self.goals = (goal, None)
+        self.choices = []
+        self.redo = False
+        self.inferences = 0
+
+    def next(self, budget=None):
+        if self.redo:
+            self.redo = False
+            if not self.backtrack():
+                return None
+        kb = self.kb
+        u = self.env
+        choices = self.choices
+        n = 0
+        while True:
+            goals = self.goals
+            if goals is None:
+                self.redo = True
+                if u.limits is not None:
+                    u.limits.answer()
+                return answer(u)
+            if budget is not None and n >= budget:
+                return PAUSE
+            n += 1
+            self.inferences += 1
+            goal, rest = goals
+            t = type(goal)
+            if t is And:
+                l, r = goal.subs
+                self.goals = (l, (r, rest))
+                continue
+            if t is Or:
+                Branches(goal.subs, rest, u.mark()).resume(self)
+                continue
+            # Without choice points left, nothing is ever undone.
+            if not choices:
+                del u.trail[:]
+            goal = subst(u, goal)
+            if goal is WAKE:
+                c = Solutions(kb.wake(u), rest, u.mark())
+                ok = c.resume(self)
+            elif isinstance(goal, (Eq, NotEq)) and (u.attrs or has_func(goal)):
+                c = Solutions(kb.ask_atom(goal, u), rest, u.mark())
+                ok = c.resume(self)
+            elif isinstance(goal, Eq):
+                if kb.profiler is not None:
+                    kb.profiler.tally('unify')
+                s1, s2 = goal.subs
+                ok = unify(s1, s2, u) is not FAIL
+                self.goals = rest
+            elif isinstance(goal, NotEq):
+                if kb.profiler is not None:
+                    kb.profiler.tally('unify')
+                s1, s2 = goal.subs
+                m = u.mark()
+                ok = unify(s1, s2, u) is FAIL
+                u.undo(m)
+                self.goals = rest
+            elif isinstance(goal, Pred):
+                if u.limits is not None:
+                    u.limits.call()
+                m = u.mark()
+                if goal.key in kb.tabled:
+                    c = Solutions(kb.ask_tabled(goal, u), rest, m)
+                elif goal.key not in kb.base and goal.key in BUILTINS:
+                    c = Solutions(BUILTINS[goal.key](kb, goal, u), rest, m)
+                else:
+                    proc = kb.base[goal.key]
+                    c = Clauses(goal, proc, kb.lookup(proc, goal), rest, m,
+                                len(choices))
+                ok = c.resume(self)
+            elif type(goal) is Cut:
+                if goal.barrier is not None:
+                    while len(choices) > goal.barrier:
+                        choices.pop().close()
+                ok = True
+                self.goals = rest
+            elif isinstance(goal, Not):
+                c = Solutions(kb.ask_not(goal, u), rest, u.mark())
+                ok = c.resume(self)
+            elif isinstance(goal, Sen) and not isinstance(goal, Rule):
+                c = Solutions(kb.ask_1(goal, u), rest, u.mark())
+                ok = c.resume(self)
+            else:
+                raise ValueError('Illegal goal: {}'.format(goal))
+            if ok and u.attrs and goal is not WAKE:
+                self.goals = (WAKE, self.goals)
+            if not ok and not self.backtrack():
+                self.goals = None
+                self.redo = True
+                return None
+
+    def backtrack(self):
+        "Resume the latest choice point left, if any."
+        choices = self.choices
+        u = self.env
+        while choices:
+            c = choices.pop()
+            u.undo(c.mark)
+            if c.resume(self):
+                if u.attrs:
+                    self.goals = (WAKE, self.goals)
+                return True
+        return False
+
+    def close(self):
+        "Abandon the query, closing pending generators."
+        while self.choices:
+            self.choices.pop().close()
+        self.goals = None
+        self.redo = True
+
+
+class Solver(object):
+
+    """Iterative engine answering queries on a `KB`.
+
+    Gives the same answers in the same order as `KB.ask`, but keeps
+    goals and choice points off the Python stack.
+
+    """
+
+    def __init__(self, kb):
+        self.kb = kb
+
+    def query(self, goal, limits=None):
+        return Query(self.kb, goal, limits)
+
+    def ask(self, goal, limits=None):
+        q = self.query(goal, limits)
+        try:
+            while True:
+                ans = q.next()
+                if ans is None:
+                    return
+                yield ans
+        finally:
+            q.close()
+
+
+async def aask(kb, goal, steps=1000, timeout=None, limits=None):
+    """Asynchronously generate the answers of `goal` on `kb`, giving way
+    to the event loop after every `steps` inferences.
+
+    Raises `asyncio.TimeoutError` once the search took longer than
+    `timeout` seconds, and `ResourceError` once it exceeds `limits` as
+    a `Query` does. Cancelling the task awaiting an answer abandons
+    the query.
+
+    Goals the solver hands to the generator engine, such as negations,
+    tabled or delayed goals and the goal arguments of built-ins, run to
+    their answer without giving way to the loop. They still check the
+    `timeout`, which is passed on to them as a limit.
+
+    """
+    loop = asyncio.get_running_loop()
+    end = None if timeout is None else loop.time() + timeout
+    if timeout is not None:
+        if limits is None:
+            limits = Limits(timeout=timeout)
+        elif limits.timeout is None or timeout < limits.timeout:
+            limits = Limits(limits.inferences, limits.depth, timeout,
+                            limits.answers)
+        else:
+            timeout = None
+    q = Query(kb, goal, limits)
+    left = steps
+    try:
+        while True:
+            n = q.inferences
+            try:
+                ans = q.next(budget=left)
+            except ResourceError as e:
+                if timeout is None or e.limit != 'timeout':
+                    raise
+                raise asyncio.TimeoutError(
+                    'Query timed out after {} inferences.'.format(
+                        q.inferences)) from e
+            left -= q.inferences - n
+            if end is not None and loop.time() > end:
+                raise asyncio.TimeoutError(
+                    'Query timed out after {} inferences.'.format(
+                        q.inferences))
+            if ans is None:
+                return
+            elif ans is not PAUSE:
+                yield ans
+            if left <= 0:
+                await asyncio.sleep(0)
+                left = steps
+    finally:
+        q.close()
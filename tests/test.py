@@ -123,3 +123,854 @@ lq = list(q)
 # Empty list means query was answered "No".
 assert not lq
 
+
+
+# print('========== indexing ==========')
+for i in range(1000):
+    kb.tell(Pred('succ', i, i + 1))
+kb.tell(Pred('succ', scm.x, scm.y) <= Pred('father', scm.x, scm.y))
+proc = kb.base['succ']
+# First argument is indexed eagerly, the second one on demand; rules
+# with open head arguments are always candidates.
+assert len(proc.lookup(Pred('succ', 5, var.x))) == 2
+assert 1 not in proc.indexes
+assert len(proc.lookup(Pred('succ', var.x, 7))) == 2
+assert 1 in proc.indexes
+assert len(proc.lookup(Pred('succ', var.x, var.y))) == 1001
+lq = list(kb.ask(Pred('succ', var.x, 7)))
+assert lq[0] == {var.x: 6}
+lq = list(kb.ask(Pred('succ', 999, var.y)))
+assert lq == [{var.y: 1000}]
+# Facts told later are indexed as well.
+kb.tell(Pred('succ', 'a', 'b'))
+assert list(kb.ask(Pred('succ', var.x, 'b'))) == [{var.x: 'pap'}, {var.x: 'a'}]
+
+
+# print('========== trail ==========')
+# Unifying against a plain dict leaves it untouched.
+u0 = {}
+u1 = unify(Pred('p', var.a, 2), Pred('p', 1, var.b), u0)
+assert u0 == {} and u1 == {var.a: 1, var.b: 2}
+# Rolling back an Env undoes bindings made after the mark.
+env = Env()
+unify(var.a, 1, env)
+m = env.mark()
+unify(Pred('p', var.b, var.c), Pred('p', 2, 3), env)
+assert env == {var.a: 1, var.b: 2, var.c: 3}
+env.undo(m)
+assert env == {var.a: 1}
+assert unify(Pred('p', var.a), Pred('p', 2), env) is FAIL
+
+kb.tell(pred.married('pap', 'mum'))
+kb.tell(pred.single(scm.x) <= Not(pred.married(scm.x, scm.y)))
+assert list(kb.ask(pred.single('opa'))) == [{}]
+assert list(kb.ask(pred.single('pap'))) == []
+
+# Long chains keep binding in place.
+Cons = lambda car, cdr: TermCnpd('Cons', car, cdr)
+kb.tell(pred.append(None, scm.ys, scm.ys))
+kb.tell(pred.append(Cons(scm.x, scm.xs), scm.ys, Cons(scm.x, scm.zs))
+        <= pred.append(scm.xs, scm.ys, scm.zs))
+xs = None
+for i in reversed(range(100)):
+    xs = Cons(i, xs)
+lq = list(kb.ask(pred.append(var.xs, var.ys, xs)))
+assert len(lq) == 101
+assert lq[0] == {var.xs: None, var.ys: xs}
+
+
+# print('========== tabling ==========')
+kb = KB()
+for a, b in [('a', 'b'), ('b', 'c'), ('c', 'a'), ('c', 'd')]:
+    kb.tell(pred.edge(a, b))
+# Left recursive over a cyclic graph.
+kb.tell(pred.path(scm.x, scm.y) <= pred.path(scm.x, scm.z) & pred.edge(scm.z, scm.y))
+kb.tell(pred.path(scm.x, scm.y) <= pred.edge(scm.x, scm.y))
+kb.table('path')
+lq = list(kb.ask(pred.path('a', var.y)))
+assert sorted(u[var.y] for u in lq) == ['a', 'b', 'c', 'd']
+lq = list(kb.ask(pred.path(var.x, var.y)))
+assert len(lq) == 12
+assert {var.x: 'd', var.y: 'a'} not in lq
+# Mutual recursion completes together.
+kb.tell(pred.odd(scm.x, scm.y) <= pred.edge(scm.x, scm.y))
+kb.tell(pred.odd(scm.x, scm.y) <= pred.even(scm.x, scm.z) & pred.edge(scm.z, scm.y))
+kb.tell(pred.even(scm.x, scm.y) <= pred.odd(scm.x, scm.z) & pred.edge(scm.z, scm.y))
+kb.table('odd', 'even')
+lq = list(kb.ask(pred.even('a', var.y)))
+assert sorted(u[var.y] for u in lq) == ['a', 'b', 'c', 'd']
+assert all(t.complete for t in kb.tables.values())
+# Telling more facts drops outdated tables.
+kb.tell(pred.edge('d', 'e'))
+lq = list(kb.ask(pred.path('a', var.y)))
+assert sorted(u[var.y] for u in lq) == ['a', 'b', 'c', 'd', 'e']
+# Calls on equal constants of different types get tables of their own.
+kb.tell(pred.same(scm.x, scm.x))
+kb.table('same')
+for v in [1, 1.0, True]:
+    y, = [u[var.y] for u in kb.ask(pred.same(v, var.y))]
+    assert type(y) is type(v)
+
+# Re-derivation of shared subgoals is avoided on a ladder graph.
+kb = KB()
+for i in range(40):
+    kb.tell(pred.edge(i, i + 1))
+    kb.tell(pred.edge(i, ('x', i)))
+    kb.tell(pred.edge(('x', i), i + 1))
+kb.tell(pred.path(scm.x, scm.y) <= pred.edge(scm.x, scm.y))
+kb.tell(pred.path(scm.x, scm.y) <= pred.path(scm.x, scm.z) & pred.edge(scm.z, scm.y))
+kb.table('path')
+lq = list(kb.ask(pred.path(0, 40)))
+assert lq == [{}]
+# Only the leader of mutually dependent tables iterates: each of them
+# is evaluated about once per pass of the leader, which stops as soon
+# as no call missed an answer.
+x, y, z = scm.x, scm.y, scm.z
+kb = KB()
+for i in range(7):
+    kb.tell(pred.edge(i, (i + 1) % 7))
+kb.tell(pred.a(x, y) <= pred.edge(x, y))
+kb.tell(pred.a(x, y) <= pred.edge(x, z) & pred.b(z, y))
+kb.tell(pred.b(x, y) <= pred.edge(x, z) & pred.a(z, y))
+kb.table('a', 'b')
+assert len(list(kb.ask(pred.a(var.x, var.y)))) == 49
+assert len(kb.tables) == 15 and kb.table_passes <= 2 * len(kb.tables)
+kb = KB()
+for i in range(20):
+    kb.tell(pred.edge(i, i + 1))
+kb.tell(pred.path(x, y) <= pred.edge(x, y))
+kb.tell(pred.path(x, y) <= pred.path(x, z) & pred.path(z, y))
+kb.table('path')
+assert len(list(kb.ask(pred.path(var.x, var.y)))) == 210
+assert kb.table_passes == len(kb.tables) == 21
+
+
+# print('========== retracting ==========')
+kb = KB()
+for i in range(10):
+    kb.tell(pred.edge(i, i + 1))
+kb.tell(pred.edge(3, 7))
+r1 = pred.path(scm.x, scm.y) <= pred.edge(scm.x, scm.y)
+r2 = pred.path(scm.x, scm.y) <= pred.edge(scm.x, scm.z) & pred.path(scm.z, scm.y)
+kb.tell(r1)
+kb.tell(r2)
+kb.tell(pred.hop(scm.x) <= pred.edge(0, scm.x))
+kb.table('path', 'hop')
+assert len(list(kb.ask(pred.path(0, var.y)))) == 10
+list(kb.ask(pred.hop(var.x)))
+assert kb.dependents('edge') == {'path', 'hop'}
+assert kb.dependents('path') == {'path'}
+
+# First matching fact only, Var's and ScmVar's as wildcards.
+assert kb.retract(pred.edge(3, var.y)).terms == (3, 4)
+assert kb.retract(pred.edge(3, scm.y)).terms == (3, 7)
+assert kb.retract(pred.edge(3, scm.y)) is None
+assert list(kb.ask(pred.path(0, var.y))) == [{var.y: 1}, {var.y: 2}, {var.y: 3}]
+assert len(kb.base['edge']) == 9
+assert kb.base['edge'].lookup(pred.edge(3, var.y)) == []
+# Tables of unaffected predicates are kept.
+kb.tell(pred.other(1))
+assert any(t.goal.key == 'path' for t in kb.tables.values())
+# Rules are retracted by pattern as well.
+assert kb.retract(pred.path(var.a, var.b) <= pred.edge(var.a, var.b)) is r1
+assert not any(t.goal.key == 'path' for t in kb.tables.values())
+assert list(kb.ask(pred.path(0, var.y))) == []
+kb.tell(r1)
+# Retracting all clauses matching a head.
+assert kb.retract_all(pred.edge(var.x, 5)) == 1
+assert kb.retract_all(pred.path(var.x, var.y)) == 2
+assert kb.retract_all(pred.nothing(var.x)) == 0
+
+# Logical update view for running queries.
+q = kb.ask(pred.edge(var.x, var.y))
+assert next(q) == {var.x: 0, var.y: 1}
+kb.retract_all(pred.edge(var.x, var.y))
+kb.tell(pred.edge(20, 21))
+assert len(list(q)) == 7
+assert list(kb.ask(pred.edge(var.x, var.y))) == [{var.x: 20, var.y: 21}]
+
+k = KBMan()
+k.father['John', 'Lucy']
+k.father['John', 'Lucas']
+k.father['Gregor', 'John']
+k.father.retract('John', '$who')
+assert list(k.query.father('$x', '$y')) == [
+    {var.x: 'John', var.y: 'Lucas'}, {var.x: 'Gregor', var.y: 'John'}]
+del k.father[':x', 'John']
+assert list(k.query.father('$x', '$y')) == [{var.x: 'John', var.y: 'Lucas'}]
+
+
+# print('========== bulk loading ==========')
+import os
+import tempfile
+from array import array
+
+kb = KB()
+kb.tell(pred.parent('Eve', 'Cain'))
+assert kb.load('parent', [('Adam', 'Cain'), ('Adam', 'Abel')]) == 2
+kb.tell(pred.parent(scm.x, scm.y) <= pred.father(scm.x, scm.y))
+kb.tell(pred.father('Abel', 'Enos'))
+assert kb.load_columns('parent', array('q', [1, 2]), ['Seth', 'Adam']) == 2
+proc = kb.base['parent']
+assert len(proc) == 6 and len(proc.facts) == 5 and len(proc.clauses) == 1
+assert len(kb.symbols) == 8
+# Loaded rows keep their telling order among other clauses.
+lq = list(kb.ask(pred.parent(var.x, var.y)))
+assert [(u[var.x], u[var.y]) for u in lq] == [
+    ('Eve', 'Cain'), ('Adam', 'Cain'), ('Adam', 'Abel'), ('Abel', 'Enos'),
+    (1, 'Seth'), (2, 'Adam')]
+assert list(kb.ask(pred.parent(var.x, 'Cain'))) == [
+    {var.x: 'Eve'}, {var.x: 'Adam'}]
+assert list(kb.ask(pred.parent(var.x, var.x))) == []
+assert list(kb.ask(pred.parent('Nobody', var.y))) == []
+assert list(kb.ask(pred.parent(2, var.y))) == [{var.y: 'Adam'}]
+# CSV files with converted fields.
+with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, 'age.csv')
+    with open(path, 'w') as f:
+        f.write('Adam,930\nSeth,912\n')
+    assert kb.load('age', path, types=(str, int)) == 2
+kb.tell(pred.old(scm.x) <= pred.age(scm.x, scm.n) & Assert(Func(op.gt, scm.n, 920)))
+assert list(kb.ask(pred.old(var.x))) == [{var.x: 'Adam'}]
+try:
+    kb.load('age', [('Enos', 905, 'extra')])
+    assert False
+except ValueError:
+    pass
+# Retracting loaded rows.
+q = kb.ask(pred.parent('Adam', var.y))
+assert next(q) == {var.y: 'Cain'}
+assert kb.retract(pred.parent('Adam', var.y)).terms == ('Adam', 'Cain')
+assert kb.retract(pred.parent('Adam', var.y)).terms == ('Adam', 'Abel')
+assert kb.retract_all(pred.parent(var.x, 'Adam')) == 2
+assert list(q) == [{var.y: 'Abel'}]
+assert list(kb.ask(pred.parent('Adam', var.y))) == []
+assert len(proc) == 2
+# Equal constants of different types are rows of their own.
+for v in [1, 1.0, True]:
+    kb.tell(pred.q(v))
+kb.load('q', [(1,), (1.0,)])
+xs = [u[var.x] for u in kb.ask(pred.q(var.x))]
+assert [(x, type(x)) for x in xs] == [(1, int), (1.0, float), (True, bool),
+                                      (1, int), (1.0, float)]
+# yet match each other, as unify has them equal.
+assert len(list(kb.ask(pred.q(1.0)))) == 5
+assert kb.symbols.mixed
+kb.tell(pred.h(2.0))
+kb.tell(pred.h1(scm.x) <= pred.h(Func(op.add, scm.x, 1)))
+kb.tell(pred.w(True))
+assert list(kb.ask(pred.h1(1))) == [{}]
+assert [u[var.x] for u in kb.ask(pred.w(var.x) & pred.q(var.x))] == [True] * 5
+assert [a for _, a in kb.ask_many([pred.w(1), pred.h(2)])] == [{}, {}]
+
+k = KBMan()
+k.edge.load((i, i + 1) for i in range(10000))
+k.path[scm.x, scm.y] = k.edge(scm.x, scm.y)
+assert list(k.query.path(9999, '$y')) == [{var.y: 10000}]
+assert list(k.query.path('$x', 5000)) == [{var.x: 4999}]
+
+
+# print('========== planning ==========')
+def family(plan):
+    kb = KB(plan=plan)
+    for i in range(250):
+        kb.tell(pred.person(i))
+    for i in range(10, 250):
+        kb.tell(pred.father(i // 10, i))
+    kb.tell(pred.married(3, 'mum'))
+    kb.tell(pred.sibling(scm.x, scm.y)
+            <= pred.person(scm.x) & pred.person(scm.y) & NotEq(scm.x, scm.y) &
+            pred.father(scm.z, scm.x) & pred.father(scm.z, scm.y))
+    kb.tell(pred.orphan(scm.x)
+            <= pred.person(scm.x) & Not(pred.father(scm.y, scm.x)))
+    kb.tell(pred.single(scm.x)
+            <= pred.person(scm.x) & Not(pred.married(scm.x, scm.y)) &
+            pred.father(scm.x, scm.z))
+    kb.tell(pred.nth(scm.x, scm.n)
+            <= pred.person(scm.x) & Eq(scm.n, Func(op.mul, scm.x, 2)) &
+            pred.person(scm.n))
+    return kb
+
+kb0, kb1 = family(False), family(True)
+for goal in [pred.sibling(var.a, var.b),
+             pred.sibling(var.a, 17),
+             pred.orphan(var.a),
+             pred.single(var.a),
+             pred.nth(var.a, var.b),
+             pred.father(var.a, var.b) & pred.person(5) & NotEq(var.b, 5)]:
+    lq0 = sorted(map(repr, kb0.ask(goal)))
+    assert lq0 and lq0 == sorted(map(repr, kb1.ask(goal))), goal
+planner = kb1.planner
+goals = conjuncts(univ_inst(kb1.base['sibling'].clauses[0]).rhs)
+assert planner.order(goals) == [3, 0, 4, 2, 1]
+x, y = sen_vars(goals[2])
+assert planner.order(goals, {y}) == [1, 4, 3, 2, 0]
+# Unpure conjuncts wait for the Var's bound before them as told, and
+# precede those binding their other Var's.
+goals = conjuncts(univ_inst(kb1.base['single'].clauses[0]).rhs)
+assert planner.order(goals) == [2, 1, 0]
+goals = conjuncts(univ_inst(kb1.base['nth'].clauses[0]).rhs)
+assert planner.order(goals) == [0, 1, 2]
+# Plans are cached until the KB changes.
+assert planner.plans
+kb1.tell(pred.person(250))
+assert not planner.plans
+
+
+# print('========== caching ==========')
+kb = KB(cache=3)
+for a, b in [('opa', 'pap'), ('pap', 'a'), ('pap', 'b'), ('oma', 'mum')]:
+    kb.tell(pred.father(a, b))
+kb.tell(pred.mother('mum', 'c'))
+kb.tell(pred.parent(scm.x, scm.y) <= pred.father(scm.x, scm.y))
+kb.tell(pred.parent(scm.x, scm.y) <= pred.mother(scm.x, scm.y))
+kb.tell(pred.ancester(scm.x, scm.y) <= pred.parent(scm.x, scm.y))
+kb.tell(pred.ancester(scm.x, scm.y)
+        <= pred.parent(scm.x, scm.z) & pred.ancester(scm.z, scm.y))
+kb.tell(pred.pair(scm.x, TermCnpd('Pair', scm.x, scm.y)))
+cache = kb.cache
+lq = list(kb.ask(pred.ancester('opa', var.y)))
+assert len(lq) == 3 and len(cache) == 1 and cache.misses == 1
+# Variants hit the same entry, with their own Var's.
+assert list(kb.ask(pred.ancester('opa', var.z))) == [
+    {var.z: u[var.y]} for u in lq]
+assert cache.hits == 1
+assert list(kb.ask(pred.mother(var.x, var.y))) == [{var.x: 'mum', var.y: 'c'}]
+# Non-ground answers get fresh Var's.
+u, = kb.ask(pred.pair(var.x, var.p))
+u1, = kb.ask(pred.pair(var.a, var.b))
+assert cache.hits == 2
+assert u1[var.b].terms[0] == var.a and isinstance(u1[var.b].terms[1], Var)
+# Only dependent entries get dropped.
+kb.tell(pred.mother('mum', 'd'))
+assert len(cache) == 1
+assert len(list(kb.ask(pred.ancester('oma', var.y)))) == 3
+# Abandoned queries are not cached.
+q = kb.ask(pred.father(var.x, var.y))
+next(q)
+q.close()
+assert len(cache) == 2
+# Least recently used entries go first.
+list(kb.ask(pred.father(var.x, var.y)))
+list(kb.ask(pred.father(var.x, 'a')))
+assert len(cache) == 3
+assert variant(pred.pair(var.x, var.p)) not in cache.entries
+kb.retract(pred.father('pap', 'b'))
+assert len(cache) == 0
+assert len(list(kb.ask(pred.ancester('opa', var.y)))) == 2
+
+
+# print('========== parallel ==========')
+kb = KB()
+for i in range(30):
+    kb.tell(pred.edge(i, i + 1))
+    kb.tell(pred.edge(i, 'c{}'.format(i)))
+kb.tell(pred.path(scm.x, scm.y) <= pred.edge(scm.x, scm.y))
+kb.tell(pred.path(scm.x, scm.y) <= pred.edge(scm.x, scm.z) & pred.path(scm.z, scm.y))
+for goal in [pred.path(var.x, var.y),
+             pred.edge(var.x, var.y) & pred.path(var.y, 'c20'),
+             pred.edge(var.x, 3) | pred.edge(var.x, 'c7') | pred.path(28, var.x)]:
+    lq = list(kb.ask(goal))
+    assert list(kb.ask(goal, workers=3)) == lq
+    lq1 = list(kb.ask(goal, workers=2, ordered=False))
+    assert sorted(map(repr, lq1)) == sorted(map(repr, lq))
+# Goals without alternatives to split run sequentially.
+assert list(kb.ask(pred.edge(3, 4), workers=2)) == [{}]
+assert list(kb.ask(pred.path(var.x, 'x'), workers=2)) == []
+
+
+# print('========== batch ==========')
+k = KBMan()
+k.parent.load([('p{}'.format(i // 3), 'c{}'.format(i)) for i in range(3000)])
+k.parent['pX', 'c7']
+k.parent.retract('p1', 'c4')
+k.age.load([('c{}'.format(i), i % 90) for i in range(3000)])
+k.elder[scm.x] = [k.age(scm.x, scm.n), Assert(Func(op.gt, scm.n, 88))]
+kb = k.kb
+goals = [pred.parent(var.p, 'c{}'.format(i)) for i in range(0, 3000, 7)]
+goals += [pred.parent('p1', var.c), pred.parent(var.p, 'nobody'),
+          pred.parent(var.p, var.c) & pred.age(var.c, 3),
+          pred.parent(var.x, var.x), pred.elder('c89'), pred.age('c5', 5)]
+# Many keys are joined by a scan, few by probing the index.
+for gs in [goals, goals[:3] + goals[-6:]]:
+    lq = list(kb.ask_many(gs))
+    assert lq == [(g, u) for g in gs for u in kb.ask(g)]
+assert (goals[1], {var.p: 'p2'}) in lq and (goals[-1], {}) in lq
+assert [u for g, u in lq if g is goals[-6]] == [{var.c: 'c3'}, {var.c: 'c5'}]
+lq = list(k.query.parent.many([('$p', 'c7'), ('p0', '$c'), ('$p', 'c1')]))
+assert lq == [(('$p', 'c7'), {var.p: 'p2'}), (('$p', 'c7'), {var.p: 'pX'}),
+              (('p0', '$c'), {var.c: 'c0'}), (('p0', '$c'), {var.c: 'c1'}),
+              (('p0', '$c'), {var.c: 'c2'}), (('$p', 'c1'), {var.p: 'p0'})]
+
+
+# print('========== joins ==========')
+def people(joined):
+    kb = KB()
+    for i in range(300):
+        kb.tell(pred.father('p{}'.format(i // 4), 'c{}'.format(i)))
+        kb.tell(pred.age('c{}'.format(i), i % 7))
+    if not joined:
+        # Rules make predicates to be resolved clause by clause.
+        kb.tell(pred.father(scm.x, scm.y) <= NotEq(scm.x, scm.x))
+        kb.tell(pred.age(scm.x, scm.y) <= NotEq(scm.x, scm.x))
+    kb.tell(pred.sibling(scm.x, scm.y)
+            <= pred.father(scm.z, scm.x) & pred.father(scm.z, scm.y) &
+            NotEq(scm.x, scm.y))
+    kb.tell(pred.peer(scm.x, scm.y, scm.a)
+            <= pred.father(scm.z, scm.x) & pred.age(scm.x, scm.a) &
+            pred.father(scm.z, scm.y) & pred.age(scm.y, scm.a))
+    return kb
+
+kb0, kb1 = people(False), people(True)
+body = conjuncts(univ_inst(kb1.base['peer'].clauses[0]).rhs)
+assert kb1.join_run(body, 0, Env()) == 4
+assert kb0.join_run(body, 0, Env()) == 0
+for goal in [pred.sibling(var.x, var.y),
+             pred.sibling('c5', var.y),
+             pred.peer(var.x, var.y, var.a),
+             pred.peer(var.x, var.x, 3),
+             pred.peer('c1', var.y, var.a),
+             pred.father(var.z, var.x) & pred.age(var.x, 'none'),
+             pred.father(var.z, var.x) & pred.age(var.y, var.a) &
+             Eq(var.y, var.x) & pred.father(var.z, 'c2')]:
+    lq = list(kb1.ask(goal))
+    assert lq == list(kb0.ask(goal)), goal
+assert len(list(kb1.ask(pred.peer(var.x, var.y, var.a)))) == sum(
+    1 for i in range(300) for j in range(300)
+    if i // 4 == j // 4 and i % 7 == j % 7)
+# Joins keep the logical update view.
+for kb in [kb0, kb1]:
+    q = kb.ask(pred.sibling('c5', var.y))
+    assert next(q) == {var.y: 'c4'}
+    kb.retract(pred.father('p1', 'c7'))
+    assert list(q) == [{var.y: 'c6'}, {var.y: 'c7'}]
+    assert list(kb.ask(pred.sibling('c5', var.y))) == [
+        {var.y: 'c4'}, {var.y: 'c6'}]
+
+
+# print('========== snapshot ==========')
+kb = KB()
+kb.load('edge', [(i, 'n{}'.format(i + 1)) for i in range(1000)])
+kb.tell(pred.edge('a', TermCnpd('Pair', 1, 2)))
+kb.tell(pred.edge('x', scm.y))
+kb.tell(pred.path(scm.x, scm.y) <= pred.edge(scm.x, scm.y))
+kb.tell(pred.path(scm.x, scm.y) <= pred.edge(scm.x, scm.z) & pred.path(scm.z, scm.y))
+kb.retract(pred.edge(3, var.y))
+kb.table('path')
+goals = [pred.edge(var.x, var.y), pred.path(995, var.y), pred.edge(var.x, 'n4'),
+         pred.path('a', var.y), pred.edge(3, var.y), pred.edge('x', 5)]
+with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, 'kb.snap')
+    kb.save(path)
+    for mapped in [True, False]:
+        kb1 = KB.open(path, mmap=mapped)
+        assert kb1.tabled == {'path'}
+        assert not kb1.base['edge'].facts.dead
+        assert (type(kb1.base['edge'].facts.ords) is memoryview) is mapped
+        for goal in goals:
+            assert list(kb1.ask(goal)) == list(kb.ask(goal)), goal
+        # Mapped tables get copied once told into.
+        kb1.tell(pred.edge(3, 'n4'))
+        kb1.retract(pred.edge(0, var.y))
+        assert type(kb1.base['edge'].facts.ords) is array
+        assert list(kb1.ask(pred.edge(var.x, 'n4'))) == [{var.x: 'x'}, {var.x: 3}]
+        assert len(kb1.base['edge']) == len(kb.base['edge'])
+        del kb1
+    with open(path, 'wb') as f:
+        f.write(b'junk')
+    try:
+        KB.open(path)
+        assert False
+    except ValueError:
+        pass
+
+
+# print('========== limits ==========')
+kb = KB()
+for i in range(50):
+    kb.tell(pred.edge(i, i + 1))
+kb.tell(pred.path(scm.x, scm.y) <= pred.edge(scm.x, scm.y))
+kb.tell(pred.path(scm.x, scm.y) <= pred.edge(scm.x, scm.z) & pred.path(scm.z, scm.y))
+kb.tell(pred.loop(scm.x) <= pred.loop(scm.x))
+goal = pred.path(0, var.y)
+assert list(kb.ask(goal, limits=Limits())) == list(kb.ask(goal))
+assert len(list(kb.ask(goal, limits=Limits(depth=51, answers=50)))) == 50
+
+
+def exceeded(goal, **limits):
+    try:
+        for _ in kb.ask(goal, limits=Limits(**limits)):
+            pass
+    except ResourceError as e:
+        return e
+    assert False, limits
+
+
+e = exceeded(goal, depth=10)
+assert e.limit == 'depth' and e.stats['max_depth'] == 11
+e = exceeded(goal, inferences=30)
+assert e.limit == 'inferences' and e.stats['inferences'] == 31
+e = exceeded(goal, answers=5)
+assert e.limit == 'answers' and e.stats['answers'] == 6
+e = exceeded(pred.loop(1), inferences=100)
+assert e.stats['max_depth'] == 100
+e = exceeded(pred.edge(var.a, var.b) & pred.edge(var.c, var.d) &
+             pred.edge(var.e, var.f) & pred.edge(var.g, var.h), timeout=0.05)
+assert e.limit == 'timeout' and e.stats['seconds'] > 0.05
+# Limits count per query.
+lim = Limits(answers=50)
+assert len(list(kb.ask(goal, limits=lim))) == len(list(kb.ask(goal, limits=lim)))
+# The Solver checks them too, but depth.
+from pryo.solver import Solver
+
+for g, limits, limit in [(goal, dict(inferences=30), 'inferences'),
+                         (goal, dict(answers=5), 'answers'),
+                         (pred.loop(1), dict(timeout=0.05), 'timeout')]:
+    try:
+        for _ in Solver(kb).ask(g, limits=Limits(**limits)):
+            pass
+        assert False
+    except ResourceError as e:
+        assert e.limit == limit
+# Timeouts are checked while scanning rows that do not match.
+kb.load('big', [(i, i + 1) for i in range(50000)])
+for ask in [kb.ask, Solver(kb).ask]:
+    for g in [pred.big(var.x, var.x), pred.big(var.x, var.y) & pred.big(var.y, var.y)]:
+        try:
+            list(ask(g, limits=Limits(timeout=0.01)))
+            assert False
+        except ResourceError as e:
+            assert e.limit == 'timeout'
+
+
+# print('========== profiling ==========')
+kb = KB()
+for i in range(10):
+    kb.tell(pred.edge(i, i + 1))
+kb.tell(pred.path(scm.x, scm.y) <= pred.edge(scm.x, scm.y))
+kb.tell(pred.path(scm.x, scm.y) <= pred.edge(scm.x, scm.z) & pred.path(scm.z, scm.y))
+with kb.profile() as prof:
+    assert len(list(kb.ask(pred.path(0, var.y)))) == 10
+    assert list(kb.ask(pred.edge(3, var.y) & pred.edge(var.y, var.z))) == [
+        {var.y: 4, var.z: 5}]
+assert kb.profiler is None
+st = prof.stats()
+assert {p: st['path'][p] for p in PORTS} == {
+    'call': 11, 'exit': 55, 'redo': 55, 'fail': 11}
+assert st['edge']['call'] == 22 + 2 and st['edge']['exit'] == 20 + 2
+assert all(s['time'] >= 0 for s in st.values())
+assert prof.counts['unify'] > 0 and prof.counts['univ_inst'] > 0
+tries = [(key, c, t, e) for key, c, t, e in prof.clauses.values()]
+assert tries[1] == ('edge', '<facts>', 20, 20)
+assert [(t, e) for key, c, t, e in tries if key == 'path'] == [(11, 10), (11, 45)]
+rows = {l.split()[0]: l.split()[1:5] for l in prof.table().split('\n')[1:-1]}
+assert rows['path'] == ['11', '55', '55', '11'] and rows['edge'][0] == '24'
+# The Solver counts its resolution steps too.
+with kb.profile() as prof:
+    assert len(list(Solver(kb).ask(pred.path(0, var.y)))) == 10
+assert prof.counts == {'unify': 22, 'univ_inst': 22}
+
+
+# print('========== threads ==========')
+import threading
+
+kb = KB()
+for i in range(1, 200):
+    kb.tell(pred.father(i // 2, i))
+kb.tell(pred.ancester(scm.x, scm.y) <= pred.father(scm.x, scm.y))
+kb.tell(pred.ancester(scm.x, scm.y) <= pred.father(scm.x, scm.z) & pred.ancester(scm.z, scm.y))
+kb.tell(pred.path(scm.x, scm.y) <= pred.path(scm.x, scm.z) & pred.father(scm.z, scm.y))
+kb.tell(pred.path(scm.x, scm.y) <= pred.father(scm.x, scm.y))
+kb.table('path')
+goal = pred.ancester(var.x, var.y)
+expected = list(kb.ask(goal))
+pairs = {(u[var.x], u[var.y]) for u in expected}
+# Queries interleaved on one thread rename clauses apart.
+q = kb.ask(goal)
+lq = [next(q) for _ in range(300)]
+for _ in range(5):
+    next(kb.ask(goal))
+lq.extend(q)
+assert lq == expected
+# Readers on many threads, while a writer tells more facts.
+errors = []
+
+
+def reader():
+    try:
+        for _ in range(3):
+            lq = list(kb.ask(goal))
+            assert len(lq) == len({(u[var.x], u[var.y]) for u in lq})
+            assert {(u[var.x], u[var.y]) for u in lq} >= pairs
+            lq = list(kb.ask(pred.path(1, var.y)))
+            assert {(1, u[var.y]) for u in lq} >= {p for p in pairs
+                                                   if p[0] == 1}
+    except Exception as e:
+        errors.append(e)
+
+
+def writer():
+    for i in range(200, 400):
+        kb.tell(pred.father(i // 2, i))
+
+
+threads = [threading.Thread(target=reader) for _ in range(4)]
+threads.append(threading.Thread(target=writer))
+for th in threads:
+    th.start()
+for th in threads:
+    th.join()
+assert not errors, errors
+assert len(list(kb.ask(pred.path(0, var.y)))) == 399
+
+
+# print('========== lists ==========')
+kb = KB()
+h, t, xs, ys, zs = scm('h t xs ys zs'.split())
+kb.tell(pred.app(None, ys, ys))
+kb.tell(pred.app(lst([h], xs), ys, lst([h], zs)) <= pred.app(xs, ys, zs))
+kb.tell(pred.nrev(None, None))
+kb.tell(pred.nrev(lst([h], t), ys) <= pred.nrev(t, zs) & pred.append(zs, lst([h]), ys))
+kb.tell(pred.items(lst(['a', 'b', 'c'])))
+
+l = lst([1, 2, 3])
+assert repr(l) == '[1, 2, 3]' and repr(lst([1], var.t)) == '[1 | $t]'
+assert lst([]) is None and l.rest.rest.tolist() == [3] and l.rest.items is l.items
+assert list(kb.ask(pred.app(l, lst([4]), var.r)))[0][var.r].tolist() == [1, 2, 3, 4]
+splits = [(u[var.a], u[var.b]) for u in kb.ask(pred.append(var.a, var.b, l))]
+assert [(a and a.tolist(), b and b.tolist()) for a, b in splits] == [
+    (None, [1, 2, 3]), ([1], [2, 3]), ([1, 2], [3]), ([1, 2, 3], None)]
+assert len(list(kb.ask(pred.app(var.a, var.b, l)))) == 4
+# Suffixes are views on the same elements.
+assert splits[1][1].items is splits[2][1].items
+assert list(kb.ask(Eq(lst([1, var.y], var.t), lst([1, 2, 3, 4]))))[0][var.t].tolist() == [3, 4]
+assert list(kb.ask(Eq(lst([1, 2]), lst([1, 2, 3])))) == []
+assert list(kb.ask(Eq(lst([1], lst([2])), l))) == []
+assert [u[var.e] for u in kb.ask(pred.items(var.l) & pred.member(var.e, var.l))] == ['a', 'b', 'c']
+assert list(kb.ask(pred.length(lst(range(10000)), var.n))) == [{var.n: 10000}]
+assert len(list(kb.ask(pred.length(var.l, 3)))[0][var.l].tolist()) == 3
+q = kb.ask(pred.length(lst([0], var.t), var.n))
+assert [u[var.n] for u in islice(q, 3)] == [1, 2, 3]
+q = kb.ask(pred.member(0, var.l))
+assert [len(u[var.l].parts()[0]) for u in islice(q, 3)] == [1, 2, 3]
+# Bound non-list arguments end the search instead of enumerating.
+assert list(kb.ask(pred.length(var.l, 'a'))) == []
+assert list(kb.ask(pred.length(lst([0], var.t), True))) == []
+assert list(kb.ask(pred.append(var.x, var.y, 5))) == [{var.x: None, var.y: 5}]
+assert len(list(kb.ask(pred.append(var.x, var.y, Cons(1, None))))) == 1
+assert [u[var.y] for u in kb.ask(pred.append(var.x, var.y, lst([1], 'e')))] == [lst([1], 'e'), 'e']
+assert list(kb.ask(pred.nrev(lst(range(30)), var.r)))[0][var.r].tolist() == list(reversed(range(30)))
+# Long lists neither rebuilt nor recursed into.
+big = lst(range(100000))
+assert list(kb.ask(pred.member(99999, big))) == [{}]
+r = list(kb.ask(pred.append(big, big, var.r)))[0][var.r]
+assert r.items is big.items and r.tail is big
+assert r.tolist() == list(range(100000)) * 2
+n = 20000
+r = list(Solver(kb).ask(pred.app(lst(range(n)), lst(['z']), var.r)))[0][var.r]
+assert r.tolist() == list(range(n)) + ['z']
+# User definitions take precedence over built-ins.
+kb.tell(pred.member(scm.x, scm.y) <= Eq(scm.x, 'mine'))
+assert list(kb.ask(pred.member(var.e, l))) == [{var.e: 'mine'}]
+
+
+# print('========== delayed goals ==========')
+kb = KB()
+for i in [-1, 0, 1, 2]:
+    kb.tell(pred.num(i))
+kb.tell(pred.twice(scm.x, scm.y)
+        <= AssertFunc(op.gt, scm.x, 0) & Eq(scm.y, Func(op.mul, scm.x, 2)) &
+        pred.num(scm.x))
+s = Solver(kb)
+goal = pred.twice(var.x, var.y)
+assert list(kb.ask(goal)) == list(s.ask(goal)) == [
+    {var.x: 1, var.y: 2}, {var.x: 2, var.y: 4}]
+goal = NotEq(Func(op.add, var.x, 1), 2) & pred.num(var.x)
+assert [u[var.x] for u in kb.ask(goal)] == [u[var.x] for u in s.ask(goal)] == [-1, 0, 2]
+# Delayed goals are dropped on backtracking.
+goal = (Eq(var.x, 5) | AssertFunc(op.lt, var.x, 0)) & pred.num(var.x)
+assert [u[var.x] for u in kb.ask(goal)] == [-1]
+# Goals never woken up make no answer.
+for ask in [kb.ask, s.ask]:
+    try:
+        list(ask(Eq(var.y, Func(op.add, var.x, 1))))
+        assert False
+    except ValueError:
+        pass
+# Tabled answers are checked against the goals delayed by their caller,
+# but may not be conditional themselves.
+kb.tell(pred.tnum(scm.x) <= pred.num(scm.x))
+kb.tell(pred.tinc(scm.x, scm.y) <= Eq(scm.y, Func(op.add, scm.x, 1)))
+kb.table('tnum', 'tinc')
+goal = AssertFunc(op.gt, var.x, 0) & pred.tnum(var.x)
+assert [u[var.x] for u in kb.ask(goal)] == [1, 2]
+try:
+    list(kb.ask(pred.tinc(var.x, var.y)))
+    assert False
+except ValueError:
+    pass
+
+# Finite domains
+fd = lambda *a: pred.fd_domain(*a)
+label = lambda *a: pred.fd_labeling(*a)
+x, y = var.x, var.y
+goal = fd(lst([x, y]), 0, 9) & Eq(Func(op.add, x, y), 10) & \
+    Eq(Func(op.sub, x, y), 2) & label(lst([x, y]))
+assert list(kb.ask(goal)) == list(s.ask(goal)) == [{x: 6, y: 4}]
+# Propagation alone may bind.
+u = list(kb.ask(fd(lst([x, y]), 0, 9) & Eq(Func(op.add, x, y), 18)))[0]
+assert u == {x: 9, y: 9}
+assert list(kb.ask(fd(x, 1, 3) & Eq(x, 5))) == []
+goal = fd(x, 0, 5) & fd(y, 3, 9) & Eq(x, y) & label(y)
+assert [u[y] for u in kb.ask(goal)] == [3, 4, 5]
+assert len(list(kb.ask(fd(lst([x, y]), 1, 3) & NotEq(x, y) & label(lst([x, y]))))) == 6
+
+k = KBMan()
+vs = list(scm('S E N D M O R Y'.split()))
+S, E, N, D, M, O, R, Y = vs
+body = [k.fd_domain(lst(vs), 0, 9), S > 0, M > 0]
+body += [a != b for i, a in enumerate(vs) for b in vs[i + 1:]]
+body += [1000 * S + 100 * E + 10 * N + D + 1000 * M + 100 * O + 10 * R + E ==
+         10000 * M + 1000 * O + 100 * N + 10 * E + Y,
+         k.fd_labeling(lst(vs))]
+k.money[lst(vs)] = body
+assert [u[var.l].tolist() for u in k.query.money('$l')] == [[9, 5, 6, 7, 1, 0, 8, 2]]
+
+# Queens pruned by propagation rather than generated and tested: the
+# placements tried are counted as the exits of labeling.
+def queens(n, fd):
+    k = KBMan()
+    qs = list(scm(['q{}'.format(i) for i in range(n)]))
+    body = [k.fd_domain(lst(qs), 1, n)] if fd else []
+    for i in range(n):
+        if not fd:
+            body += [k.fd_domain(qs[i], 1, n), k.fd_labeling(qs[i])]
+        for j in range(i):
+            body += [qs[i] != qs[j], qs[i] - qs[j] != i - j,
+                     qs[j] - qs[i] != i - j]
+    if fd:
+        body += [k.fd_labeling(q) for q in qs]
+    k.queens[lst(qs)] = body
+    with k.kb.profile() as prof:
+        n = len(list(k.query.queens('$qs')))
+    return n, prof.stats()['fd_labeling']['exit']
+
+(n1, tried1), (n2, tried2) = queens(6, True), queens(6, False)
+assert n1 == n2 == 4 and tried1 < tried2
+
+
+# print('========== aggregates ==========')
+k = KBMan()
+x, y, c, n, a = scm('x y c n a'.split())
+for f, ch in [('opa', 'pap'), ('pap', 'a'), ('pap', 'b'), ('opa', 'ucl')]:
+    k.father[f, ch]
+for p, age in [('pap', 40), ('a', 10), ('b', 8), ('ucl', 35)]:
+    k.age[p, age]
+k.nkids[x, n] = k.count(k.father(x, c), n)
+k.oldest[x, a] = k.group_by(x, k.max(y, k.father(x, c) & k.age(c, y), a))
+q = k.query
+assert list(q.count(k.father('opa', '$c'), '$n')) == [{var.n: 2}]
+assert list(q.nkids('pap', '$n')) == [{var.n: 2}]
+assert list(q.nkids('a', '$n')) == [{var.n: 0}]
+assert list(q.group_by('$x', k.count(k.father('$x', '$c'), '$n'))) == [
+    {var.x: 'opa', var.n: 2}, {var.x: 'pap', var.n: 2}]
+assert list(q.group_by('$x', k.sum('$a', k.father('$x', '$c') & k.age('$c', '$a'), '$s'))) == [
+    {var.x: 'opa', var.s: 75}, {var.x: 'pap', var.s: 18}]
+assert list(q.oldest('$x', '$a')) == [{var.x: 'opa', var.a: 40}, {var.x: 'pap', var.a: 10}]
+assert list(Solver(k.kb).ask(pred.oldest('pap', var.a))) == [{var.a: 10}]
+assert list(q.min('$a', k.age('$p', '$a'), '$m')) == [{var.m: 8}]
+assert list(q.max('$a', k.age('nobody', '$a'), '$m')) == []
+assert list(q.findall('$c', k.father('$x', '$c'), '$l'))[0][var.l].tolist() == [
+    'pap', 'a', 'b', 'ucl']
+assert list(q.findall('$c', k.father('a', '$c'), '$l')) == [{var.l: None}]
+assert list(q.bagof('$c', k.father('a', '$c'), '$l')) == []
+assert list(q.setof('$x', k.father('$x', '$c'), '$l'))[0][var.l].tolist() == ['opa', 'pap']
+for v in [1, 1.0, True]:
+    k.num[v]
+assert list(q.setof('$x', k.num('$x'), '$l'))[0][var.l].tolist() == [1, 1.0, True]
+k.edge.load([(i, i + 1) for i in range(50000)])
+assert list(q.count(k.edge('$x', '$y'), '$n')) == [{var.n: 50000}]
+assert list(q.sum('$x', k.edge('$x', '$y'), '$s')) == [{var.s: sum(range(50000))}]
+
+
+# print('========== cut ==========')
+kb = KB()
+s = Solver(kb)
+X, Y, N, F, N1, F1 = scm.x, scm.y, scm.n, scm.f, scm.n1, scm.f1
+kb.tell(pred.mx(X, Y, X) <= AssertFunc(op.ge, X, Y) & cut)
+kb.tell(pred.mx(X, Y, Y))
+kb.tell(pred.fact(0, 1) <= cut)
+kb.tell(pred.fact(N, F) <= Eq(N1, Func(op.sub, N, 1)) & pred.fact(N1, F1) &
+        Eq(F, Func(op.mul, N, F1)))
+for i in [1, 2, 3]:
+    kb.tell(pred.a(i))
+for c in 'xy':
+    kb.tell(pred.b(c))
+kb.tell(pred.t(X, Y) <= pred.a(X) & cut & pred.b(Y))
+kb.tell(pred.t(9, 9))
+kb.tell(pred.r(X) <= (Eq(X, 1) & cut) | Eq(X, 2))
+kb.tell(pred.r(3))
+# Cuts within a negation are local to it.
+kb.tell(pred.nt(X) <= pred.a(X) & Not(pred.a(Y) & cut & Eq(Y, 2)))
+first_ab = [{var.x: 1, var.y: 'x'}, {var.x: 1, var.y: 'y'}]
+for goal, ans in [(pred.mx(3, 5, var.m), [{var.m: 5}]),
+                  (pred.mx(5, 3, var.m), [{var.m: 5}]),
+                  (pred.fact(5, var.f), [{var.f: 120}]),
+                  (pred.t(var.x, var.y), first_ab),
+                  (pred.r(var.x), [{var.x: 1}]),
+                  (pred.nt(var.x), [{var.x: 1}, {var.x: 2}, {var.x: 3}]),
+                  (pred.once(pred.a(var.x)) & pred.b(var.y), first_ab)]:
+    assert list(kb.ask(goal)) == list(s.ask(goal)) == ans, goal
+kb.planner = Planner(kb)
+assert list(kb.ask(pred.t(var.x, var.y))) == list(s.ask(pred.t(var.x, var.y))) == first_ab
+kb.planner = None
+# Committed deterministic recursion leaves no choice point.
+q = s.query(pred.fact(500, var.f))
+assert q.next() is not None and not q.choices
+assert kb.ask_first(pred.a(var.x)) == {var.x: 1}
+assert kb.ask_first(pred.a(4)) is None
+# A top-level cut is not committed by the negations it was in.
+assert list(kb.ask(Not(pred.a(var.x) & cut))) == [] and cut.barrier is None
+assert list(s.ask(pred.a(var.x) & cut)) == [{var.x: 1}, {var.x: 2}, {var.x: 3}]
+# Parallel queries keep the commitment of a cut.
+kb.tell(pred.m(X) <= pred.a(X) & cut)
+kb.tell(pred.m(3))
+assert list(kb.ask(pred.m(var.x), workers=2)) == [{var.x: 1}]
+# Cuts within goal arguments are local to them, both in rules and queries.
+kb.tell(pred.fa(F) <= pred.findall(X, pred.a(X) & cut, F))
+kb.tell(pred.ca(N) <= pred.count(pred.a(X) & cut, N))
+for goal in [pred.fa(var.l), pred.findall(var.x, pred.a(var.x) & cut, var.l)]:
+    assert [a[var.l].tolist() for a in kb.ask(goal)] == [[1]], goal
+assert list(kb.ask(pred.ca(var.n))) == [{var.n: 1}]
+assert list(kb.ask(pred.once(pred.a(var.x) & cut | pred.b(var.y)))) == [{var.x: 1}]
+assert cut.barrier is None
+k = KBMan()
+k.color['apple', 'red']
+k.color['lemon', 'yellow']
+assert k.query.color.first('$f', 'yellow') == {var.f: 'lemon'}
+
+
+# print('========== structure sharing ==========')
+def tree(d):
+    return 'leaf' if d == 0 else TermCnpd('node', d, tree(d - 1), tree(d - 1))
+
+big = tree(12)
+assert big.ground and is_ground(pred.p(big, [1, 'a'])) and not is_ground(pred.p(big, var.x))
+assert subst(Env(), big) is big and univ_inst(big) is big and walk(Env(), big) is big
+t = TermCnpd('f', var.x, big)
+assert not t.ground and subst(Env(), t) is t
+t1 = subst(Env({var.x: 1}), t)
+assert t1 is not t and t1.terms[1] is big
+g = pred.p(var.x, 1)
+assert subst(Env(), g) is g and subst(Env({var.x: 2}), g).terms == (2, 1)
+assert not g.ground and g(3, 1).ground
+g = pred.p(1)
+s1 = g & pred.q(2)
+assert s1.ground and not (g & pred.q(var.x)).ground and not g(var.x).ground
+assert univ_inst(cut) is not cut
+kb = KB()
+kb.tell(pred.carry(0, scm.t, scm.t))
+kb.tell(pred.carry(scm.n, scm.t, scm.r) <= AssertFunc(op.gt, scm.n, 0) &
+        pred.carry(Func(op.sub, scm.n, 1), scm.t, scm.r))
+for ask in [kb.ask, Solver(kb).ask]:
+    assert list(ask(pred.carry(100, big, var.r)))[0][var.r] is big
@@ -0,0 +1,106 @@
+"""
+Bottom-up evaluation compared against top-down queries.
+"""
+
+import operator as op
+
+from pryo.pryo import *
+from pryo.datalog import Datalog
+
+
+def answers(q):
+    return sorted(set(repr(sorted(u.items(), key=repr)) for u in q))
+
+
+kb = KB()
+for i in range(30):
+    kb.tell(pred.father(i, i + 1))
+    kb.tell(pred.father(i, 'c{}'.format(i)))
+kb.tell(pred.ancester(scm.x, scm.y) <= pred.father(scm.x, scm.y))
+kb.tell(pred.ancester(scm.x, scm.y)
+        <= pred.father(scm.x, scm.z) & pred.ancester(scm.z, scm.y))
+kb.tell(pred.sibling(scm.x, scm.y)
+        <= pred.father(scm.z, scm.x) & pred.father(scm.z, scm.y) &
+        NotEq(scm.x, scm.y))
+kb.tell(pred.far(scm.x, scm.y)
+        <= pred.ancester(scm.x, scm.y) & pred.father(scm.y, scm.y1) &
+        Assert(Func(op.gt, Func(op.sub, scm.y, scm.x), 25)))
+kb.tell(pred.loop(scm.x) <= pred.father(scm.x, scm.x))
+# Unsupported rules are reported and left to top-down queries.
+kb.tell(pred.head(TermCnpd('Cons', scm.x, scm.xs), scm.x))
+kb.tell(pred.first(scm.x) <= pred.head(scm.x, 0) | pred.head(scm.x, 1))
+kb.tell(pred.later(scm.x) <= pred.first(scm.x))
+
+dl = Datalog(kb)
+assert {verb for verb in dl.excluded} == {'head', 'first', 'later'}
+assert [s.key for s, _ in dl.unsupported] == ['head', 'first']
+
+# print('========== ancester ==========')
+assert len(dl.rels['ancester']) == sum(2 * (30 - i) for i in range(30))
+for goal in [pred.ancester(var.x, 17),
+             pred.ancester(3, var.y),
+             pred.ancester(3, 'c20'),
+             pred.sibling(var.x, var.y),
+             pred.far(var.x, var.y),
+             pred.loop(var.x)]:
+    assert answers(dl.ask(goal)) == answers(kb.ask(goal)), goal
+assert answers(dl.ask(pred.far(var.x, var.x))) == []
+
+# Excluded predicates are asked top-down.
+c = TermCnpd('Cons', 1, None)
+assert list(dl.ask(pred.head(c, var.h))) == [{var.h: 1}]
+
+
+# print('========== maintenance ==========')
+def graph(edges):
+    kb = KB()
+    for a, b in edges:
+        kb.tell(pred.edge(a, b))
+    kb.tell(pred.path(scm.x, scm.y) <= pred.edge(scm.x, scm.y))
+    kb.tell(pred.path(scm.x, scm.y)
+            <= pred.path(scm.x, scm.z) & pred.edge(scm.z, scm.y))
+    kb.tell(pred.twin(scm.x, scm.y)
+            <= pred.path(scm.x, scm.y) & pred.path(scm.y, scm.x) &
+            NotEq(scm.x, scm.y))
+    return kb
+
+
+edges = [(i, i + 1) for i in range(20)] + [(5, 2), (10, 15), (20, 0)]
+kb = graph(edges)
+dl = Datalog(kb)
+assert dl in kb.watchers
+
+# Told facts only propagate their deltas.
+kb.tell(pred.edge(20, 21))
+kb.tell(pred.edge(21, 'x'))
+assert dl.rels == Datalog(graph(edges + [(20, 21), (21, 'x')])).rels
+
+# Told rules get evaluated and propagated as well.
+kb.tell(pred.reach(scm.x) <= pred.path(0, scm.x))
+assert (21,) in dl.rels['reach']
+
+# Retracted facts are deleted and rederived (DRed).
+kb.retract(pred.edge(20, 0))
+kb.retract(pred.edge(10, 15))
+expect = graph([e for e in edges if e not in [(20, 0), (10, 15)]] +
+               [(20, 21), (21, 'x')])
+expect.tell(pred.reach(scm.x) <= pred.path(0, scm.x))
+assert dl.rels == Datalog(expect).rels
+assert (5, 2) in dl.rels['path'] and (2, 5) in dl.rels['path']
+assert (20, 0) not in dl.rels['path']
+
+# Retracted rules likewise.
+kb.retract_all(pred.twin(var.x, var.y))
+assert dl.rels['twin'] == set()
+dl.detach()
+assert dl not in kb.watchers
+
+# Bulk loaded facts are read and propagated as well.
+kb = graph([])
+kb.load('edge', [(0, 1), (1, 2)])
+dl = Datalog(kb)
+assert dl.rels['path'] == {(0, 1), (1, 2), (0, 2)}
+kb.load('edge', [(2, 3)])
+assert (0, 3) in dl.rels['path']
+kb.retract(pred.edge(1, 2))
+assert dl.rels['path'] == {(0, 1), (2, 3)}
@@ -0,0 +1,188 @@
+"""
+Iterative solver compared against the generator engine.
+"""
+
+import operator as op
+
+from pryo.pryo import *
+from pryo.solver import Solver, PAUSE
+
+
+kb = KB()
+for a, b in [('opa', 'pap'), ('pap', 'a'), ('pap', 'b'), ('opa', 'ucl')]:
+    kb.tell(pred.father(a, b))
+kb.tell(pred.mother('mum', 'a'))
+kb.tell(pred.parent(scm.x, scm.y) <= pred.father(scm.x, scm.y) | pred.mother(scm.x, scm.y))
+kb.tell(pred.ancester(scm.x, scm.y) <= pred.parent(scm.x, scm.y))
+kb.tell(pred.ancester(scm.x, scm.y)
+        <= pred.parent(scm.x, scm.z) & pred.ancester(scm.z, scm.y))
+kb.tell(pred.sibling(scm.x, scm.y)
+        <= pred.father(scm.z, scm.x) & pred.father(scm.z, scm.y) &
+        NotEq(scm.x, scm.y))
+kb.tell(pred.married('pap', 'mum'))
+kb.tell(pred.single(scm.x) <= Not(pred.married(scm.x, scm.y)))
+kb.tell(pred.factorial(0, 1))
+kb.tell(pred.factorial(scm.x, scm.y)
+        <= AssertFunc(op.gt, scm.x, 0) &
+        pred.factorial(Func(op.sub, scm.x, 1), scm.y1) &
+        Eq(scm.y, Func(op.mul, scm.x, scm.y1)))
+
+s = Solver(kb)
+
+# print('========== parity ==========')
+for goal in [pred.ancester(var.x, var.y),
+             pred.ancester('opa', var.y),
+             pred.sibling(var.x, var.y),
+             pred.parent(var.x, 'a'),
+             pred.single('opa') & pred.single(var.x),
+             pred.father(var.x, var.y) & Not(pred.married(var.x, var.z)),
+             pred.factorial(6, var.w),
+             pred.father('opa', var.x) & Eq(var.x, 'ucl')]:
+    assert list(s.ask(goal)) == list(kb.ask(goal)), goal
+assert list(s.ask(pred.factorial(6, var.w))) == [{var.w: 720}]
+kb.planner = Planner(kb)
+for goal in [pred.sibling(var.x, var.y), pred.factorial(6, var.w)]:
+    assert list(s.ask(goal)) == list(kb.ask(goal)), goal
+kb.planner = None
+assert list(s.ask(pred.father('a', var.x))) == []
+
+# Tabled predicates are left to the tables.
+kb.tell(pred.path(scm.x, scm.y) <= pred.path(scm.x, scm.z) & pred.father(scm.z, scm.y))
+kb.tell(pred.path(scm.x, scm.y) <= pred.father(scm.x, scm.y))
+kb.table('path')
+lq = list(s.ask(pred.path('opa', var.y)))
+assert sorted(u[var.y] for u in lq) == ['a', 'b', 'pap', 'ucl']
+
+
+# print('========== deep recursion ==========')
+Cons = lambda car, cdr: TermCnpd('Cons', car, cdr)
+kb.tell(pred.append(None, scm.ys, scm.ys))
+kb.tell(pred.append(Cons(scm.x, scm.xs), scm.ys, Cons(scm.x, scm.zs))
+        <= pred.append(scm.xs, scm.ys, scm.zs))
+kb.tell(pred.nums(0, None))
+kb.tell(pred.nums(scm.n, Cons(scm.n, scm.t))
+        <= AssertFunc(op.gt, scm.n, 0) &
+        pred.nums(Func(op.sub, scm.n, 1), scm.t))
+kb.tell(pred.length(None, 0))
+kb.tell(pred.length(Cons(scm.x, scm.t), scm.n)
+        <= pred.length(scm.t, scm.m) & Eq(scm.n, Func(op.add, scm.m, 1)))
+
+n = 5000
+lq = list(s.ask(pred.nums(n, var.l) &
+                pred.append(var.l, Cons('z', None), var.r) &
+                pred.length(var.r, var.n)))
+assert len(lq) == 1
+assert lq[0][var.n] == n + 1
+r = lq[0][var.r]
+for i in reversed(range(1, n + 1)):
+    assert r.terms[0] == i
+    r = r.terms[1]
+assert r.terms == ('z', None)
+
+f = list(s.ask(pred.factorial(2000, var.w)))[0][var.w]
+assert f % 10 ** 20 == 0 and f // 1999 % 2000 == 0
+
+# Deterministic recursion only leaves the base case choice point behind.
+q = s.query(pred.nums(n, var.l) & pred.length(var.l, var.n))
+assert q.next()[var.n] == n
+assert len(q.choices) <= 1
+
+
+# print('========== stepping ==========')
+q = s.query(pred.factorial(30, var.w))
+steps = 0
+ans = q.next(budget=10)
+while ans is PAUSE:
+    steps += 1
+    ans = q.next(budget=10)
+assert steps > 5 and ans[var.w] == list(kb.ask(pred.factorial(30, var.w)))[0][var.w]
+assert q.next() is None and q.next() is None
+
+# Abandoning a query closes what is left of it.
+q = s.query(pred.path(var.x, var.y) & pred.father(var.y, var.z))
+assert q.next() is not None
+q.close()
+assert q.next() is None and not q.choices
+assert not kb.table_stack
+
+
+# print('========== asyncio ==========')
+import asyncio
+
+from pryo.pryo import KBMan
+from pryo.solver import aask
+
+k = KBMan()
+for i in range(60):
+    k.edge[i, i + 1]
+k.path[scm.x, scm.y] = k.edge(scm.x, scm.y)
+k.path[scm.x, scm.y] = [k.edge(scm.x, scm.z), k.path(scm.z, scm.y)]
+k.loop[scm.x] = k.loop(scm.x)
+for i in range(100):
+    k.digit[i]
+k.no_triple[scm.x] = Not(k.digit(scm.x) & k.digit(scm.y) & k.digit(scm.z) &
+                         Eq(scm.z, -1))
+
+
+async def collect(tag, q, log):
+    n = 0
+    async for u in q:
+        log.append(tag)
+        n += 1
+    return n
+
+
+async def main():
+    log = []
+    # Concurrent queries take turns on the loop.
+    counts = await asyncio.gather(
+        collect('a', k.aquery.path(0, '$y', steps=50), log),
+        collect('b', k.aquery.path('$x', 60, steps=50), log))
+    assert counts == [60, 60]
+    assert log != sorted(log)
+    assert [u async for u in aask(k.kb, pred.path(58, var.y))] == [
+        {var.y: 59}, {var.y: 60}]
+    # Deadlines
+    try:
+        async for u in k.aquery.loop(1, timeout=0.05):
+            pass
+        assert False
+    except asyncio.TimeoutError:
+        pass
+    # Goals run by the generator engine check the deadline as well.
+    try:
+        async for u in k.aquery.no_triple(1, timeout=0.05):
+            pass
+        assert False
+    except asyncio.TimeoutError:
+        pass
+    try:
+        async for u in k.aquery.loop(1, limits=Limits(inferences=100)):
+            pass
+        assert False
+    except ResourceError as e:
+        assert e.limit == 'inferences'
+    # Cancellation
+    task = asyncio.ensure_future(collect('c', k.aquery.loop(1), log))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    try:
+        await task
+        assert False
+    except asyncio.CancelledError:
+        pass
+
+asyncio.run(main())
+
+
+# print('========== determinism ==========')
+# No choice point is left when no other candidate clause can match.
+for a, b in [('a', 1), ('a', 2), ('b', 1)]:
+    kb.tell(pred.f(a, b))
+kb.tell(pred.g('a', 1, scm.x) <= Eq(scm.x, 'one'))
+kb.tell(pred.g('a', 2, scm.x) <= Eq(scm.x, 'two'))
+for goal in [pred.f('a', 1), pred.f('a', 2), pred.g('a', 1, var.x), pred.g('a', 2, var.x)]:
+    q = s.query(goal)
+    assert q.next() is not None and not q.choices, goal
+q = s.query(pred.f('a', var.y))
+assert q.next() == {var.y: 1} and len(q.choices) == 1